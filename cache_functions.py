@@ -0,0 +1,283 @@
+"""
+this file contains functions to cache the results of slow calculations on disk, so that scripts and
+notebooks that rerun the same design parameters do not recompute them.
+
+Results are stored as .npz files named after a hash of:
+  - the contents of config.yaml
+  - the module, name and source code of the function (editing the function invalidates its results)
+  - the contents of the files the function depends on (depends_on)
+  - the arguments of the call, including the contents of numpy arrays
+When the cache directory grows beyond its maximum size, the least recently used results are deleted.
+
+Environment variables:
+  READOUT_CACHE_DIR : cache directory, defaults to .readout_cache in the repository root
+  READOUT_CACHE_MAX_MB : maximum size of the cache directory in MB, defaults to 1000
+  READOUT_CACHE_DISABLE : set to 1 to always recompute
+"""
+
+import os
+import hashlib
+import inspect
+import tempfile
+import functools
+import numpy as np
+from scipy import sparse
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.path.join(REPO_ROOT, 'config.yaml')
+
+# cache directory -> size of its results [bytes], scanned once per process and then updated by each write.
+# Writes of other processes are only seen at the next scan (when this process evicts)
+_cache_sizes = {}
+
+
+def get_cache_dir():
+    return os.environ.get('READOUT_CACHE_DIR', os.path.join(REPO_ROOT, '.readout_cache'))
+
+
+def get_max_cache_size():
+    """Maximum size of the cache directory in bytes"""
+    return float(os.environ.get('READOUT_CACHE_MAX_MB', 1000)) * 1e6
+
+
+def cache_disabled():
+    return os.environ.get('READOUT_CACHE_DISABLE', '0').lower() not in ('', '0', 'false', 'no')
+
+
+def _update_hash(h, value):
+    # feed a value into the hash, the type is included so that e.g. 1 and 1.0 or [1] and (1,) differ
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        h.update("ndarray:{}:{}:".format(value.dtype.str, value.shape).encode())
+        h.update(value.tobytes())
+    elif sparse.issparse(value):
+        value = sparse.csr_matrix(value)
+        h.update("csr:{}:".format(value.shape).encode())
+        for array in (value.data, value.indices, value.indptr):
+            _update_hash(h, array)
+    elif value is None or isinstance(value, (bool, int, float, complex, str, bytes, np.generic)):
+        h.update("{}:{!r}:".format(type(value).__name__, value).encode())
+    elif isinstance(value, (list, tuple)):
+        h.update("{}:{}:".format(type(value).__name__, len(value)).encode())
+        for item in value:
+            _update_hash(h, item)
+    elif isinstance(value, dict):
+        h.update("dict:{}:".format(len(value)).encode())
+        for key in sorted(value, key=repr):
+            _update_hash(h, key)
+            _update_hash(h, value[key])
+    else:
+        raise TypeError("cannot hash argument of type {}".format(type(value).__name__))
+
+
+def hash_file(filename:str):
+    """Function to hash the contents of a file, returns '' if the file does not exist"""
+    if filename is None or not os.path.exists(filename):
+        return ''
+    with open(filename, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def get_function_identity(func):
+    """Function to get a string that changes whenever the module, name or source code of func changes"""
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = func.__code__.co_code.hex()
+    return "{}.{}:{}".format(func.__module__, func.__qualname__, hashlib.sha256(source.encode()).hexdigest())
+
+
+def get_cache_key(func, args:tuple, kwargs:dict, config_file:str=CONFIG_FILE, depends_on=()):
+    """Function to calculate the cache key of a call of func
+
+    The arguments are bound to the signature of func with the defaults applied, so f(x) and
+    f(x, default_value) have the same key.
+
+    Args:
+        func (callable): the function
+        args (tuple): positional arguments of the call
+        kwargs (dict): keyword arguments of the call
+        config_file (str, optional): configuration file whose contents are part of the key
+        depends_on (list, optional): other files whose contents are part of the key, e.g. the modules
+            with the functions that func calls
+
+    Returns:
+        key (str): hex digest
+    """
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    h = hashlib.sha256()
+    h.update(hash_file(config_file).encode())
+    for filename in depends_on:
+        h.update(hash_file(filename).encode())
+    h.update(get_function_identity(func).encode())
+    _update_hash(h, dict(bound.arguments))
+    return h.hexdigest()
+
+
+def _result_to_arrays(result):
+    # flatten a result into a dict of arrays for np.savez, None if the type is not supported
+    if isinstance(result, (np.ndarray, np.generic, float, int, complex)):
+        return {'kind' : np.array('array'), 'result' : np.asarray(result)}
+    if sparse.issparse(result):
+        result = sparse.csr_matrix(result)
+        return {'kind' : np.array('csr'), 'data' : result.data, 'indices' : result.indices,
+                'indptr' : result.indptr, 'shape' : np.array(result.shape)}
+    if isinstance(result, tuple) and all(isinstance(item, (np.ndarray, np.generic, float, int, complex)) for item in result):
+        arrays = {'item_{}'.format(i) : np.asarray(item) for i, item in enumerate(result)}
+        return {'kind' : np.array('tuple'), 'length' : np.array(len(result)), **arrays}
+    if isinstance(result, dict) and all(isinstance(key, str) for key in result) \
+            and all(isinstance(item, (np.ndarray, np.generic, float, int, complex)) for item in result.values()):
+        arrays = {'value_{}'.format(i) : np.asarray(item) for i, item in enumerate(result.values())}
+        return {'kind' : np.array('dict'), 'keys' : np.array(list(result), dtype=str), **arrays}
+    return None
+
+
+def _arrays_to_result(arrays):
+    # inverse of _result_to_arrays
+    kind = str(arrays['kind'])
+    if kind == 'array':
+        result = arrays['result']
+        return result[()] if result.ndim == 0 else result
+    if kind == 'csr':
+        return sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(arrays['shape']))
+    if kind == 'tuple':
+        return tuple(arrays['item_{}'.format(i)] for i in range(int(arrays['length'])))
+    if kind == 'dict':
+        return {str(key) : arrays['value_{}'.format(i)] for i, key in enumerate(arrays['keys'])}
+    raise ValueError("unknown kind of cached result '{}'".format(kind))
+
+
+def load_result(key:str):
+    """Function to load a cached result
+
+    Returns:
+        found (bool): False if there is no (readable) result for this key
+        result: the cached result, None if not found
+    """
+    filename = os.path.join(get_cache_dir(), key + '.npz')
+    try:
+        with np.load(filename, allow_pickle=False) as data:
+            result = _arrays_to_result({name : data[name] for name in data.files})
+    except (OSError, ValueError, KeyError):
+        return False, None
+    try:
+        os.utime(filename) # mark as recently used
+    except OSError:
+        pass
+    return True, result
+
+
+def save_result(key:str, result):
+    """Function to store a result in the cache, then evict the least recently used results if
+    the write made the cache too large. The file is written to a temporary name and renamed, so other
+    processes never see half-written results.
+
+    Returns:
+        saved (bool): False if the type of result cannot be cached
+    """
+    arrays = _result_to_arrays(result)
+    if arrays is None:
+        return False
+    cache_dir = get_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    filename = os.path.join(cache_dir, key + '.npz')
+    handle, temporary_name = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            np.savez(file, **arrays)
+        size = os.path.getsize(temporary_name)
+        replaced_size = os.path.getsize(filename) if os.path.exists(filename) else 0
+        os.replace(temporary_name, filename)
+    except BaseException:
+        if os.path.exists(temporary_name):
+            os.remove(temporary_name)
+        raise
+    if cache_dir in _cache_sizes:
+        _cache_sizes[cache_dir] += size - replaced_size
+    else:
+        _cache_sizes[cache_dir] = get_cache_size()
+    if _cache_sizes[cache_dir] > get_max_cache_size():
+        evict(get_max_cache_size())
+    return True
+
+
+def _scan_cache():
+    # (last use, size, path) of every result in the cache directory
+    entries = []
+    for entry in os.scandir(get_cache_dir()):
+        if entry.name.endswith('.npz'):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue # removed by another process
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+
+def get_cache_size():
+    """Size of the results in the cache directory [bytes]"""
+    if not os.path.isdir(get_cache_dir()):
+        return 0
+    return sum(size for _, size, _ in _scan_cache())
+
+
+def evict(max_size:float):
+    """Function to delete the least recently used results until the cache is smaller than max_size [bytes]"""
+    if not os.path.isdir(get_cache_dir()):
+        return
+    entries = _scan_cache()
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total_size -= size
+    _cache_sizes[get_cache_dir()] = total_size
+
+
+def clear_cache():
+    """Function to delete all cached results"""
+    evict(0)
+
+
+def cached(config_file:str=CONFIG_FILE, depends_on=()):
+    """Decorator to cache the results of a function on disk
+
+    The function has to be deterministic, take arguments made of numbers, strings, numpy arrays,
+    sparse matrices, lists, tuples and dicts, and return an array, a sparse matrix, or a tuple or dict
+    of arrays. Calls with other arguments or results are computed without the cache.
+
+    Args:
+        config_file (str, optional): configuration file whose contents are part of the key.
+            Defaults to config.yaml in the repository root, None for functions that do not depend on it.
+        depends_on (list, optional): other files whose contents are part of the key. Only the source
+            of the function itself is hashed, so list the modules of the functions it calls.
+
+    Example:
+        @cached()
+        def slow_function(x, y):
+            ...
+        slow_function.uncached(x, y) # always recompute
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if cache_disabled():
+                return func(*args, **kwargs)
+            try:
+                key = get_cache_key(func, args, kwargs, config_file, depends_on)
+            except TypeError:
+                return func(*args, **kwargs)
+            found, result = load_result(key)
+            if found:
+                return result
+            result = func(*args, **kwargs)
+            save_result(key, result)
+            return result
+        wrapper.uncached = func
+        return wrapper
+    return decorator
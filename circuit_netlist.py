@@ -0,0 +1,364 @@
+"""
+this file contains a small netlist model of the readout circuits, so that the comb (TES, resonators,
+stray impedances, bias element, parasitic capacitance and resistance, wiring) is described once
+as a graph instead of writing the impedances by hand in each script.
+
+A Netlist is a list of two-terminal elements (branches) between named nodes, 'gnd' is the reference.
+Netlist.compile() gives a CompiledNetlist that evaluates all the branches of the same kind in one
+numpy expression and solves the nodal equations Y V = I for all frequencies and parameter sets at once.
+Arrays have the shape (*batch, number of frequencies, ...) where batch is the broadcast shape of the
+parameters.
+
+Element values are numbers, arrays (batch of circuits) or names of parameters given at evaluation,
+e.g. netlist.add_resistor('tes 0', 'comb', 'leg 0', 'R_tes') and compiled.impedance(f, 'comb', R_tes=R_array).
+"""
+
+import numpy as np
+pi = np.pi
+
+GROUND = 'gnd'
+
+# admittance of each kind of element, values in the order of ELEMENT_VALUES
+ELEMENT_VALUES = {
+    'R' : ('R',),
+    'L' : ('L',),
+    'C' : ('C',),
+    'RLC' : ('R', 'L', 'C'),
+}
+
+
+def _admittance(kind:str, omega, values:list):
+    if kind == 'R':
+        return 1. / values[0] + 0j * omega
+    if kind == 'L':
+        return -1j / (omega * values[0])
+    if kind == 'C':
+        return 1j * omega * values[0]
+    if kind == 'RLC':
+        R, L, C = values
+        # reactance in real arithmetic, so that C=inf gives no capacitor
+        return 1. / (R + 1j * (omega * L - 1. / (omega * C)))
+    raise ValueError("unknown element kind '{}'".format(kind))
+
+
+class Netlist:
+    """Circuit as a list of two-terminal elements between named nodes"""
+    def __init__(self):
+        self.node_names = [] # without the ground node
+        self.node_index = {}
+        self.branch_names = []
+        self.branch_index = {}
+        self.branch_nodes = [] # (node a, node b)
+        self.branch_kind = []
+        self.branch_values = [] # tuple of values, or the impedance function of 'Z' elements
+
+    def _node(self, name:str):
+        # index of a node, created the first time it is used, -1 for the ground
+        if name == GROUND:
+            return -1
+        if name not in self.node_index:
+            self.node_index[name] = len(self.node_names)
+            self.node_names.append(name)
+        return self.node_index[name]
+
+    def add_alias(self, node:str, alias:str):
+        """Function to give a node a second name, i.e. to connect two nodes with a short"""
+        if alias in self.node_index or alias == GROUND:
+            raise ValueError("node '{}' already exists".format(alias))
+        if node == GROUND:
+            raise ValueError("the ground has no aliases, leave out the nodes shorted to it")
+        self.node_index[alias] = self._node(node)
+
+    def add_element(self, name:str, kind:str, node_a:str, node_b:str, values):
+        """Function to add an element between node_a and node_b
+
+        Args:
+            name (str): name of the branch
+            kind (str): 'R', 'L', 'C', 'RLC' (series) or 'Z' (impedance function)
+            node_a (str): first node, the current of the branch flows from node_a to node_b
+            node_b (str): second node
+            values (tuple or callable): values of the element in the order of ELEMENT_VALUES[kind], each a number,
+                an array or the name of a parameter; for 'Z', a function of jomega (and of the parameters
+                as keyword arguments) returning the impedance
+        """
+        if name in self.branch_index:
+            raise ValueError("branch '{}' already exists".format(name))
+        if kind != 'Z' and kind not in ELEMENT_VALUES:
+            raise ValueError("unknown element kind '{}', options are {}".format(kind, list(ELEMENT_VALUES) + ['Z']))
+        if node_a == node_b:
+            raise ValueError("branch '{}' connects node '{}' to itself".format(name, node_a))
+        self.branch_index[name] = len(self.branch_names)
+        self.branch_names.append(name)
+        self.branch_nodes.append((self._node(node_a), self._node(node_b)))
+        self.branch_kind.append(kind)
+        self.branch_values.append(values)
+
+    def add_resistor(self, name:str, node_a:str, node_b:str, R):
+        self.add_element(name, 'R', node_a, node_b, (R,))
+
+    def add_inductor(self, name:str, node_a:str, node_b:str, L):
+        self.add_element(name, 'L', node_a, node_b, (L,))
+
+    def add_capacitor(self, name:str, node_a:str, node_b:str, C):
+        self.add_element(name, 'C', node_a, node_b, (C,))
+
+    def add_series_RLC(self, name:str, node_a:str, node_b:str, R=0., L=0., C=np.inf):
+        """Resistor, inductor and capacitor in series as one branch (C=inf for no capacitor)"""
+        self.add_element(name, 'RLC', node_a, node_b, (R, L, C))
+
+    def add_impedance(self, name:str, node_a:str, node_b:str, function):
+        """Branch with any impedance, function(jomega, **parameters) has to broadcast like numpy"""
+        self.add_element(name, 'Z', node_a, node_b, function)
+
+    def compile(self):
+        return CompiledNetlist(self)
+
+
+class CompiledNetlist:
+    """
+    Vectorized evaluator of a Netlist. The incidence matrix A (nodes x branches, +1 at node_a and -1
+    at node_b) and the branches of each kind are fixed here, so every evaluation is a few numpy
+    expressions and one batched linear solve.
+    """
+    def __init__(self, netlist:Netlist):
+        self.node_names = list(netlist.node_names)
+        self.node_index = dict(netlist.node_index)
+        self.branch_names = list(netlist.branch_names)
+        self.branch_index = dict(netlist.branch_index)
+        self.n_nodes = len(self.node_names)
+        self.n_branches = len(self.branch_names)
+
+        self.incidence = np.zeros((self.n_nodes, self.n_branches))
+        for branch, (a, b) in enumerate(netlist.branch_nodes):
+            if a >= 0:
+                self.incidence[a, branch] = 1.
+            if b >= 0:
+                self.incidence[b, branch] = -1.
+
+        # branches grouped by kind, evaluated together
+        self.groups = []
+        for kind in ELEMENT_VALUES:
+            branches = [i for i, known in enumerate(netlist.branch_kind) if known == kind]
+            if branches:
+                values = [[netlist.branch_values[i][k] for i in branches] for k in range(len(ELEMENT_VALUES[kind]))]
+                self.groups.append((kind, np.array(branches), values))
+        self.impedance_functions = [(i, netlist.branch_values[i]) for i, kind in enumerate(netlist.branch_kind) if kind == 'Z']
+
+    def _branch_index(self, branch):
+        return self.branch_index[branch] if isinstance(branch, str) else branch
+
+    def branch_admittances(self, freqs, **parameters):
+        """Admittance of every branch [S], shape (*batch, number of frequencies, number of branches)"""
+        omega = 2 * pi * np.atleast_1d(np.asarray(freqs, dtype=float))
+        jomega = 1j * omega
+        blocks = []
+        for kind, branches, values in self.groups:
+            # values of each branch of this kind, with the batch axes in front and the branch axis last
+            resolved = [np.stack(np.broadcast_arrays(*[np.asarray(parameters[value] if isinstance(value, str) else value, dtype=float)
+                                                       for value in value_list]), axis=-1)
+                        for value_list in values]
+            y = _admittance(kind, omega[:, np.newaxis], [value[..., np.newaxis, :] for value in resolved])
+            blocks.append((branches, y))
+        for branch, function in self.impedance_functions:
+            blocks.append(([branch], (1. / function(jomega, **parameters))[..., np.newaxis]))
+
+        shape = np.broadcast_shapes(*[y.shape[:-1] for _, y in blocks])
+        Y = np.zeros(shape + (self.n_branches,), dtype=complex)
+        for branches, y in blocks:
+            Y[..., branches] = y
+        return Y
+
+    def admittance_matrix(self, branch_admittances:np.ndarray):
+        """Nodal admittance matrix A diag(y) A^T, shape (*batch, number of frequencies, n_nodes, n_nodes)"""
+        return (self.incidence * branch_admittances[..., np.newaxis, :]) @ self.incidence.T
+
+    def _evaluate(self, freqs, parameters):
+        # branch admittances and the inverse of the nodal admittance matrix
+        with np.errstate(divide='ignore'):
+            y = self.branch_admittances(freqs, **parameters)
+        shorted = ~np.all(np.isfinite(y), axis=tuple(range(y.ndim - 1)))
+        if np.any(shorted):
+            raise ValueError("branches {} have zero impedance, connect their nodes directly instead".format(
+                [self.branch_names[i] for i in np.flatnonzero(shorted)]))
+        G = np.linalg.inv(self.admittance_matrix(y))
+        return y, G
+
+    def solve(self, freqs, currents:dict=None, emfs:dict=None, **parameters):
+        """Function to solve the circuit driven by current sources and voltage sources
+
+        Args:
+            freqs (np.ndarray): frequencies [Hz]
+            currents (dict, optional): node name -> current injected into the node [A]
+            emfs (dict, optional): branch name -> EMF in series with the branch [V], raising the
+                potential from its node_a to its node_b
+            **parameters: values of the named parameters
+
+        Returns:
+            V (np.ndarray): node voltages [V], shape (*batch, number of frequencies, n_nodes)
+            i (np.ndarray): branch currents from node_a to node_b [A], shape (*batch, number of frequencies, n_branches)
+        """
+        y, G = self._evaluate(freqs, parameters)
+        return self._solve(y, G, currents, emfs)
+
+    def _solve(self, y, G, currents, emfs):
+        e = np.zeros(y.shape, dtype=complex)
+        for branch, emf in (emfs or {}).items():
+            e[..., self.branch_index[branch]] = emf
+        # EMFs become the equivalent current sources -y e (at node_a) and +y e (at node_b)
+        I = -(self.incidence @ (y * e)[..., np.newaxis])[..., 0]
+        for node, current in (currents or {}).items():
+            I[..., self.node_index[node]] += current
+        V = (G @ I[..., np.newaxis])[..., 0]
+        i = y * ((V @ self.incidence) + e)
+        return V, i
+
+    def impedance(self, freqs, node_a:str, node_b:str=GROUND, **parameters):
+        """Impedance between two nodes [Ohm], shape (*batch, number of frequencies)"""
+        _, G = self._evaluate(freqs, parameters)
+        u = np.zeros(self.n_nodes)
+        if node_a != GROUND:
+            u[self.node_index[node_a]] += 1.
+        if node_b != GROUND:
+            u[self.node_index[node_b]] -= 1.
+        return np.einsum('n,...nm,m->...', u, G, u)
+
+    def thevenin_impedance(self, freqs, branches=None, seen_by_resistance:bool=False, **parameters):
+        """Thévenin-equivalent impedance seen by branches, i.e. the impedance between their nodes
+        with the branch itself removed, all from one inverse of the nodal admittance matrix
+
+        Args:
+            freqs (np.ndarray): frequencies [Hz]
+            branches (list, optional): names or indices of the branches. Defaults to all of them.
+            seen_by_resistance (bool, optional): add the reactance of the branch itself, i.e. the impedance
+                seen by the resistance of a series RLC branch (the TES of a comb leg). Defaults to False.
+            **parameters: values of the named parameters
+
+        Returns:
+            Z_thev (np.ndarray): shape (*batch, number of frequencies, number of branches)
+        """
+        branches = np.arange(self.n_branches) if branches is None else np.array([self._branch_index(b) for b in branches])
+        y, G = self._evaluate(freqs, parameters)
+        A = self.incidence[:, branches]
+        Z_terminals = np.einsum('nb,...nm,mb->...b', A, G, A) # with the branch
+        with np.errstate(divide='ignore'):
+            Z_thev = 1. / (1. / Z_terminals - y[..., branches])
+            if seen_by_resistance:
+                Z_thev = Z_thev + 1j * np.imag(1. / y[..., branches])
+        return Z_thev
+
+    def transfer_matrix(self, freqs, branches=None, **parameters):
+        """Current in each branch per unit EMF in series with each branch, e.g. the transfer functions of
+        voltage noise sources: T = diag(y) (1 - A^T G A diag(y))
+
+        Args:
+            freqs (np.ndarray): frequencies [Hz]
+            branches (list, optional): names or indices of the branches (rows and columns). Defaults to all of them.
+            **parameters: values of the named parameters
+
+        Returns:
+            T (np.ndarray): T[..., k, s] = current in branch k per volt in branch s [S],
+                shape (*batch, number of frequencies, number of branches, number of branches)
+        """
+        branches = np.arange(self.n_branches) if branches is None else np.array([self._branch_index(b) for b in branches])
+        y, G = self._evaluate(freqs, parameters)
+        return self._transfer(y, G, branches)
+
+    def _transfer(self, y, G, branches):
+        y = y[..., branches]
+        A = self.incidence[:, branches]
+        M = A.T @ G @ A
+        return y[..., :, np.newaxis] * (np.eye(len(branches)) - M * y[..., np.newaxis, :])
+
+    def resistance_sensitivity(self, freqs, currents:dict=None, emfs:dict=None, outputs=None, resistors=None, **parameters):
+        """Derivative of the current in the output branches with respect to the resistance of resistor branches,
+        d i_k / d R_j = -T[k, j] i_j (a change dR_j acts as an EMF -i_j dR_j in series with branch j),
+        e.g. the responsivity of the readout to each TES and the crosstalk between them
+
+        Args:
+            freqs (np.ndarray): frequencies [Hz]
+            currents, emfs: sources, see solve
+            outputs (list, optional): names of the output branches. Defaults to all branches.
+            resistors (list, optional): names of the branches whose resistance changes (resistors or series RLC).
+                Defaults to all branches.
+            **parameters: values of the named parameters
+
+        Returns:
+            di_dR (np.ndarray): [A/Ohm], shape (*batch, number of frequencies, number of outputs, number of resistors)
+        """
+        y, G = self._evaluate(freqs, parameters)
+        _, i = self._solve(y, G, currents, emfs)
+        outputs = np.arange(self.n_branches) if outputs is None else np.array([self._branch_index(b) for b in outputs])
+        resistors = np.arange(self.n_branches) if resistors is None else np.array([self._branch_index(b) for b in resistors])
+        branches = np.union1d(outputs, resistors)
+        T = self._transfer(y, G, branches)
+        position = {branch : k for k, branch in enumerate(branches)}
+        T = T[..., [position[k] for k in outputs], :][..., [position[j] for j in resistors]]
+        return -T * i[..., np.newaxis, resistors]
+
+
+def _is_zero(*values):
+    # element values that are known to be zero when the netlist is built, parameter names never are
+    return all(not isinstance(value, str) and np.all(np.asarray(value) == 0) for value in values)
+
+
+def build_comb_netlist(L, C, R, Rs=0.005, Ls=30e-9, Rbias=0., Lbias=5e-9, Cpar=0., Rpar=np.inf, wiring=None):
+    """Function to build the netlist of a comb of LCR resonators, with the same topology as bolocomb:
+    the bias current is injected into the node 'bias', the bias element goes from 'bias' to ground,
+    the stray series impedance from 'bias' to 'comb', and the legs, Cpar and Rpar from 'comb' to ground.
+    A bias element or stray impedance that is zero is a short and is left out: with Rs=Ls=0 'bias' and 'comb'
+    are two names of the same node, with Rbias=Lbias=0 there is no node 'bias' (it is the ground, an ideal
+    voltage bias). Leg j is the series RLC branch 'leg j' (TES and resonator), use seen_by_resistance=True in
+    thevenin_impedance for the impedance seen by the TES.
+
+    Args:
+        L (float or str): inductance of the resonators [H]
+        C (np.ndarray): capacitance of each leg [F], numbers or parameter names
+        R (np.ndarray or str): resistance of each TES [Ohm], numbers or parameter names
+        Rs, Ls (float or str, optional): stray series resistance [Ohm] and inductance [H]. Default to the
+            values of bolocomb, 0.005 Ohm and 30 nH.
+        Rbias, Lbias (float or str, optional): bias resistance [Ohm] and inductance [H]. Default to the
+            values of bolocomb, 0 Ohm and 5 nH.
+        Cpar, Rpar (float or str, optional): parasitic capacitance [F] and resistance [Ohm] parallel to the comb
+        wiring (callable, optional): impedance function of the wiring harness, added in series with the stray impedance
+
+    Returns:
+        netlist (Netlist)
+    """
+    netlist = Netlist()
+    n_legs = len(C)
+    R = [R] * n_legs if isinstance(R, str) or np.ndim(R) == 0 else R
+    bias = GROUND if _is_zero(Rbias, Lbias) else 'bias'
+    if bias != GROUND:
+        netlist.add_series_RLC('bias element', bias, GROUND, Rbias, Lbias)
+    stray_end = 'comb' if wiring is None else 'wiring'
+    if not _is_zero(Rs, Ls):
+        netlist.add_series_RLC('stray', bias, stray_end, Rs, Ls)
+    elif bias != GROUND:
+        netlist.add_alias(bias, stray_end)
+    else:
+        stray_end = GROUND
+    if wiring is not None:
+        netlist.add_impedance('wiring', stray_end, 'comb', wiring)
+    elif stray_end == GROUND:
+        raise ValueError("the comb is shorted to ground, give a non-zero bias element (Rbias, Lbias) or stray impedance (Rs, Ls)")
+    netlist.add_capacitor('Cpar', 'comb', GROUND, Cpar)
+    netlist.add_resistor('Rpar', 'comb', GROUND, Rpar)
+    for j in range(n_legs):
+        netlist.add_series_RLC('leg {}'.format(j), 'comb', GROUND, R[j], L, C[j])
+    return netlist
+
+
+def local_main():
+    # comb of 40 legs, Thévenin impedance seen by each TES at its series resonance
+    L = 60e-6
+    f_bias = np.linspace(1.5e6, 5.5e6, 40)
+    C = 1 / ((2*pi*f_bias)**2 * L)
+    comb = build_comb_netlist(L, C, 'R_tes', Cpar=1500e-12, Rpar=20.).compile()
+    legs = ['leg {}'.format(j) for j in range(len(C))]
+    R_tes = np.array([0.7, 1.0]) # batch of two operating resistances
+    Z_thev = comb.thevenin_impedance(f_bias, legs, seen_by_resistance=True, R_tes=R_tes)
+    print("Re(Z_thev) at the bias frequencies [mOhm]:", np.round(np.real(np.diagonal(Z_thev, axis1=-2, axis2=-1))*1e3, 2))
+
+
+if __name__ == "__main__":
+    local_main()
@@ -10,11 +10,11 @@ pi = np.pi
 # Resonant Frequency Stuff
 # ---------------------------------------------------------
 
-def find_resonant_freq(Z_array:np.complex, freq_array:np.ndarray, show_plot:bool=False):
+def find_resonant_freq(Z_array:complex, freq_array:np.ndarray, show_plot:bool=False):
     """Function to find the resonant frequency given an array of impedances and corresponding frequencies
 
     Args:
-        Z (np.complex): array of impedances
+        Z (complex): array of impedances
         freq_array (ndarray):array of frequencies
         show_plot(bool) : show a plot of frequency vs Z
     Returns:
@@ -35,6 +35,84 @@ def find_resonant_freq(Z_array:np.complex, freq_array:np.ndarray, show_plot:bool
     return f_res
 
 
+def find_resonant_freq_batch(Z_function, f_min, f_max, args:tuple=(), n_coarse:int=1000, xtol:float=1e-3):
+    """Function to find the resonant frequencies (minimum of |Z|) of many circuits at once, with a precision
+    that is not limited by a frequency grid
+
+    A coarse scan on a logarithmic grid between f_min and f_max brackets the minimum of each circuit, then
+    golden-section iterations shrink all the brackets together until they are smaller than xtol.
+
+    Args:
+        Z_function (callable): Z_function(freqs, *args) returns the impedance at frequencies freqs [Hz],
+            it has to broadcast like numpy (freqs and args get an extra last axis)
+        f_min (float or np.ndarray): lower edge of the search range of each circuit [Hz]
+        f_max (float or np.ndarray): upper edge of the search range of each circuit [Hz]
+        args (tuple, optional): circuit element values, arrays of the same shape (or broadcastable)
+        n_coarse (int, optional): number of frequencies of the coarse scan. Defaults to 1000.
+        xtol (float, optional): absolute precision of the resonant frequencies [Hz]. Defaults to 1e-3.
+
+    Returns:
+        f_res (np.ndarray): resonant frequency of each circuit [Hz], shape of the broadcast arguments
+    """
+    args = np.broadcast_arrays(np.asarray(f_min, dtype=float), np.asarray(f_max, dtype=float), *[np.asarray(arg) for arg in args])
+    shape = args[0].shape
+    f_min, f_max = args[0].reshape(-1, 1), args[1].reshape(-1, 1)
+    element_values = [arg.reshape(-1, 1) for arg in args[2:]]
+    rows = np.arange(len(f_min))
+
+    def Z_abs(freqs):
+        return np.abs(Z_function(freqs, *element_values))
+
+    # coarse scan, the minimum is between the neighbours of the smallest sample
+    freqs = f_min * (f_max/f_min)**np.linspace(0, 1, n_coarse)
+    index = np.argmin(Z_abs(freqs), axis=1)
+    a = freqs[rows, np.maximum(index - 1, 0)]
+    b = freqs[rows, np.minimum(index + 1, n_coarse - 1)]
+
+    # golden-section search, one evaluation of Z per iteration for all the circuits
+    ratio = (np.sqrt(5) - 1) / 2
+    x1 = b - ratio * (b - a)
+    x2 = a + ratio * (b - a)
+    Z1 = Z_abs(x1[:, None])[:, 0]
+    Z2 = Z_abs(x2[:, None])[:, 0]
+    while np.max(b - a) > xtol:
+        left = Z1 < Z2 # the minimum is in [a, x2]
+        b = np.where(left, x2, b)
+        a = np.where(left, a, x1)
+        x_new = np.where(left, b - ratio * (b - a), a + ratio * (b - a))
+        Z_new = Z_abs(x_new[:, None])[:, 0]
+        x1, x2 = np.where(left, x_new, x2), np.where(left, x1, x_new)
+        Z1, Z2 = np.where(left, Z_new, Z2), np.where(left, Z1, Z_new)
+
+    return ((a + b) / 2).reshape(shape)
+
+
+def Z_series_RLC(freqs, L, C, R=0., C_parallel=0.):
+    """Impedance of a series RLC resonator, optionally shunted by a parasitic capacitance C_parallel"""
+    omega = 2*pi*freqs
+    Z = series(R, series(ZL(L, omega), ZC(C, omega)))
+    return Z / (1 + 1j*omega*C_parallel*Z)
+
+
+def find_resonant_freq_RLC(L, C, R=0., C_parallel=0., n_coarse:int=1000, xtol:float=1e-3):
+    """Function to find the resonant frequencies (minimum of |Z|) of many series RLC resonators from their
+    element values, see find_resonant_freq_batch. The search range is one octave around 1/(2 pi sqrt(LC)).
+
+    Args:
+        L (float or np.ndarray): inductances [H]
+        C (float or np.ndarray): capacitances [F]
+        R (float or np.ndarray, optional): series resistances [Ohm]. Defaults to 0.
+        C_parallel (float or np.ndarray, optional): parasitic capacitances across the resonators [F]. Defaults to 0.
+        n_coarse (int, optional): number of frequencies of the coarse scan. Defaults to 1000.
+        xtol (float, optional): absolute precision of the resonant frequencies [Hz]. Defaults to 1e-3.
+
+    Returns:
+        f_res (np.ndarray): resonant frequencies [Hz]
+    """
+    f_LC = find_LC_resonant_frequency(np.asarray(L), np.asarray(C))
+    return find_resonant_freq_batch(Z_series_RLC, f_LC/2, f_LC*2, (L, C, R, C_parallel), n_coarse, xtol)
+
+
 def find_LC_resonant_frequency(L:float, C:float):
     """Function to get the resonant frequency of a simple LC circuit
 
@@ -64,10 +142,30 @@ def get_C_from_bias_freq_and_L(freq_array:np.ndarray, L:float):
         C_array(np.ndarray): Capacitance array
     """
     
-    C_array = np.array( [ 1/( (2*pi*f)**2 * L) for f in freq_array ] )
+    C_array = 1/( (2*pi*np.asarray(freq_array))**2 * L)
     
     return C_array
 
+def band_indices(n:int, band:int):
+    """Function to get the (row, column) indices of the diagonals |i-j| <= band of an n x n matrix,
+    e.g. to build a banded crosstalk matrix as a scipy.sparse matrix
+
+    Args:
+        n (int): size of the matrix (number of channels)
+        band (int): number of diagonals on each side of the main diagonal
+
+    Returns:
+        rows (np.ndarray): row index of each element in the band, in row-major order
+        cols (np.ndarray): column index of each element in the band
+    """
+    
+    offsets = np.arange(-band, band + 1)
+    rows = np.repeat(np.arange(n), len(offsets))
+    cols = rows + np.tile(offsets, n)
+    in_matrix = (cols >= 0) & (cols < n)
+    
+    return rows[in_matrix], cols[in_matrix]
+
 # ---------------------------------------------------------
 # BASIC STUFF
 # ---------------------------------------------------------
@@ -88,34 +186,34 @@ def get_voltage_divider_factor(Z1:float, Z2:float):
     
     return ratio_mag, ratio_phase
 
-def get_phase(Z:np.complex):
+def get_phase(Z:complex):
     """This function calculates the phase associated with an impedance
 
     Args:
-        Z (np.complex): The complex impedance
+        Z (complex): The complex impedance
     """
     
     phase:float = np.real(np.arctan(np.imag(Z) / np.real(Z))) 
     return phase
 
-def series(Z1:np.complex, Z2:np.complex):
+def series(Z1:complex, Z2:complex):
     """ This function returns the equivalent impedance in series
 
     Args:
-        Z1 (np.complex): _description_
-        Z2 (np.complex): _description_
+        Z1 (complex): _description_
+        Z2 (complex): _description_
     """
     Z_eq = Z1 + Z2 
     return Z_eq
 
-def parallel(Z1:np.complex, Z2:np.complex):
+def parallel(Z1:complex, Z2:complex):
     """This function returns the equivalent impedance in parallel
 
     Args:
-        Z1 (np.complex): _description_
-        Z2 (np.complex): _description_
+        Z1 (complex): _description_
+        Z2 (complex): _description_
     """
-    Z_eq = 1/Z1 + 1/Z2
+    Z_eq = 1/(1/Z1 + 1/Z2)
     return Z_eq
 
 def ZC(C:float, omega:float):
@@ -1,35 +1,38 @@
 # SCRIPT WITH SOME CORE EQUATIONS
 
 import numpy as np
+from tes_functions import get_tes_responsivity
 
 def calculate_responsivity(V_bias, loop_gain, tau=None, omega=None, ac=True, R_TES=1, R_s=0):
     """
-    Function to calculate the responsivity of a bolometer
+    Function to calculate the responsivity of a bolometer, all the arguments can be arrays (they broadcast)
 
     Args:
-        V_bias (_type_): _description_
-        loop_gain (_type_): _description_
-        tau (_type_): _description_
-        omega (_type_): _description_
-        ac (bool, optional): _description_. Defaults to True.
+        V_bias (_type_): bias voltage [V]
+        loop_gain (_type_): loop gain
+        tau (_type_): time constant of the detector with electrothermal feedback, tau0/(1+loop_gain) [s],
+            None together with omega for a fast detector
+        omega (_type_): angular frequency of the signal [rad/s], None together with tau for a fast detector
+        ac (bool, optional): AC bias (sqrt(2) prefactor). Defaults to True.
+        R_TES (float, optional): TES resistance [Ohm]. Defaults to 1.
+        R_s (float, optional): stray series impedance [Ohm]. Defaults to 0.
+
+    Returns:
+        S_I: responsivity [1/V], complex for a slow detector (the phase of the roll-off)
     """
     
-    if (omega is None) or (tau is None):
-        # just assume a very fast detector
-        omega = 1
-        tau = omega/100
-    
-    if ac:
-        prefactor = np.sqrt(2)    
-    else:
-        prefactor = 1
+    if (omega is None) != (tau is None):
+        raise ValueError("give both tau and omega, or neither of them for a fast detector")
+    if omega is None:
+        # fast detector, no roll-off
+        omega = 0
+        tau = 0
     
     V_TES = V_bias * R_TES / (R_TES + R_s) # =V_bias if there are no stray impedances
     
-    # Derived in Tucker's thesis section 5.1 and re-arranged in Josh's thesis
-    # I NEED TO CHECK HOW THE LAST TERM WHICH DEPENDS ON TAU GETS AFFECTED
-    # I DON'T TRUST TUCKER'S DERIVATION JUST YET
-    S_I = prefactor/V_TES * \
-        (loop_gain * (R_TES) /( loop_gain*(R_TES - R_s) + (R_TES + R_s))) * (1/(1 + omega*tau))
+    # Derived in Tucker's thesis section 5.1 and re-arranged in Josh's thesis, see get_tes_responsivity,
+    # the roll-off comes from the loop gain L0/(1 + j omega tau0) with the time constant without feedback
+    tau0 = tau * (1 + loop_gain)
+    S_I = np.real_if_close(get_tes_responsivity(V_TES, loop_gain, omega=omega, tau0=tau0, R_TES=R_TES, R_s=R_s, AC=ac))
         
     return S_I
\ No newline at end of file
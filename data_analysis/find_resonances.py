@@ -0,0 +1,225 @@
+"""
+this file contains functions to find the resonances in VNA sweeps (S11 / S21 in dB) and fit them,
+so that the resonant frequencies of a cooldown do not have to be read by eye from the plots.
+
+For each trace:
+  - the dips are found with scipy.signal.find_peaks and located between the frequency points with a
+    parabola through the three points around the minimum
+  - a Lorentzian dip is fitted around each of them in linear power, giving f_res and Q with uncertainties
+The traces of many files are fitted in parallel over a process pool, and the fit of each trace is cached
+on disk (see cache_functions.py), so rerunning a script on the same files does not fit them again.
+"""
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import curve_fit
+from scipy.signal import find_peaks, peak_widths
+from data_analysis.load_vna_data import read_vna_files
+from cache_functions import cached
+
+
+class Resonance:
+    """Fitted resonance: frequency f_res [Hz], quality factor Q and fractional depth of the dip in power"""
+    def __init__(self, f_res:float, f_res_sigma:float, Q:float, Q_sigma:float, depth:float, f_dip:float, name:str=''):
+        self.f_res = f_res
+        self.f_res_sigma = f_res_sigma
+        self.Q = Q
+        self.Q_sigma = Q_sigma
+        self.depth = depth
+        self.f_dip = f_dip # position of the dip from the parabolic interpolation [Hz]
+        self.name = name
+
+    def __repr__(self):
+        return "Resonance({}: f_res={:.6g} +- {:.2g} MHz, Q={:.3g} +- {:.2g})".format(
+            self.name, self.f_res/1e6, self.f_res_sigma/1e6, self.Q, self.Q_sigma)
+
+
+def lorentzian_dip(freqs, f_res, Q, depth, baseline):
+    """Power transmission of a resonance dip: baseline * (1 - depth / (1 + (2Q (f - f_res)/f_res)^2))"""
+    x = 2 * Q * (freqs - f_res) / f_res
+    return baseline * (1 - depth / (1 + x**2))
+
+
+def interpolate_minima(freqs:np.ndarray, S:np.ndarray, indices:np.ndarray):
+    """Function to locate minima between the frequency points, with the vertex of the parabola through
+    the points before, at and after each index (works for non-uniform frequency steps)
+
+    Args:
+        freqs (np.ndarray): frequencies [Hz]
+        S (np.ndarray): trace [dB]
+        indices (np.ndarray): indices of the minima, not the first or last point
+
+    Returns:
+        f_min (np.ndarray): interpolated frequencies of the minima [Hz]
+        S_min (np.ndarray): interpolated values at the minima [dB]
+    """
+    x0, x1, x2 = freqs[indices-1], freqs[indices], freqs[indices+1]
+    y0, y1, y2 = S[indices-1], S[indices], S[indices+1]
+    numerator = (x1 - x0)**2 * (y1 - y2) - (x1 - x2)**2 * (y1 - y0)
+    denominator = (x1 - x0) * (y1 - y2) - (x1 - x2) * (y1 - y0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f_min = x1 - 0.5 * numerator / denominator
+    # flat points: keep the sampled minimum
+    f_min = np.where((denominator != 0) & (f_min >= x0) & (f_min <= x2), f_min, x1)
+    # value of the parabola at the vertex, from the Lagrange form
+    S_min = y0 * (f_min - x1) * (f_min - x2) / ((x0 - x1) * (x0 - x2)) \
+        + y1 * (f_min - x0) * (f_min - x2) / ((x1 - x0) * (x1 - x2)) \
+        + y2 * (f_min - x0) * (f_min - x1) / ((x2 - x0) * (x2 - x1))
+    return f_min, S_min
+
+
+def find_dips(freqs:np.ndarray, S:np.ndarray, n_dips:int=1, prominence:float=3.):
+    """Function to find the deepest dips of a trace
+
+    Args:
+        freqs (np.ndarray): frequencies [Hz]
+        S (np.ndarray): trace [dB]
+        n_dips (int, optional): maximum number of dips, None for all. Defaults to 1.
+        prominence (float, optional): minimum prominence of a dip [dB]. Defaults to 3.
+
+    Returns:
+        indices (np.ndarray): index of each dip, sorted from the most prominent
+        f_dip (np.ndarray): interpolated frequency of each dip [Hz]
+        widths (np.ndarray): full width of each dip at half its prominence [Hz]
+    """
+    indices, properties = find_peaks(-S, prominence=prominence)
+    keep = (indices > 0) & (indices < len(S) - 1)
+    indices = indices[keep][np.argsort(-properties['prominences'][keep])][:n_dips]
+    if len(indices) == 0:
+        return indices, np.zeros(0), np.zeros(0)
+    f_dip, _ = interpolate_minima(freqs, S, indices)
+    _, _, left, right = peak_widths(-S, indices, rel_height=0.5)
+    points = np.arange(len(freqs))
+    widths = np.interp(right, points, freqs) - np.interp(left, points, freqs)
+    return indices, f_dip, widths
+
+
+def fit_resonance(freqs:np.ndarray, S:np.ndarray, f_dip:float, width:float, window:float=5., name:str=''):
+    """Function to fit a Lorentzian dip around a dip found by find_dips
+
+    Args:
+        freqs (np.ndarray): frequencies [Hz]
+        S (np.ndarray): trace [dB]
+        f_dip (float): frequency of the dip [Hz]
+        width (float): width of the dip [Hz], used for the initial Q and the fit window
+        window (float, optional): half width of the fit window in units of the dip width. Defaults to 5.
+        name (str, optional): label of the resonance. Defaults to ''.
+
+    Returns:
+        resonance (Resonance): None if the fit fails
+    """
+    in_window = np.abs(freqs - f_dip) <= window * width
+    f = freqs[in_window]
+    power = 10**(S[in_window]/10)
+    if len(f) < 5:
+        return None
+    baseline = np.max(power)
+    depth = 1 - np.min(power) / baseline
+    p0 = [f_dip, f_dip / width, depth, baseline]
+    try:
+        popt, pcov = curve_fit(lorentzian_dip, f, power, p0=p0, x_scale=[width, p0[1], 1., baseline],
+                               bounds=([f[0], 0., 0., 0.], [f[-1], np.inf, 1., np.inf]))
+    except (RuntimeError, ValueError):
+        return None
+    sigmas = np.sqrt(np.diag(pcov))
+    return Resonance(popt[0], sigmas[0], popt[1], sigmas[1], popt[2], f_dip, name)
+
+
+def find_resonances(freqs:np.ndarray, S:np.ndarray, n_dips:int=1, prominence:float=3., window:float=5., name:str=''):
+    """Function to find and fit the resonances of one trace
+
+    Args:
+        freqs (np.ndarray): frequencies [Hz]
+        S (np.ndarray): S11 or S21 [dB]
+        n_dips (int, optional): maximum number of resonances, the most prominent first. Defaults to 1.
+        prominence (float, optional): minimum prominence of a dip [dB]. Defaults to 3.
+        window (float, optional): half width of the fit window in units of the dip width. Defaults to 5.
+        name (str, optional): label of the trace. Defaults to ''.
+
+    Returns:
+        resonances (list): Resonance of each dip that could be fitted
+    """
+    freqs = np.asarray(freqs, dtype=float)
+    S = np.asarray(S, dtype=float)
+    _, f_dips, widths = find_dips(freqs, S, n_dips, prominence)
+    resonances = [fit_resonance(freqs, S, f_dip, width, window, name) for f_dip, width in zip(f_dips, widths)]
+    return [resonance for resonance in resonances if resonance is not None]
+
+
+# parameters of Resonance, in the order of its constructor
+RESONANCE_FIELDS = ('f_res', 'f_res_sigma', 'Q', 'Q_sigma', 'depth', 'f_dip')
+
+
+@cached(config_file=None, depends_on=[__file__])
+def fit_trace(freqs:np.ndarray, S:np.ndarray, n_dips:int=1, prominence:float=3., window:float=5.):
+    """Function to find and fit the resonances of one trace, as a dict of arrays so that it can be cached
+
+    Returns:
+        fitted (dict): name of a parameter of Resonance (RESONANCE_FIELDS) -> its value for each resonance
+    """
+    resonances = find_resonances(freqs, S, n_dips, prominence, window)
+    return {field : np.array([getattr(resonance, field) for resonance in resonances], dtype=float) for field in RESONANCE_FIELDS}
+
+
+def _find_resonances(args):
+    # top level function so that it can be sent to the worker processes
+    freqs, S, n_dips, prominence, window, name = args
+    fitted = fit_trace(freqs, S, n_dips, prominence, window)
+    return [Resonance(*[fitted[field][i] for field in RESONANCE_FIELDS], name=name) for i in range(len(fitted['f_res']))]
+
+
+def find_resonances_in_traces(traces:list, n_dips:int=1, prominence:float=3., window:float=5., names:list=None,
+                              n_workers:int=None):
+    """Function to find and fit the resonances of many traces, in parallel over a process pool
+
+    Args:
+        traces (list): (freqs, S) of each trace
+        n_dips, prominence, window: see find_resonances
+        names (list, optional): label of each trace. Defaults to the index of the trace.
+        n_workers (int, optional): number of worker processes, 1 to fit in this process.
+            Defaults to None (number of CPUs).
+
+    Returns:
+        resonances (list): list of Resonance of each trace, in the same order
+    """
+    if names is None:
+        names = [str(i) for i in range(len(traces))]
+    jobs = [(np.asarray(freqs), np.asarray(S), n_dips, prominence, window, name) for (freqs, S), name in zip(traces, names)]
+    if n_workers == 1 or len(jobs) <= 1:
+        return [_find_resonances(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(_find_resonances, jobs))
+
+
+def find_resonances_in_files(filepaths:list, n_dips:int=1, prominence:float=3., window:float=5., column:int=1,
+                             n_workers:int=None):
+    """Function to find and fit the resonances of VNA csv files
+
+    Args:
+        filepaths (list): csv files
+        n_dips, prominence, window: see find_resonances
+        column (int, optional): column of the trace to use. Defaults to 1 (first trace after the frequency).
+        n_workers (int, optional): number of worker processes. Defaults to None (number of CPUs).
+
+    Returns:
+        resonances (list): list of Resonance of each file, in the same order
+    """
+    all_data = read_vna_files(filepaths)
+    traces = [(data[0], data[column]) for data in all_data]
+    return find_resonances_in_traces(traces, n_dips, prominence, window, [str(filepath) for filepath in filepaths], n_workers)
+
+
+def get_resonant_frequencies(resonances:list):
+    """Function to get the frequency of the strongest resonance of each trace, e.g. as the y data of
+    model_res_freq in starcryo_cable_meas.py
+
+    Args:
+        resonances (list): output of find_resonances_in_files or find_resonances_in_traces
+
+    Returns:
+        res_freqs (np.ndarray): resonant frequencies [Hz], nan for traces without a resonance
+        res_freq_err (np.ndarray): fit uncertainties [Hz]
+    """
+    res_freqs = np.array([found[0].f_res if found else np.nan for found in resonances])
+    res_freq_err = np.array([found[0].f_res_sigma if found else np.nan for found in resonances])
+    return res_freqs, res_freq_err
@@ -0,0 +1,113 @@
+"""
+this file contains functions to load the csv files saved by the VNA (frequency sweeps of S11 / S21),
+shared by read_VNA_file.py and starcryo_cable_meas.py.
+
+The header block (instrument settings, "BEGIN CH1_DATA", column names) and the trailing lines
+("END") are detected automatically, and the data block is parsed in one call. A binary copy of the
+data (<file>.npy) is written next to the csv and memory-mapped on the next load; it is rewritten
+when the csv changes.
+"""
+
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _is_data_line(line:str):
+    # a data line has at least two fields and all of its non-empty fields are numbers
+    fields = [field for field in line.strip().split(',') if field.strip()]
+    if len(fields) < 2:
+        return False
+    try:
+        for field in fields:
+            float(field)
+    except ValueError:
+        return False
+    return True
+
+
+def find_data_block(lines:list):
+    """Function to find the data block of a VNA file
+
+    Args:
+        lines (list): lines of the file
+
+    Returns:
+        start (int): index of the first data line
+        stop (int): index after the last data line
+    """
+    start = 0
+    while start < len(lines) and not _is_data_line(lines[start]):
+        start += 1
+    if start == len(lines):
+        raise ValueError("no data found")
+    stop = len(lines)
+    while not _is_data_line(lines[stop - 1]):
+        stop -= 1
+    return start, stop
+
+
+def parse_vna_file(filepath:str):
+    """Function to parse the data block of a VNA csv file
+
+    Args:
+        filepath (str): csv file
+
+    Returns:
+        data (np.ndarray): shape (number of columns, number of points), frequency [Hz] in the first row
+    """
+    with open(filepath, mode='r') as file:
+        lines = file.read().splitlines()
+    start, stop = find_data_block(lines)
+    n_columns = len([field for field in lines[start].strip().split(',') if field.strip()])
+    return np.loadtxt(lines[start:stop], delimiter=',', usecols=range(n_columns), ndmin=2).T.copy()
+
+
+def _cache_filename(filepath:str):
+    return filepath + '.npy'
+
+
+def read_vna_file(filepath:str, use_cache:bool=True):
+    """Function to read a VNA csv file
+
+    Args:
+        filepath (str): csv file
+        use_cache (bool, optional): read from / write the binary copy <file>.npy. Defaults to True.
+
+    Returns:
+        data (np.ndarray): shape (number of columns, number of points), e.g. freqs, S11 = data
+            for frequency [Hz] and S11 [dB]. Memory-mapped (read-only) when loaded from the cache.
+    """
+    if not use_cache:
+        return parse_vna_file(filepath)
+    cache = _cache_filename(filepath)
+    mtime = os.stat(filepath).st_mtime_ns
+    if os.path.exists(cache) and os.stat(cache).st_mtime_ns == mtime:
+        try:
+            return np.load(cache, mmap_mode='r')
+        except (OSError, ValueError):
+            pass # unreadable copy, parse the csv again
+    data = parse_vna_file(filepath)
+    try:
+        np.save(cache + '.tmp.npy', data)
+        # the copy gets the modification time of the csv, so that a changed csv is detected
+        os.utime(cache + '.tmp.npy', ns=(mtime, mtime))
+        os.replace(cache + '.tmp.npy', cache)
+    except OSError:
+        pass # e.g. read-only data directory, the copy is only an optimization
+    return data
+
+
+def read_vna_files(filepaths:list, use_cache:bool=True, n_workers:int=None):
+    """Function to read many VNA csv files concurrently on a thread pool
+
+    Args:
+        filepaths (list): csv files
+        use_cache (bool, optional): see read_vna_file. Defaults to True.
+        n_workers (int, optional): number of threads. Defaults to None (ThreadPoolExecutor default).
+
+    Returns:
+        data (list): the array of each file, in the same order
+    """
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(lambda filepath: read_vna_file(filepath, use_cache), filepaths))
@@ -1,6 +1,6 @@
 import numpy as np
-import csv
 from matplotlib import pyplot as plt
+from data_analysis.load_vna_data import read_vna_files
 
 
 data_folder = "C:/Users/nicol/Documents/00Research/Data/Dunk Probe/starcryo_cable/date_20230920_19mm_2000um/"
@@ -10,30 +10,12 @@ def main():
     
     print("Hello. Let's look at the VNA data")
     
-    for data_file in data_files:
-        
-        filepath = data_folder+data_file
-        
-        # initialize arrays
-        freqs = np.array([])
-        S11 = np.array([])
-        
-        # opening the CSV file
-        with open(filepath, mode ='r') as file:
-            # reading the CSV file
-            csvFile = csv.reader(file)
+    # all files are read at once
+    all_data = read_vna_files([data_folder+data_file for data_file in data_files])
     
-            # displaying the contents of the CSV file
-            line_counter = 0
-            lines_to_skip = 17
-            for line in csvFile:
-                if line_counter > lines_to_skip: # skip the headers
-                    # ignore last file
-                    if len(line) >1:
-                        freqs = np.append(freqs, float(line[0]) ) # frequency in Hz
-                        S11 = np.append(S11, float(line[1]) ) # S11 in dB
-                line_counter = line_counter + 1
+    for data in all_data:
         
+        freqs, S11 = data[0], data[1] # frequency in Hz, S11 in dB
         
         print(freqs[0:10])
         print(S11[0:10])
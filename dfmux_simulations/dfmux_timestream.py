@@ -0,0 +1,355 @@
+"""
+Time-domain simulation of the frequency-domain multiplexed readout: the current through the SQUID of a
+comb (one carrier per bias frequency, amplitude modulated by the TES, cancelled by the nuller, plus broadband
+and 1/f noise) is synthesized block by block, demodulated channel by channel and its power spectral density
+is accumulated on the fly, so that long timestreams are simulated in bounded memory.
+
+Conventions: carrier amplitudes are rms currents [A]. The demodulated output x of a channel is normalized
+so that a carrier of rms amplitude I gives |x| = I, and rotated by the phase of the carrier, so that the
+real part of x is the amplitude quadrature and the imaginary part the phase quadrature. With this
+normalization, a broadband noise of one-sided density nei(f) [A/rtHz] at the SQUID gives a one-sided density
+nei(f_bias) in each quadrature, which is what DfMux.total_noise is compared with.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import firwin, firwin2, get_window, lfilter, sosfilt, zpk2sos, sosfreqz
+from load_data_functions import load_schedule
+
+pi = np.pi
+
+
+def get_rotation(step:np.ndarray, n:int, sign:int=1):
+    """Oscillators exp(sign 2j pi step k) for k < n, shape (len(step), n), computed once per block length"""
+    return np.exp(sign * 2j*pi * np.outer(step, np.arange(n)))
+
+
+class DecimatingFIR:
+    """
+    Low-pass FIR filter and decimation of many channels at once, in polyphase form: the input is cut in frames
+    of `decimation` samples and each output sample is the product of n_taps_per_phase consecutive frames with
+    the taps, evaluated on a sliding window view (no copy of the input). The last input samples are kept
+    between calls, so that a stream cut in blocks gives the same output as the whole stream.
+    """
+    def __init__(self, decimation:int, n_taps_per_phase:int=8, cutoff:float=0.8):
+        """
+        Args:
+            decimation (int): decimation factor
+            n_taps_per_phase (int, optional): number of taps of each polyphase branch. Defaults to 8.
+            cutoff (float, optional): cutoff frequency relative to the output Nyquist frequency. Defaults to 0.8.
+        """
+        self.decimation = decimation
+        self.n_taps_per_phase = n_taps_per_phase
+        self.taps = firwin(decimation * n_taps_per_phase, cutoff / decimation) if decimation > 1 else np.ones(1)
+        # taps in the order of the input samples of a window, one row per frame
+        self._polyphase_taps = self.taps[::-1].reshape(n_taps_per_phase if decimation > 1 else 1, decimation)
+        self.history = None
+
+    def reset(self):
+        self.history = None
+
+    def process(self, x:np.ndarray):
+        """Function to filter and decimate the next block of samples
+
+        Args:
+            x (np.ndarray): samples along the last axis, any leading shape (e.g. channels)
+
+        Returns:
+            y (np.ndarray): decimated samples, one for every `decimation` input samples
+        """
+        n_frames_per_window, decimation = self._polyphase_taps.shape
+        if self.history is None:
+            # start with zeros, the first output sample covers the first `decimation` input samples,
+            # i.e. a fixed delay of decimation-1 samples
+            self.history = np.zeros(x.shape[:-1] + ((n_frames_per_window - 1) * decimation,), dtype=x.dtype)
+        buffer = np.concatenate([self.history, x], axis=-1)
+        n_frames = buffer.shape[-1] // decimation
+        n_out = n_frames - n_frames_per_window + 1
+        if n_out <= 0:
+            self.history = buffer
+            return np.zeros(x.shape[:-1] + (0,), dtype=np.result_type(x, self.taps))
+        frames = buffer[..., :n_frames * decimation].reshape(x.shape[:-1] + (n_frames, decimation))
+        windows = sliding_window_view(frames, n_frames_per_window, axis=-2) # (..., n_out, decimation, frames)
+        y = np.einsum('...mdt,td->...m', windows, self._polyphase_taps)
+        self.history = buffer[..., n_out * decimation:]
+        return y
+
+
+class Channelizer:
+    """
+    Demodulator of all the channels of a comb: each channel is mixed to baseband with its own oscillator
+    and decimated by a cascade of DecimatingFIR stages. With the default 8 taps per phase the response is
+    flat up to about 0.4 of the output Nyquist frequency (the cutoff of firwin is the -6 dB point).
+    """
+    def __init__(self, f_bias:np.ndarray, sample_rate:float, decimations=(16, 16, 16), phases:np.ndarray=0.,
+                 n_taps_per_phase:int=8):
+        """
+        Args:
+            f_bias (np.ndarray): bias frequency of each channel [Hz]
+            sample_rate (float): sample rate of the input [Hz]
+            decimations (tuple, optional): decimation factor of each stage. Defaults to (16, 16, 16).
+            phases (np.ndarray, optional): phase of each carrier [rad], the output is rotated by -phase.
+                Defaults to 0.
+            n_taps_per_phase (int, optional): taps of each polyphase branch of the stages. Defaults to 8.
+        """
+        self.f_bias = np.asarray(f_bias, dtype=float)
+        self.sample_rate = sample_rate
+        self.phases = np.broadcast_to(np.asarray(phases, dtype=float), self.f_bias.shape)
+        self.stages = [DecimatingFIR(decimation, n_taps_per_phase) for decimation in decimations]
+        self.output_rate = sample_rate / np.prod(decimations)
+        self.cycles = np.zeros(len(self.f_bias)) # phase of the oscillators at the start of the next block [cycles]
+        self._rotation = None
+
+    def reset(self):
+        self.cycles[:] = 0.
+        for stage in self.stages:
+            stage.reset()
+
+    def process(self, block:np.ndarray):
+        """Function to demodulate the next block of the timestream
+
+        Args:
+            block (np.ndarray): real samples of the current through the SQUID [A]
+
+        Returns:
+            x (np.ndarray): complex demodulated samples of shape (n_channels, n) at output_rate [A rms]
+        """
+        n = len(block)
+        step = self.f_bias / self.sample_rate
+        if self._rotation is None or self._rotation.shape[-1] != n:
+            # phase of the oscillators within a block, the same for all the blocks of the same length
+            self._rotation = get_rotation(step, n, sign=-1)
+        # sqrt(2) so that a carrier of rms amplitude I gives |x| = I
+        start = np.sqrt(2) * np.exp(-2j*pi*self.cycles - 1j*self.phases)
+        self.cycles = (self.cycles + step * n) % 1
+        x = block * self._rotation
+        x *= start[:, np.newaxis]
+        for stage in self.stages:
+            x = stage.process(x)
+        return x
+
+
+class WelchAccumulator:
+    """
+    Welch estimate of the one-sided power spectral density (as scipy.signal.welch with detrend='constant'
+    and average='mean') accumulated block by block: the segments that are complete are transformed at
+    each update, the incomplete one is kept for the next.
+    """
+    def __init__(self, sample_rate:float, nperseg:int=256, noverlap:int=None, window='hann'):
+        self.sample_rate = sample_rate
+        self.nperseg = nperseg
+        self.step = nperseg - (nperseg // 2 if noverlap is None else noverlap)
+        self.window = get_window(window, nperseg)
+        self.scale = 1. / (sample_rate * np.sum(self.window**2))
+        self.freqs = np.fft.rfftfreq(nperseg, 1. / sample_rate)
+        self.buffer = None
+        self.power_sum = None
+        self.n_segments = 0
+
+    def update(self, x:np.ndarray):
+        """Function to add the next samples (along the last axis, any leading shape) to the estimate"""
+        buffer = x if self.buffer is None else np.concatenate([self.buffer, x], axis=-1)
+        n_segments = (buffer.shape[-1] - self.nperseg) // self.step + 1
+        if n_segments > 0:
+            segments = sliding_window_view(buffer, self.nperseg, axis=-1)[..., :n_segments * self.step:self.step, :]
+            segments = segments - np.mean(segments, axis=-1, keepdims=True)
+            power = np.sum(np.abs(np.fft.rfft(segments * self.window, axis=-1))**2, axis=-2)
+            self.power_sum = power if self.power_sum is None else self.power_sum + power
+            self.n_segments += n_segments
+            buffer = buffer[..., n_segments * self.step:]
+        self.buffer = buffer.copy()
+
+    def psd(self):
+        """One-sided power spectral density of the samples so far, frequencies in self.freqs [unit^2/Hz]"""
+        if not self.n_segments:
+            raise ValueError("fewer samples than one segment of {}".format(self.nperseg))
+        psd = self.power_sum / self.n_segments * self.scale
+        last = -1 if self.nperseg % 2 == 0 else None # the Nyquist bin is not doubled
+        psd[..., 1:last] *= 2
+        return psd
+
+
+class CombTimestream:
+    """
+    Streaming synthesis of the current through the SQUID of a comb, sampled at sample_rate:
+     - carrier i: sqrt(2) I_i (1 + s(t)) cos(2 pi f_i t + phi_i), s(t) = signal_amplitude sin(2 pi signal_frequency t)
+       is the response of the TES to an optical signal, as in am_modulation.ipynb
+     - nuller: -sqrt(2) I_i (1 - nuller_residual) cos(2 pi f_i t + phi_i + nuller_phase_error)
+     - 1/f noise of the TES current: amplitude noise of each carrier with density nei(f_i)^2 (f_knee/f)^alpha,
+       synthesized at sample_rate/slow_factor and interpolated linearly
+     - broadband noise of one-sided density nei(f) at the SQUID, shaped by a FIR filter
+    The state of the filters and of the carrier phases is kept between blocks.
+    """
+    def __init__(self, f_bias:np.ndarray, I_carrier, nei_freqs:np.ndarray, nei:np.ndarray, sample_rate:float=20e6,
+                 block_size:int=2**16, nuller_residual=0., nuller_phase_error=0., signal_amplitude:float=0.,
+                 signal_frequency:float=1., f_knee:float=0., alpha:float=1., f_min:float=1e-3, slow_factor:int=2**10,
+                 n_shaping_taps:int=255, seed:int=0):
+        """
+        Args:
+            f_bias (np.ndarray): bias frequency of each channel [Hz]
+            I_carrier (float or np.ndarray): rms amplitude of each carrier [A]
+            nei_freqs (np.ndarray): frequencies at which the noise density is given [Hz], e.g. DfMux.freqs
+            nei (np.ndarray): noise density at the SQUID [A/rtHz], e.g. DfMux.total_noise
+            sample_rate (float, optional): sample rate [Hz]. Defaults to 20e6.
+            block_size (int, optional): number of samples per block, a multiple of slow_factor. Defaults to 2**16.
+            nuller_residual (float or np.ndarray, optional): fraction of each carrier left by the nuller. Defaults to 0.
+            nuller_phase_error (float or np.ndarray, optional): phase error of the nuller [rad]. Defaults to 0.
+            signal_amplitude (float, optional): fractional amplitude of the TES response. Defaults to 0.
+            signal_frequency (float, optional): frequency of the TES response [Hz]. Defaults to 1.
+            f_knee (float, optional): knee frequency of the 1/f noise [Hz], 0 for none. Defaults to 0.
+            alpha (float, optional): slope of the 1/f noise power. Defaults to 1.
+            f_min (float, optional): lowest frequency of the 1/f slope [Hz]. Defaults to 1e-3.
+            slow_factor (int, optional): decimation of the sample rate of the 1/f noise. Defaults to 2**10.
+            n_shaping_taps (int, optional): taps of the broadband noise shaping filter. Defaults to 255.
+            seed (int, optional): random seed. Defaults to 0.
+        """
+        if block_size % slow_factor:
+            raise ValueError("block_size ({}) must be a multiple of slow_factor ({})".format(block_size, slow_factor))
+        self.f_bias = np.asarray(f_bias, dtype=float)
+        n_channels = len(self.f_bias)
+        self.I_carrier = np.broadcast_to(np.asarray(I_carrier, dtype=float), (n_channels,))
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.signal_amplitude = signal_amplitude
+        self.signal_frequency = signal_frequency
+        self.slow_factor = slow_factor
+        self.rng = np.random.default_rng(seed)
+        self.phases = self.rng.uniform(0, 2*pi, n_channels)
+        self.n_samples = 0 # samples generated so far
+        self.cycles = np.zeros(n_channels)
+        self.rotation = get_rotation(self.f_bias / sample_rate, block_size)
+        self._rotation_real = np.ascontiguousarray(self.rotation.real)
+        self._rotation_imag = np.ascontiguousarray(self.rotation.imag)
+
+        # complex amplitude of carrier + nuller, without the TES response
+        self.nulled_amplitude = np.sqrt(2) * self.I_carrier * (1 - (1 - np.asarray(nuller_residual)) * np.exp(1j*np.asarray(nuller_phase_error)))
+
+        # broadband noise: unit white noise has a one-sided density 2/sample_rate
+        nei_freqs = np.asarray(nei_freqs, dtype=float)
+        nei = np.broadcast_to(np.asarray(nei, dtype=float), nei_freqs.shape)
+        if np.ptp(nei) == 0:
+            self.shaping_taps = np.array([nei.flat[0] * np.sqrt(sample_rate / 2)])
+        else:
+            grid = np.linspace(0, 1, 513)
+            gain = np.interp(grid * sample_rate / 2, nei_freqs, nei) * np.sqrt(sample_rate / 2)
+            self.shaping_taps = firwin2(n_shaping_taps, grid, gain)
+        self.shaping_state = np.zeros(len(self.shaping_taps) - 1)
+
+        # 1/f noise: cascade of real poles (2 per decade) and zeros between them, unit density at f_knee
+        self.f_knee = f_knee
+        self.one_over_f_sos = None
+        if f_knee > 0:
+            slow_rate = sample_rate / slow_factor
+            f_poles = np.geomspace(f_min, slow_rate / 8, max(int(2 * np.log10(slow_rate / 8 / f_min)), 1) + 1)
+            f_zeros = f_poles * (f_poles[1] / f_poles[0])**(alpha / 2) if len(f_poles) > 1 else f_poles * 10**(alpha / 2)
+            sos = zpk2sos(np.exp(-2*pi*f_zeros / slow_rate), np.exp(-2*pi*f_poles / slow_rate), 1.)
+            response = np.abs(sosfreqz(sos, [f_knee], fs=slow_rate)[1][0])
+            nei_bias = np.interp(self.f_bias, nei_freqs, nei)
+            self.one_over_f_scale = nei_bias / (response * np.sqrt(2 / slow_rate))
+            self.one_over_f_sos = sos
+            self.one_over_f_state = np.zeros((sos.shape[0], n_channels, 2))
+            self.one_over_f_last = np.zeros(n_channels)
+
+    def _one_over_f(self):
+        # 1/f noise of each channel for the next block, shape (n_channels, block_size) [A]
+        n_slow = self.block_size // self.slow_factor
+        white = self.rng.standard_normal((len(self.f_bias), n_slow))
+        slow, self.one_over_f_state = sosfilt(self.one_over_f_sos, white, axis=-1, zi=self.one_over_f_state)
+        slow *= self.one_over_f_scale[:, np.newaxis]
+        # linear interpolation from the last sample of the previous block
+        extended = np.concatenate([self.one_over_f_last[:, np.newaxis], slow], axis=-1)
+        self.one_over_f_last = slow[:, -1]
+        weights = np.arange(1, self.slow_factor + 1) / self.slow_factor
+        interpolated = extended[:, :-1, np.newaxis] * (1 - weights) + extended[:, 1:, np.newaxis] * weights
+        return interpolated.reshape(len(self.f_bias), self.block_size)
+
+    def next_block(self):
+        """Function to synthesize the next block_size samples of the current through the SQUID [A]"""
+        n = self.block_size
+        start = np.exp(2j*pi*self.cycles + 1j*self.phases) # phase of the carriers at the start of the block
+        self.cycles = (self.cycles + self.f_bias / self.sample_rate * n) % 1
+
+        # the amplitudes that are constant over the block are summed with one product over the channels
+        block = np.real((self.nulled_amplitude * start) @ self.rotation)
+        if self.signal_amplitude:
+            time = (self.n_samples + np.arange(n)) / self.sample_rate
+            carriers = np.real((np.sqrt(2) * self.I_carrier * start) @ self.rotation)
+            block += self.signal_amplitude * np.sin(2*pi*self.signal_frequency*time) * carriers
+        if self.one_over_f_sos is not None:
+            # sum over the channels of sqrt(2) n_i(t) Re(start_i rotation_i(t))
+            one_over_f = np.sqrt(2) * self._one_over_f()
+            block += np.einsum('ik,ik->k', one_over_f * start.real[:, np.newaxis], self._rotation_real)
+            block -= np.einsum('ik,ik->k', one_over_f * start.imag[:, np.newaxis], self._rotation_imag)
+
+        white = self.rng.standard_normal(n)
+        if len(self.shaping_taps) == 1:
+            block += self.shaping_taps[0] * white
+        else:
+            noise, self.shaping_state = lfilter(self.shaping_taps, 1., white, zi=self.shaping_state)
+            block += noise
+        self.n_samples += n
+        return block
+
+    def blocks(self, n_samples:int):
+        """Generator of the blocks of the next n_samples samples (rounded up to whole blocks)"""
+        for _ in range(-(-n_samples // self.block_size)):
+            yield self.next_block()
+
+
+def simulate_demodulated_noise(f_bias:np.ndarray, I_carrier, nei_freqs:np.ndarray, nei:np.ndarray, duration:float,
+                               sample_rate:float=20e6, decimations=(16, 16, 16), nperseg:int=256, **timestream_args):
+    """Function to synthesize, demodulate and analyze the timestream of a comb, in blocks
+
+    Args:
+        f_bias (np.ndarray or str): bias frequency of each channel [Hz], or the name of a frequency
+            schedule file (see load_schedule)
+        I_carrier (float or np.ndarray): rms amplitude of each carrier [A]
+        nei_freqs (np.ndarray): frequencies at which the noise density is given [Hz]
+        nei (np.ndarray): noise density at the SQUID [A/rtHz]
+        duration (float): length of the timestream [s]
+        sample_rate (float, optional): sample rate [Hz]. Defaults to 20e6.
+        decimations (tuple, optional): decimation factor of each stage of the channelizer. Defaults to (16, 16, 16).
+        nperseg (int, optional): length of the Welch segments at the output rate. Defaults to 256.
+        **timestream_args: other arguments of CombTimestream (block_size, nuller_residual, f_knee, ...)
+
+    Returns:
+        freqs (np.ndarray): frequencies of the power spectral density [Hz]
+        psd (np.ndarray): one-sided density of the amplitude (psd[0]) and phase (psd[1]) quadratures
+            of each channel, shape (2, n_channels, len(freqs)) [A^2/Hz]
+    """
+    if isinstance(f_bias, str):
+        f_bias = load_schedule(f_bias)
+    comb = CombTimestream(f_bias, I_carrier, nei_freqs, nei, sample_rate, **timestream_args)
+    channelizer = Channelizer(f_bias, sample_rate, decimations, comb.phases)
+    welch = WelchAccumulator(channelizer.output_rate, nperseg)
+    # the start of the output depends on the zeros at the start of the filters, skip it
+    n_transient = int(np.sum([stage.taps.size * np.prod(decimations[:i]) for i, stage in enumerate(channelizer.stages)]))
+    n_skip_out = -(-n_transient // int(np.prod(decimations)))
+    for block in comb.blocks(int(duration * sample_rate) + n_transient):
+        x = channelizer.process(block)
+        if n_skip_out:
+            skip = min(n_skip_out, x.shape[-1])
+            x = x[:, skip:]
+            n_skip_out -= skip
+        welch.update(np.stack([np.real(x), np.imag(x)]))
+    return welch.freqs, welch.psd()
+
+
+def local_main(schedule_file:str=None):
+    # compare the demodulated noise with the analytic DfMux noise, at the bias frequencies of a
+    # frequency schedule file (electric_design/frequency_schedule.py) if one is given
+    from noise_simulations.noise_sims_from_Tucker.dfmux_calc import DfMux
+    freqs = np.linspace(1.5e6, 5.5e6, 68) if schedule_file is None else load_schedule(schedule_file)
+    dfmux = DfMux(freqs)
+    nei = dfmux.total_noise
+    # white noise only: both quadratures match the analytic noise. With 1/f noise of the TES current the
+    # amplitude quadrature is raised also above 100 Hz, the phase quadrature stays white
+    for f_knee in (0., 20.):
+        f_psd, psd = simulate_demodulated_noise(freqs, 1e-6, freqs, nei, duration=0.5, nuller_residual=1e-3, f_knee=f_knee)
+        band = (f_psd > 100) & (f_psd < 0.4 * f_psd[-1]) # above the 1/f knee, below the roll-off of the channelizer
+        ratio = np.sqrt(np.mean(psd[:, :, band], axis=-1)) / nei
+        print("Demodulated / analytic noise over {} channels, f_knee = {:.0f} Hz: amplitude {:.3f} +- {:.3f}, phase {:.3f} +- {:.3f}".format(
+            len(freqs), f_knee, np.mean(ratio[0]), np.std(ratio[0]), np.mean(ratio[1]), np.std(ratio[1])))
+
+if __name__ == "__main__":
+    local_main()
@@ -0,0 +1,289 @@
+"""
+    Model of a comb of LCR resonators (bolocomb) and its Thévenin-equivalent impedance.
+    Moved out of LiteBIRD_mux_requirements.ipynb (Tijmen de Haan, 2023-08-11) so that
+    it can be imported by other scripts.
+
+    Simplifying assumptions (see the notebook for details):
+     - DAN is working perfectly
+     - each leg of the comb is a simple LCR, all of the R is on the TES island
+     - the comb is in parallel with a resistor and a capacitor (all other current paths)
+     - this combination is in series with a common series inductance and resistance
+     - the comb is biased through a finite bias element (an inductor for LiteBIRD)
+"""
+
+import numpy as np
+from scipy import sparse
+from cache_functions import cached
+import circuit_netlist
+from circuit_netlist import build_comb_netlist
+from circuits_functions import band_indices
+
+pi = np.pi
+
+
+@cached(config_file=None, depends_on=[__file__, circuit_netlist.__file__])
+def compute_z_thev(n_LCR, L, base_frequency, Rs, Rbias, Lbias, Ls, Cpar, Rpar, C, R, freqs_per_block=4096):
+    """Function to calculate the Thévenin-equivalent series impedance seen by each leg of the comb
+
+    The impedance seen by the TES of each leg comes from the netlist of the comb (circuit_netlist.py), all
+    legs at once for freqs_per_block frequencies at a time. compute_z_thev_reference is the closed form.
+    Results are cached on disk (see cache_functions.py), compute_z_thev.uncached always recomputes.
+
+    Args:
+        n_LCR (int): number of LCR legs
+        L (float): inductance of the resonators [H]
+        base_frequency (float): frequency resolution of the bias frequencies [Hz]
+        Rs (float): stray series resistance [Ohm]
+        Rbias (float): bias resistance [Ohm]
+        Lbias (float): bias inductance [H]
+        Ls (float): stray series inductance [H]
+        Cpar (float): parasitic capacitance in parallel with the comb [F]
+        Rpar (float): parasitic resistance in parallel with the comb [Ohm]
+        C (np.ndarray): capacitance of each leg [F]
+        R (np.ndarray): resistance of each leg [Ohm]
+        freqs_per_block (int, optional): number of frequencies evaluated at once, bounds the memory use. Defaults to 4096.
+
+    Returns:
+        z_thev_optimal (np.ndarray): Thévenin-equivalent impedance of each leg where it is purely real [Ohm]
+        f_z_thev_purely_real (np.ndarray): frequency at which that happens, i.e. the optimal bias frequency [Hz]
+    """
+    fmin = 1.5e6
+    fmax = 5.6e6
+    f = np.arange((fmin // base_frequency) * base_frequency, fmax, base_frequency)
+    C = np.broadcast_to(np.asarray(C, dtype=float), (n_LCR,))
+    R = np.broadcast_to(np.asarray(R, dtype=float), (n_LCR,))
+    comb = build_comb_netlist(L, C, R, Rs=Rs, Ls=Ls, Rbias=Rbias, Lbias=Lbias, Cpar=Cpar, Rpar=Rpar).compile()
+
+    legs = ['leg {}'.format(j) for j in range(n_LCR)]
+
+    f_z_thev_purely_real = np.zeros(n_LCR)
+    z_thev_optimal = np.zeros(n_LCR, dtype=np.complex64)
+    smallest_reactance = np.full(n_LCR, np.inf)
+    for start in range(0, len(f), freqs_per_block):
+        block = slice(start, start + freqs_per_block)
+        z_thev = comb.thevenin_impedance(f[block], legs, seen_by_resistance=True)
+        wh_purely_real = np.argmin(np.abs(np.imag(z_thev)), axis=0)
+        reactance = np.abs(np.imag(z_thev[wh_purely_real, np.arange(n_LCR)]))
+        # keep the first frequency with the smallest reactance, as argmin over all the frequencies
+        better = reactance < smallest_reactance
+        smallest_reactance[better] = reactance[better]
+        f_z_thev_purely_real[better] = f[block][wh_purely_real[better]]
+        z_thev_optimal[better] = z_thev[wh_purely_real[better], np.flatnonzero(better)]
+
+    return z_thev_optimal, f_z_thev_purely_real
+
+
+def compute_z_thev_reference(n_LCR, L, base_frequency, Rs, Rbias, Lbias, Ls, Cpar, Rpar, C, R, legs_per_block=16):
+    """Closed form of compute_z_thev, kept as a reference check of the netlist
+
+    The parallel admittance of the whole comb is calculated once, and the admittance of each
+    leg is subtracted from it (leave-one-out), so the cost is n_LCR * number of frequency bins
+    instead of n_LCR^2 * number of frequency bins.
+
+    Args:
+        n_LCR (int): number of LCR legs
+        L (float): inductance of the resonators [H]
+        base_frequency (float): frequency resolution of the bias frequencies [Hz]
+        Rs (float): stray series resistance [Ohm]
+        Rbias (float): bias resistance [Ohm]
+        Lbias (float): bias inductance [H]
+        Ls (float): stray series inductance [H]
+        Cpar (float): parasitic capacitance in parallel with the comb [F]
+        Rpar (float): parasitic resistance in parallel with the comb [Ohm]
+        C (np.ndarray): capacitance of each leg [F]
+        R (np.ndarray): resistance of each leg [Ohm]
+        legs_per_block (int, optional): number of legs evaluated at once, bounds the memory use. Defaults to 16.
+
+    Returns:
+        z_thev_optimal (np.ndarray): Thévenin-equivalent impedance of each leg where it is purely real [Ohm]
+        f_z_thev_purely_real (np.ndarray): frequency at which that happens, i.e. the optimal bias frequency [Hz]
+    """
+    fmin = 1.5e6
+    fmax = 5.6e6
+    f = np.arange((fmin // base_frequency) * base_frequency, fmax, base_frequency)
+    jomega = 2.j * pi * f
+    C = np.broadcast_to(np.asarray(C, dtype=float), (n_LCR,))
+    R = np.broadcast_to(np.asarray(R, dtype=float), (n_LCR,))
+
+    f_z_thev_purely_real = np.zeros(n_LCR)
+    z_thev_optimal = np.zeros(n_LCR, dtype=np.complex64)
+
+    z_s_inv = 1./(Rs + Rbias + jomega * Lbias + jomega * Ls)
+    z_p_inv = jomega * Cpar + 1 / Rpar
+
+    # first pass: total admittance of all the legs, accumulated block by block
+    z_p_inv_all_legs = np.zeros(len(f), dtype=complex)
+    for start in range(0, n_LCR, legs_per_block):
+        legs = slice(start, start + legs_per_block)
+        z_p_inv_all_legs += np.sum(get_leg_admittance(jomega, L, C[legs], R[legs]), axis=1)
+    z_s_inv_plus_z_p_inv = (z_s_inv + z_p_inv + z_p_inv_all_legs)[:, np.newaxis]
+
+    # second pass: remove the contribution of each leg from the total (leave-one-out)
+    for start in range(0, n_LCR, legs_per_block):
+        legs = slice(start, start + legs_per_block)
+        z_p_inv_per_leg = get_leg_admittance(jomega, L, C[legs], R[legs])
+        z_LC = jomega[:, np.newaxis] * L + 1./(jomega[:, np.newaxis] * C[legs])
+        z_thev = z_LC + 1./(z_s_inv_plus_z_p_inv - z_p_inv_per_leg)
+
+        wh_purely_real = np.argmin(np.abs(np.imag(z_thev)), axis=0)
+        f_z_thev_purely_real[legs] = f[wh_purely_real]
+        z_thev_optimal[legs] = z_thev[wh_purely_real, np.arange(z_thev.shape[1])]
+
+    return z_thev_optimal, f_z_thev_purely_real
+
+
+def get_leg_admittance(jomega:np.ndarray, L:float, C:np.ndarray, R:np.ndarray):
+    """Function to calculate the admittance of LCR legs at many frequencies
+
+    Args:
+        jomega (np.ndarray): 2j*pi*frequency, shape (number of frequencies,)
+        L (float): inductance of the resonators [H]
+        C (np.ndarray): capacitance of each leg [F]
+        R (np.ndarray): resistance of each leg [Ohm]
+
+    Returns:
+        Y (np.ndarray): admittance, shape (number of frequencies, number of legs)
+    """
+    jomega = jomega[:, np.newaxis]
+    Y = 1./(jomega * L + R + 1./(jomega * C))
+    return Y
+
+
+class bolocomb:
+    def __init__(self):
+        self.L = 60e-6 # Inductance in Henries
+        self.base_frequency = 20e6/2**18 # Base frequency in Hertz
+        self.frequency_resolution = 20e6/2**30 # Frequency resolution in Hertz
+        self.normalization = 100. # Normalization factor (arbitrary units)
+        self.Rs = 0.005 # Stray series resistance in Ohms
+        self.Ls = 30e-9 # Stray series inductance in Henries
+        self.Cpar = 1500e-12 # Equivalent parasitic capacitance parallel to the comb in Farads
+        self.Rpar = 20. # Equivalent parasitic resistance parallel to the comb in Ohms, 20 Ohms is what we find for the CIMM
+        self.Rbias = 0. # Bias resistor in Ohms, this is zero for LiteBIRD
+        self.Lbias = 5 * 1e-9 # Bias inductance in Henries
+        self.C = np.array([100, 120]) * 1e-12 # LCR parameters for capacitance in Farads
+        self.R = np.array([1, 1]) # LCR parameters for resistance in Ohms
+
+    @property # property decorator ensures the n_LCR attribute is always up to date
+    def n_LCR(self):
+        return len(self.C)
+
+    def admittance(self, f):
+        jomega = 2.j * np.pi * f # Complex phase
+        LRstray = self.Rs + jomega * self.Ls # Stray inductance and resistance
+        LRbias = self.Rbias + jomega * self.Lbias # Bias inductance and resistance
+        Larr = jomega * self.L # Inductance array
+        Zinv = jomega * self.Cpar + 1 / self.Rpar # Inverse impedance for parallel components
+        for C, R in zip(self.C, self.R):
+            Zinv += 1./(Larr + 1./(jomega * C) + R)
+        return self.normalization / (1. + (LRstray + 1./Zinv) / LRbias)
+
+    def z_thev(self, use_cache=True):
+        # use_cache=False for combs that are only evaluated once, e.g. random combs
+        compute = compute_z_thev if use_cache else compute_z_thev.uncached
+        return compute(
+            self.n_LCR, self.L, self.base_frequency, self.Rs, self.Rbias,
+            self.Lbias, self.Ls, self.Cpar, self.Rpar, self.C, self.R)
+
+    def netlist(self):
+        """Function to get the compiled netlist of the comb (see circuit_netlist.py)"""
+        return build_comb_netlist(self.L, np.asarray(self.C), np.broadcast_to(self.R, np.shape(self.C)), Rs=self.Rs, Ls=self.Ls,
+                                  Rbias=self.Rbias, Lbias=self.Lbias, Cpar=self.Cpar, Rpar=self.Rpar).compile()
+
+    def admittance_sensitivity(self, f):
+        """Derivative of the admittance with respect to the resistance of each leg, dY/dR_j
+
+        admittance() is the current into the comb per unit bias current injected at the bias element (times
+        normalization), so dY/dR_j is the resistance sensitivity of the netlist summed over the branches
+        of the comb, at all frequencies and legs at once. admittance_sensitivity_reference is the closed form.
+
+        Args:
+            f (np.ndarray): frequencies [Hz]
+
+        Returns:
+            dY_dR (np.ndarray): complex sensitivity, shape (number of frequencies, n_LCR)
+        """
+        comb = self.netlist()
+        legs = ['leg {}'.format(j) for j in range(self.n_LCR)]
+        dI_dR = comb.resistance_sensitivity(np.atleast_1d(f), currents={'bias' : self.normalization},
+                                            outputs=['Cpar', 'Rpar'] + legs, resistors=legs)
+        return np.sum(dI_dR, axis=-2)
+
+    def admittance_sensitivity_reference(self, f):
+        """Closed form of admittance_sensitivity, kept as a reference check of the netlist:
+        dY/dR_j = -normalization / (A^2 * Zinv^2 * LRbias * Z_j^2), with A = 1 + (LRstray + 1/Zinv)/LRbias
+
+        Args:
+            f (np.ndarray): frequencies [Hz]
+
+        Returns:
+            dY_dR (np.ndarray): complex sensitivity, shape (number of frequencies, n_LCR)
+        """
+        jomega = 2.j * np.pi * np.atleast_1d(f) # Complex phase
+        LRstray = self.Rs + jomega * self.Ls # Stray inductance and resistance
+        LRbias = self.Rbias + jomega * self.Lbias # Bias inductance and resistance
+        Z_legs = 1./get_leg_admittance(jomega, self.L, np.asarray(self.C), np.asarray(self.R)) # impedance of each leg
+        Zinv = jomega * self.Cpar + 1 / self.Rpar + np.sum(1./Z_legs, axis=1) # Inverse impedance of the whole comb
+        A = 1. + (LRstray + 1./Zinv) / LRbias
+        common_factor = -self.normalization / (A**2 * Zinv**2 * LRbias)
+        return common_factor[:, np.newaxis] / Z_legs**2
+
+    def xtalk_matrix(self, band=None, bias_freqs=None):
+        """Crosstalk matrix of the comb, xtalk_ij = (dY/dR_j) / (dY/dR_i) evaluated at the bias frequency of leg i
+
+        All the factors common to the comb cancel in the ratio, so xtalk_ij = (Z_i/Z_j)^2 with Z the leg impedances
+        at the bias frequency of leg i. The dense matrix comes from admittance_sensitivity (the netlist), the banded
+        one from this closed form. No state is modified, unlike the finite difference in the notebook.
+
+        Args:
+            band (int, optional): if given, only neighbours with |i-j| <= band are calculated and a
+                sparse matrix is returned. Defaults to None (full dense matrix).
+            bias_freqs (np.ndarray, optional): bias frequencies of the legs [Hz]. Defaults to the optimal
+                bias frequencies from z_thev().
+
+        Returns:
+            xtalk (np.ndarray or scipy.sparse.csr_matrix): complex crosstalk matrix of shape (n_LCR, n_LCR),
+                rows are the biased leg i and columns the leg j whose resistance changes
+        """
+        if bias_freqs is None:
+            _,bias_freqs = self.z_thev()
+        C = np.asarray(self.C, dtype=float)
+        R = np.broadcast_to(np.asarray(self.R, dtype=float), C.shape)
+        jomega = 2.j * np.pi * np.asarray(bias_freqs)
+
+        if band is None:
+            dY_dR = self.admittance_sensitivity(bias_freqs) # dY_dR[i, j]: leg j at bias frequency i
+            return dY_dR / np.diag(dY_dR)[:, np.newaxis]
+
+        # only the diagonals within the band
+        rows, cols = band_indices(self.n_LCR, band)
+        Z_i = jomega[rows] * self.L + R[rows] + 1./(jomega[rows] * C[rows])
+        Z_j = jomega[rows] * self.L + R[cols] + 1./(jomega[rows] * C[cols])
+        return sparse.csr_matrix(((Z_i / Z_j)**2, (rows, cols)), shape=(self.n_LCR, self.n_LCR))
+
+    def xtalk(self):
+        """Nearest-neighbour crosstalk, xtalk_{i,i+1}, taken from the analytic crosstalk matrix"""
+        nearest_neighbor_xtalk = self.xtalk_matrix(band=1).diagonal(k=1)
+        return nearest_neighbor_xtalk.astype(np.complex64)
+
+
+def local_main():
+    # check the netlist against the closed forms for the default comb with 40 legs
+    comb = bolocomb()
+    comb.C = 1 / ((2*pi*np.linspace(1.6e6, 5.4e6, 40))**2 * comb.L)
+    comb.R = np.ones(40)
+    args = (comb.n_LCR, comb.L, comb.base_frequency, comb.Rs, comb.Rbias, comb.Lbias, comb.Ls, comb.Cpar, comb.Rpar, comb.C, comb.R)
+    z_thev, f_bias = compute_z_thev.uncached(*args)
+    z_thev_reference, f_bias_reference = compute_z_thev_reference(*args)
+    print("Thévenin impedance: max relative difference {:.1e}, same bias frequencies: {}".format(
+        np.max(np.abs(z_thev / z_thev_reference - 1)), np.array_equal(f_bias, f_bias_reference)))
+    dY_dR = comb.admittance_sensitivity(f_bias)
+    dY_dR_reference = comb.admittance_sensitivity_reference(f_bias)
+    print("dY/dR: max relative difference {:.1e}".format(np.max(np.abs(dY_dR / dY_dR_reference - 1))))
+    xtalk = comb.xtalk_matrix(bias_freqs=f_bias)
+    xtalk_banded = comb.xtalk_matrix(band=comb.n_LCR, bias_freqs=f_bias).toarray()
+    print("crosstalk matrix: max difference with the closed form {:.1e}".format(np.max(np.abs(xtalk - xtalk_banded))))
+
+
+if __name__ == "__main__":
+    local_main()
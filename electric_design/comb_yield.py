@@ -0,0 +1,347 @@
+"""
+    Monte-Carlo yield analysis of random bolocombs.
+    Generalizes the random_bolocomb() cell in LiteBIRD_mux_requirements.ipynb:
+    combs are drawn from configurable distributions, checked against the Thévenin-equivalent
+    impedance and crosstalk targets, and the pass/fail statistics are accumulated in histograms.
+    Draws are evaluated in batches over a process pool. Every batch has its own seed, so the
+    result does not depend on the number of workers, and an interrupted run can be resumed
+    from its checkpoint file.
+"""
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from electric_design.bolocomb import bolocomb
+
+# outcome of each comb, same categories as the notebook
+BOTH_PASSED = 0
+XTALK_FAILED = 1
+THEV_FAILED = 2
+BOTH_FAILED = 3
+OUTCOME_LABELS = ['both passed', 'crosstalk failed', 'series impedance failed', 'both failed']
+
+
+class CombDistribution:
+    """
+    Distributions the random combs are drawn from. Defaults follow random_bolocomb() in the notebook.
+    Ranges are (low, high) of uniform distributions, scales are the mean of exponential distributions.
+    """
+    def __init__(self, num_legs_range=(58, 68), R_range=(0.4, 1.0), R_scatter_range=(0., 0.2),
+                 min_frequency_range=(1.6e6, 1.8e6), max_frequency_range=(5.0e6, 5.6e6),
+                 frequency_scatter_range=(1e3, 10e3), log_spacing_probability=0.5,
+                 Rs_scale=0.005, Ls_scale=20e-9, Cpar_range=(800e-12, 1500e-12), Rpar_range=(20., 25.),
+                 Lbias_range=(3.8e-9, 5e-9), Rbias=0.):
+        self.num_legs_range = num_legs_range # number of LCR legs, both ends included
+        self.R_range = R_range # [Ohm] operating resistance, the same for all legs
+        self.R_scatter_range = R_scatter_range # fractional scatter in R
+        self.min_frequency_range = min_frequency_range # [Hz] lowest bias frequency
+        self.max_frequency_range = max_frequency_range # [Hz] highest bias frequency
+        self.frequency_scatter_range = frequency_scatter_range # [Hz] scatter on the resonant frequencies
+        self.log_spacing_probability = log_spacing_probability # probability of log-uniform instead of uniform spacing
+        self.Rs_scale = Rs_scale # [Ohm] stray series resistance
+        self.Ls_scale = Ls_scale # [H] stray series inductance
+        self.Cpar_range = Cpar_range # [F] parasitic capacitance parallel to the comb
+        self.Rpar_range = Rpar_range # [Ohm] parasitic resistance parallel to the comb
+        self.Lbias_range = Lbias_range # [H] bias inductance
+        self.Rbias = Rbias # [Ohm] bias resistor, zero for LiteBIRD
+
+    def draw(self, rng:np.random.Generator):
+        """Function to draw one random comb
+
+        Args:
+            rng (np.random.Generator): random number generator
+
+        Returns:
+            this_bolocomb (bolocomb): the random comb
+        """
+        this_bolocomb = bolocomb()
+        num_legs = rng.integers(self.num_legs_range[0], self.num_legs_range[1] + 1)
+        R = rng.uniform(*self.R_range)
+        R_scatter = rng.uniform(*self.R_scatter_range)
+        R_values = R * (1 + rng.normal(0, R_scatter, num_legs))
+
+        min_frequency = rng.uniform(*self.min_frequency_range)
+        max_frequency = rng.uniform(*self.max_frequency_range)
+        frequency_scatter = rng.uniform(*self.frequency_scatter_range)
+        if rng.uniform() < self.log_spacing_probability:
+            frequencies = np.geomspace(min_frequency, max_frequency, num_legs)
+        else:
+            frequencies = np.linspace(min_frequency, max_frequency, num_legs)
+        frequencies += rng.normal(0, frequency_scatter, num_legs)
+
+        this_bolocomb.C = 1 / ((2 * np.pi * frequencies) ** 2 * this_bolocomb.L)
+        this_bolocomb.R = R_values
+        this_bolocomb.Rs = rng.exponential(self.Rs_scale)
+        this_bolocomb.Ls = rng.exponential(self.Ls_scale)
+        this_bolocomb.Cpar = rng.uniform(*self.Cpar_range)
+        this_bolocomb.Rpar = rng.uniform(*self.Rpar_range)
+        this_bolocomb.Rbias = self.Rbias
+        this_bolocomb.Lbias = rng.uniform(*self.Lbias_range)
+        return this_bolocomb
+
+
+class YieldStatistics:
+    """
+    Pass/fail counts and histograms accumulated over many combs.
+    Only histograms are kept, so the memory use does not grow with the number of draws.
+    """
+    def __init__(self, z_thev_bins=None, xtalk_bins=None, R_bins=None, Ls_bins=None):
+        self.z_thev_bins = np.linspace(0, 0.2, 81) if z_thev_bins is None else np.asarray(z_thev_bins) # [Ohm]
+        self.xtalk_bins = np.geomspace(1e-6, 1e-1, 81) if xtalk_bins is None else np.asarray(xtalk_bins)
+        self.R_bins = np.linspace(0.2, 1.2, 51) if R_bins is None else np.asarray(R_bins) # [Ohm]
+        self.Ls_bins = np.linspace(0, 100e-9, 51) if Ls_bins is None else np.asarray(Ls_bins) # [H]
+
+        n_outcomes = len(OUTCOME_LABELS)
+        self.counts = np.zeros(n_outcomes, dtype=np.int64)
+        self.z_thev_hist = np.zeros(len(self.z_thev_bins) - 1, dtype=np.int64)
+        self.xtalk_hist = np.zeros(len(self.xtalk_bins) - 1, dtype=np.int64)
+        self.R_Ls_hist = np.zeros((n_outcomes, len(self.R_bins) - 1, len(self.Ls_bins) - 1), dtype=np.int64)
+        self.completed_batches = set()
+
+    @property
+    def num_combs(self):
+        return int(np.sum(self.counts))
+
+    @property
+    def yield_fraction(self):
+        """Fraction of the combs that passed both requirements"""
+        return self.counts[BOTH_PASSED] / max(self.num_combs, 1)
+
+    def update(self, batch_index:int, results:dict):
+        """Function to add the results of one batch of combs to the statistics
+
+        Args:
+            batch_index (int): index of the batch
+            results (dict): output of evaluate_batch()
+        """
+        self.counts += np.bincount(results['outcome'], minlength=len(self.counts))
+        self.z_thev_hist += np.histogram(results['z_thev_max'], bins=self.z_thev_bins)[0]
+        self.xtalk_hist += np.histogram(results['xtalk_max'], bins=self.xtalk_bins)[0]
+        for outcome in range(len(self.counts)):
+            this_outcome = results['outcome'] == outcome
+            self.R_Ls_hist[outcome] += np.histogram2d(results['R_median'][this_outcome], results['Ls'][this_outcome],
+                                                      bins=(self.R_bins, self.Ls_bins))[0].astype(np.int64)
+        self.completed_batches.add(batch_index)
+
+    def save(self, filename:str, **metadata):
+        """Function to save the statistics to a checkpoint file. Written to a temporary file first
+        so that an interrupted save does not corrupt the previous checkpoint.
+
+        Args:
+            filename (str): name of the checkpoint file (.npz)
+            metadata: extra values stored with the checkpoint (seed, targets, ...)
+        """
+        temporary_file = filename + '.tmp.npz'
+        np.savez(temporary_file, counts=self.counts, z_thev_bins=self.z_thev_bins, xtalk_bins=self.xtalk_bins,
+                 R_bins=self.R_bins, Ls_bins=self.Ls_bins, z_thev_hist=self.z_thev_hist, xtalk_hist=self.xtalk_hist,
+                 R_Ls_hist=self.R_Ls_hist, completed_batches=np.array(sorted(self.completed_batches), dtype=np.int64),
+                 **metadata)
+        os.replace(temporary_file, filename)
+
+    @classmethod
+    def load(cls, filename:str):
+        """Function to load statistics from a checkpoint file
+
+        Args:
+            filename (str): name of the checkpoint file (.npz)
+
+        Returns:
+            stats (YieldStatistics): the statistics
+            metadata (dict): the extra values stored with the checkpoint
+        """
+        with np.load(filename) as data:
+            stats = cls(data['z_thev_bins'], data['xtalk_bins'], data['R_bins'], data['Ls_bins'])
+            stats.counts = data['counts']
+            stats.z_thev_hist = data['z_thev_hist']
+            stats.xtalk_hist = data['xtalk_hist']
+            stats.R_Ls_hist = data['R_Ls_hist']
+            stats.completed_batches = set(data['completed_batches'].tolist())
+            metadata = {key: data[key] for key in data.files if key not in
+                        ('counts', 'z_thev_bins', 'xtalk_bins', 'R_bins', 'Ls_bins', 'z_thev_hist',
+                         'xtalk_hist', 'R_Ls_hist', 'completed_batches')}
+        return stats, metadata
+
+
+def evaluate_comb(this_bolocomb:bolocomb, Rthev_target:float=0.05, xtalk_target:float=3e-3, xtalk_band:int=1):
+    """Function to check a comb against the Thévenin-equivalent impedance and crosstalk requirements
+
+    Args:
+        this_bolocomb (bolocomb): the comb
+        Rthev_target (float, optional): maximum Thévenin-equivalent impedance [Ohm]. Defaults to 0.05 (50 mOhm).
+        xtalk_target (float, optional): maximum in-phase crosstalk. Defaults to 3e-3 (0.3% as in PTEP).
+        xtalk_band (int, optional): neighbours on each side included in the crosstalk. Defaults to 1.
+
+    Returns:
+        z_thev_max (float): largest |Z_thev| of the comb [Ohm]
+        xtalk_max (float): largest in-phase crosstalk between neighbours
+        outcome (int): one of BOTH_PASSED, XTALK_FAILED, THEV_FAILED, BOTH_FAILED
+    """
+    z, bias_freqs = this_bolocomb.z_thev(use_cache=False) # random combs are never seen twice
+    z_thev_max = np.max(np.abs(z))
+
+    xtalk = this_bolocomb.xtalk_matrix(band=xtalk_band, bias_freqs=bias_freqs)
+    xtalk.setdiag(0)
+    xtalk_max = np.max(np.abs(np.real(xtalk.data)))
+
+    pass_thev = z_thev_max < Rthev_target
+    pass_xtalk = xtalk_max < xtalk_target
+    outcome = (not pass_xtalk) + 2 * (not pass_thev)
+    return z_thev_max, xtalk_max, outcome
+
+
+def evaluate_batch(distribution:CombDistribution, seed:int, batch_index:int, batch_size:int,
+                   Rthev_target:float=0.05, xtalk_target:float=3e-3, xtalk_band:int=1):
+    """Function to draw and evaluate one batch of combs. Runs in the worker processes.
+
+    The random numbers of each batch only depend on (seed, batch_index), so the results do not
+    depend on how the batches are distributed over the workers.
+
+    Returns:
+        results (dict): arrays z_thev_max, xtalk_max, outcome, R_median and Ls, one entry per comb
+    """
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(batch_index,)))
+    results = {
+        'z_thev_max' : np.zeros(batch_size),
+        'xtalk_max' : np.zeros(batch_size),
+        'outcome' : np.zeros(batch_size, dtype=np.int64),
+        'R_median' : np.zeros(batch_size),
+        'Ls' : np.zeros(batch_size),
+    }
+    for i in range(batch_size):
+        this_bolocomb = distribution.draw(rng)
+        results['z_thev_max'][i], results['xtalk_max'][i], results['outcome'][i] = \
+            evaluate_comb(this_bolocomb, Rthev_target, xtalk_target, xtalk_band)
+        results['R_median'][i] = np.median(this_bolocomb.R)
+        results['Ls'][i] = this_bolocomb.Ls
+    return results
+
+
+def run_yield_analysis(num_combs:int, distribution:CombDistribution=None, Rthev_target:float=0.05,
+                       xtalk_target:float=3e-3, xtalk_band:int=1, batch_size:int=50, n_workers:int=None,
+                       seed:int=0, checkpoint_file:str=None, checkpoint_every:int=10, callback=None):
+    """Function to run the Monte-Carlo yield analysis over a process pool
+
+    Args:
+        num_combs (int): number of combs to draw
+        distribution (CombDistribution, optional): where the combs are drawn from. Defaults to CombDistribution().
+        Rthev_target (float, optional): maximum Thévenin-equivalent impedance [Ohm]. Defaults to 0.05.
+        xtalk_target (float, optional): maximum in-phase crosstalk. Defaults to 3e-3.
+        xtalk_band (int, optional): neighbours on each side included in the crosstalk. Defaults to 1.
+        batch_size (int, optional): combs per batch sent to a worker. Defaults to 50.
+        n_workers (int, optional): number of worker processes, 1 runs everything in this process.
+            Defaults to os.cpu_count().
+        seed (int, optional): seed of the whole run. Defaults to 0.
+        checkpoint_file (str, optional): if given, statistics are saved there every checkpoint_every batches
+            and an existing checkpoint is resumed. The checkpoint must have the same num_combs, batch_size,
+            seed, targets and distribution, otherwise a ValueError is raised. Defaults to None.
+        checkpoint_every (int, optional): number of batches between checkpoints. Defaults to 10.
+        callback (callable, optional): called as callback(stats) after every batch, e.g. to print progress.
+
+    Returns:
+        stats (YieldStatistics): accumulated pass/fail counts and histograms
+    """
+    if distribution is None:
+        distribution = CombDistribution()
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    n_batches = int(np.ceil(num_combs / batch_size))
+    metadata = {'num_combs': num_combs, 'seed': seed, 'batch_size': batch_size, 'Rthev_target': Rthev_target,
+                'xtalk_target': xtalk_target, 'xtalk_band': xtalk_band}
+    # the combs of a resumed run must come from the same distribution. num_combs is fixed too: a partial last
+    # batch of the checkpoint would count as completed and never be topped up to a larger num_combs
+    metadata.update({'distribution_' + name: value for name, value in vars(distribution).items()})
+
+    stats = YieldStatistics()
+    if checkpoint_file is not None and os.path.exists(checkpoint_file):
+        stats, saved_metadata = YieldStatistics.load(checkpoint_file)
+        for key, value in metadata.items():
+            if key in saved_metadata and not np.array_equal(saved_metadata[key], value):
+                raise ValueError("checkpoint {} was made with {}={}, not {}".format(
+                    checkpoint_file, key, saved_metadata[key], value))
+
+    todo = [b for b in range(n_batches) if b not in stats.completed_batches]
+
+    def batch_done(batch_index, results):
+        stats.update(batch_index, results)
+        if callback is not None:
+            callback(stats)
+        if checkpoint_file is not None and len(stats.completed_batches) % checkpoint_every == 0:
+            stats.save(checkpoint_file, **metadata)
+
+    def this_batch_size(batch_index):
+        return min(batch_size, num_combs - batch_index * batch_size)
+
+    if n_workers == 1:
+        for batch_index in todo:
+            batch_done(batch_index, evaluate_batch(distribution, seed, batch_index, this_batch_size(batch_index),
+                                                   Rthev_target, xtalk_target, xtalk_band))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            # keep a limited number of batches in flight so that results stream back as they finish
+            pending = {}
+            todo = iter(todo)
+            while True:
+                for batch_index in todo:
+                    future = executor.submit(evaluate_batch, distribution, seed, batch_index,
+                                             this_batch_size(batch_index), Rthev_target, xtalk_target, xtalk_band)
+                    pending[future] = batch_index
+                    if len(pending) >= 2 * n_workers:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch_done(pending.pop(future), future.result())
+
+    if checkpoint_file is not None:
+        stats.save(checkpoint_file, **metadata)
+    return stats
+
+
+def plot_yield_statistics(stats:YieldStatistics, Rthev_target:float=0.05, xtalk_target:float=3e-3):
+    """Function to plot the histograms of a yield analysis"""
+    from matplotlib import pyplot as plt
+
+    fig, axs = plt.subplots(1, 3, figsize=(15, 4))
+    axs[0].stairs(stats.z_thev_hist, stats.z_thev_bins)
+    axs[0].axvline(Rthev_target, color='green', label='Target')
+    axs[0].set_xlabel('Maximum Thévenin-equivalent impedance ($\\Omega$)')
+    axs[0].legend()
+    axs[1].stairs(stats.xtalk_hist, stats.xtalk_bins)
+    axs[1].axvline(xtalk_target, color='green', label='Target')
+    axs[1].set_xscale('log')
+    axs[1].set_xlabel('Maximum in-phase crosstalk')
+    axs[1].legend()
+    colors = ['green', 'orange', 'blue', 'red']
+    R_centers = (stats.R_bins[1:] + stats.R_bins[:-1]) / 2
+    Ls_centers = (stats.Ls_bins[1:] + stats.Ls_bins[:-1]) / 2
+    for outcome, color in enumerate(colors):
+        i, j = np.nonzero(stats.R_Ls_hist[outcome])
+        axs[2].scatter(R_centers[i], Ls_centers[j] * 1e9, s=5 + stats.R_Ls_hist[outcome][i, j],
+                       color=color, alpha=0.5, label=OUTCOME_LABELS[outcome])
+    axs[2].set_xlabel('Operating Resistance ($\\Omega$)')
+    axs[2].set_ylabel('Common Series Inductance (nH)')
+    axs[2].legend()
+    fig.suptitle('Yield {:.1f}% of {} combs'.format(stats.yield_fraction * 100, stats.num_combs))
+    fig.tight_layout()
+    return fig
+
+
+def local_main():
+    """
+    local main to test functionality of the yield analysis
+    """
+    def print_progress(stats):
+        print("{} combs, yield {:.1f}%".format(stats.num_combs, stats.yield_fraction * 100))
+
+    stats = run_yield_analysis(1000, checkpoint_file='comb_yield_checkpoint.npz', callback=print_progress)
+    for label, count in zip(OUTCOME_LABELS, stats.counts):
+        print("{}: {}".format(label, count))
+
+    from matplotlib import pyplot as plt
+    plot_yield_statistics(stats)
+    plt.show()
+
+
+if __name__ == "__main__":
+    local_main()
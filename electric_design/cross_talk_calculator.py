@@ -7,8 +7,11 @@
 import yaml
 import numpy as np
 from matplotlib import pyplot as plt
-from circuits_functions import series, parallel, get_C_from_bias_freq_and_L
-from load_data_functions import read_yaml_file
+from scipy import sparse
+import circuits_functions
+from circuits_functions import series, parallel, get_C_from_bias_freq_and_L, band_indices
+from load_data_functions import read_yaml_file, load_schedule
+from cache_functions import cached
 
 pi = np.pi
 
@@ -18,7 +21,7 @@ def local_main():
     local main to test functionality of cross talk functions
     """
     
-    f_bias_spacing = 'logarithmic' #'linear' # spacing between channels. Options: 'linear' , 'logarithmic' (not yet available)
+    f_bias_spacing = 'logarithmic' #'linear' # spacing between channels. Options: 'linear' , 'logarithmic', 'schedule' (from frequency_schedule.py)
     
     print("\n\n ------ Welcome ------ \nLet's calculate cross talk!")
     
@@ -31,59 +34,24 @@ def local_main():
     print("data: ", d)
     
     # create bias frequency array
-    f_bias_array = create_f_bias_array(d['freq_bias_range'], d['mux_factor'], f_bias_spacing)
+    f_bias_array = create_f_bias_array(d['freq_bias_range'], d['mux_factor'], f_bias_spacing, 'frequency_schedule.yaml')
     print("f_bias_array: ", f_bias_array)
     
     # get array of capacitor values
     C_array = get_C_from_bias_freq_and_L(f_bias_array, d['L_res'])
     #print("C array: ", C_array)
     
-    # get V_bias -- what is a good number for it?????
-    V_bias_array = np.ones(d['mux_factor'])
+    # CALCULATE THE CROSS TALK BETWEEN ALL PAIRS OF CHANNELS
+    # ctf_LCX_matrix[i, n]: cross talk fraction of channel i from neighbor n, at the bias frequency of channel i
+    ctf_LCX_matrix = calculate_cross_talk_matrix_LCX(f_bias_array, d['L_res'], R_tes, d['r_s'], d['L_stray'], C_array)
     
-    # INITIALIZE ARRAYS TO STORE DATA
-    LCX_array = np.zeros(d['mux_factor']) # array of leakage current
-    ctf_LCX_array = np.zeros(d['mux_factor']) # array of cross talk fraction (leakage current)
-    
-    
-    # CALCULATE THINGS FOR EACH CHANNEL
-    for channel in range(0, d['mux_factor']-1):
-        # get frequency
-        omega = 2*pi*f_bias_array[channel]
-        
-        # get voltage bias at frequency 'i'
-        V_bias = V_bias_array[channel]
-            
-        # PARASITICS
-        Z_com = omega * d['L_stray'] * 1j   
-        
-        # ON RESONANCE:
-        C_i = C_array[channel] # capacitance of on-resonance circuit
-        Z_i = R_tes + d['r_s'] + 1j * omega * d['L_res'] + 1/(1j * omega * C_i) + Z_com
-        
-        
-        # GET THE OFF RESONANCE COMPONENTS:
-        # get impedance
-        C_n = C_array[channel+1]  # capacitance of neighbor (pick the one to the right of it for simplicity, it could be +1  or - 1.
-        Z_n = R_tes + d['r_s'] + 1j * omega * d['L_res'] + 1/(1j * omega * C_n) + Z_com
-
-        # Calculate the leakage function
-        # LCX_array[channel] = calculate_leakage_function(omega, V_bias, Z_com, R_tes, d['L_res'], C_n, d['r_s'])
-                
-        # Calculate the leakage current cross talk fraction
-        ctf_LCX = calculate_cross_talk_fraction_LCX(Z_i, Z_n, Z_com)
-        
-        ctf_LCX_array[channel] = abs(ctf_LCX)
-
-    
-    # plt.figure(1)
-    # plt.plot(f_bias_array[0:-1]/1e6, LCX_array[0:-1])
-    # plt.ylabel('Leakage Current (uncalibrated units)')
-    # plt.xlabel("Bias frequency [MHz]")
+    # worst neighbor of each channel
+    np.fill_diagonal(ctf_LCX_matrix, 0)
+    ctf_LCX_array = np.max(np.abs(ctf_LCX_matrix), axis=1)
     
     plt.figure(2)
-    plt.plot(f_bias_array[0:-1]/1e6, ctf_LCX_array[0:-1] * 100)
-    plt.ylabel('Cross talk fraction (leakage current) [%]')
+    plt.plot(f_bias_array/1e6, ctf_LCX_array * 100)
+    plt.ylabel('Worst neighbor cross talk fraction (leakage current) [%]')
     plt.xlabel('Bias frequency [MHz]')
     
     
@@ -91,6 +59,63 @@ def local_main():
     plt.show()
     return 0
 
+@cached(config_file=None, depends_on=[__file__, circuits_functions.__file__])
+def calculate_cross_talk_matrix_LCX(f_bias_array:np.ndarray, L_res:float, R_tes:float, r_s:float=0.0, L_stray:float=0.0,
+                                    C_array:np.ndarray=None, band:int=None, all_frequencies:bool=False):
+    """
+    Function to calculate the leakage current cross talk fraction between all pairs of channels in one broadcast
+    ctf[i, n] = calculate_cross_talk_fraction_LCX(Z_i, Z_n, Z_com), all impedances evaluated at the bias frequency of channel i
+
+    Args:
+        f_bias_array (np.ndarray): bias frequencies [Hz], e.g. from create_f_bias_array
+        L_res (float): inductance of resonators [H]
+        R_tes (float): resistance of TES [ohms]
+        r_s (float, optional): stray resistance in series with each TES [ohms]. Defaults to 0.0.
+        L_stray (float, optional): stray inductance in series with all TESs (Z_com) [H]. Defaults to 0.0.
+        C_array (np.ndarray, optional): capacitance of the resonators [F]. Defaults to the values
+            from get_C_from_bias_freq_and_L.
+        band (int, optional): only calculate neighbors with |i-n| <= band and return a sparse matrix,
+            for very high mux factors. Defaults to None (dense matrix).
+        all_frequencies (bool, optional): evaluate the impedances at every bias frequency instead,
+            returns ctf[k, i, n] at the bias frequency of channel k. Defaults to False.
+
+    Returns:
+        ctf (np.ndarray or scipy.sparse.csr_matrix): complex cross talk fractions, shape (mux_factor, mux_factor)
+            or (mux_factor, mux_factor, mux_factor) if all_frequencies
+            Results are cached on disk (see cache_functions.py)
+    """
+    f_bias_array = np.asarray(f_bias_array)
+    mux_factor = len(f_bias_array)
+    if C_array is None:
+        C_array = get_C_from_bias_freq_and_L(f_bias_array, L_res)
+    C_array = np.asarray(C_array)
+    
+    def impedance(omega, C):
+        # impedance of TES + resonator, and the common impedance
+        Z_com = omega * L_stray * 1j
+        return R_tes + r_s + 1j * omega * L_res + 1/(1j * omega * C) + Z_com, Z_com
+    
+    omega = 2*pi*f_bias_array
+    if all_frequencies:
+        if band is not None:
+            raise ValueError("band is not available with all_frequencies")
+        omega_k = omega[:, np.newaxis, np.newaxis]
+        Z_i, Z_com = impedance(omega_k, C_array[np.newaxis, :, np.newaxis])
+        Z_n, _ = impedance(omega_k, C_array[np.newaxis, np.newaxis, :])
+        return calculate_cross_talk_fraction_LCX(Z_i, Z_n, Z_com)
+    
+    if band is None:
+        Z_i, Z_com = impedance(omega[:, np.newaxis], C_array[:, np.newaxis])
+        Z_n, _ = impedance(omega[:, np.newaxis], C_array[np.newaxis, :])
+        return calculate_cross_talk_fraction_LCX(Z_i, Z_n, Z_com)
+    
+    # banded: only the diagonals |i-n| <= band
+    rows, cols = band_indices(mux_factor, band)
+    Z_i, Z_com = impedance(omega[rows], C_array[rows])
+    Z_n, _ = impedance(omega[rows], C_array[cols])
+    ctf = calculate_cross_talk_fraction_LCX(Z_i, Z_n, Z_com)
+    return sparse.csr_matrix((ctf, (rows, cols)), shape=(mux_factor, mux_factor))
+
 def calculate_cross_talk_fraction_LCX(Z_i:float, Z_n:float, Z_com:float=0.0):
     """
     Function to calculate the approximate cross talk fraction: dI_i,n,LCX/dI_i,signal
@@ -125,13 +150,14 @@ def calculate_leakage_function(omega, V_bias, Z_com, R_tes, L_res:float, C_n:np.
     return leakage_current
 
 
-def create_f_bias_array(freq_bias_range, mux_factor: int =40, f_bias_spacing: str='linear'):
+def create_f_bias_array(freq_bias_range, mux_factor: int =40, f_bias_spacing: str='linear', schedule_file: str=None):
     """Function to create an array of frequency bias
 
     Args:
         freq_bias_range (_type_): array with range of bias frequency [start, end]
         mux_factor (int) : number of channels -- set to 40 by default
-        f_bias_spacing (str): type of spacing between channels (ex: 'linear', 'logarithmic')
+        f_bias_spacing (str): type of spacing between channels (ex: 'linear', 'logarithmic', 'schedule')
+        schedule_file (str) : yaml file written by frequency_schedule.py, used when f_bias_spacing is 'schedule'
     """
     
     if f_bias_spacing == 'linear':        
@@ -139,10 +165,15 @@ def create_f_bias_array(freq_bias_range, mux_factor: int =40, f_bias_spacing: st
         #print("f_bias: ", f_bias_array)
     
     elif f_bias_spacing == "logarithmic":
-        print("\n\n hey yo")
         #logspace = np.logspace(np.log(freq_bias_range[0]), np.log(freq_bias_range[1]), mux_factor)
         #print("logspace: ", logspace)
         f_bias_array = np.geomspace(freq_bias_range[0], freq_bias_range[1], mux_factor)
+    
+    elif f_bias_spacing == "schedule":
+        # optimized frequency schedule
+        f_bias_array = load_schedule(schedule_file)
+        if len(f_bias_array) != mux_factor:
+            raise ValueError("the schedule in {} has {} channels, not {}".format(schedule_file, len(f_bias_array), mux_factor))
     else:
         print("sorry, I don't know how to calculate that yet")
         
@@ -0,0 +1,301 @@
+"""
+    Solver for the placement of the bias frequencies (frequency schedule) of a comb.
+    create_f_bias_array only knows linear and logarithmic spacing. Here the mux_factor bias frequencies
+    are moved inside freq_bias_range to minimize the worst leakage current cross talk
+    (cross_talk_calculator) and the worst Thévenin-equivalent resistance seen by the TESs (bolocomb),
+    over Monte-Carlo realizations of the capacitor fabrication scatter.
+    The schedule is saved as a yaml file that can be read back with load_schedule (load_data_functions.py),
+    which the noise tools (DfMux, nei_margin, dfmux_timestream) use, or with
+    create_f_bias_array(..., f_bias_spacing='schedule').
+"""
+
+import numpy as np
+import yaml
+from electric_design.bolocomb import bolocomb
+from electric_design.cross_talk_calculator import calculate_cross_talk_fraction_LCX, create_f_bias_array
+from load_data_functions import read_yaml_file
+
+pi = np.pi
+
+
+class FrequencyScheduleSolver:
+    """
+    Local search for the frequency schedule with the lowest worst-case cost, where the cost is
+    max(worst cross talk / xtalk_target, worst Re(Z_thev) / r_thev_target) over all channels and
+    all capacitor scatter realizations.
+
+    Each channel is biased at the actual resonance of its fabricated capacitor,
+    f_actual = f_bias / sqrt(1 + scatter), so the scatter moves the bias frequencies of every realization.
+    When one frequency moves, only the row and column of that channel in the cross talk and
+    admittance matrices are recalculated.
+    """
+    def __init__(self, mux_factor:int=68, freq_bias_range=(1.5e6, 5.5e6), L_res:float=60e-6, R_tes:float=1.,
+                 r_s:float=0., L_stray:float=0., comb:bolocomb=None, capacitor_scatter:float=0.002,
+                 n_realizations:int=16, xtalk_target:float=3e-3, r_thev_target:float=0.05, grid:float=None, seed:int=0):
+        """
+        Args:
+            mux_factor (int, optional): number of channels. Defaults to 68.
+            freq_bias_range (tuple, optional): [lowest, highest] bias frequency [Hz]
+            L_res (float, optional): inductance of the resonators [H]. Defaults to 60e-6.
+            R_tes (float, optional): resistance of the TESs [Ohm]. Defaults to 1.
+            r_s (float, optional): stray resistance in series with each TES [Ohm]. Defaults to 0.
+            L_stray (float, optional): stray inductance in series with all TESs (Z_com) [H]. Defaults to 0.
+            comb (bolocomb, optional): comb with the parasitics (Rs, Ls, Rbias, Lbias, Cpar, Rpar) used for
+                the Thévenin-equivalent impedance. Defaults to bolocomb().
+            capacitor_scatter (float, optional): relative rms scatter of the fabricated capacitors. Defaults to 0.002.
+            n_realizations (int, optional): number of capacitor scatter realizations. Defaults to 16.
+            xtalk_target (float, optional): maximum leakage current cross talk. Defaults to 3e-3.
+            r_thev_target (float, optional): maximum Thévenin-equivalent resistance [Ohm]. Defaults to 0.05.
+            grid (float, optional): frequencies are rounded to multiples of grid [Hz], e.g. comb.base_frequency.
+                Defaults to None (no rounding).
+            seed (int, optional): random seed of the capacitor scatter. Defaults to 0.
+        """
+        self.mux_factor = mux_factor
+        self.freq_bias_range = freq_bias_range
+        self.L_res = L_res
+        self.R_tes = R_tes
+        self.r_s = r_s
+        self.L_stray = L_stray
+        self.comb = comb if comb is not None else bolocomb()
+        self.capacitor_scatter = capacitor_scatter
+        self.xtalk_target = xtalk_target
+        self.r_thev_target = r_thev_target
+        self.grid = grid
+        # realization 0 is the nominal comb
+        rng = np.random.default_rng(seed)
+        self.scatter = capacitor_scatter * rng.standard_normal((n_realizations, mux_factor))
+        self.scatter[0] = 0.
+        self.f_bias = None
+
+    @classmethod
+    def from_config(cls, config_file:str='config.yaml', **kwargs):
+        """Function to create the solver from the readout parameters in the configuration file"""
+        d = read_yaml_file(config_file)
+        parameters = {'mux_factor' : d['mux_factor'], 'freq_bias_range' : d['freq_bias_range'], 'L_res' : d['L_res'],
+                      'R_tes' : d['R_tes_normal'] * d['R_frac'], 'r_s' : d['r_s'], 'L_stray' : d['L_stray']}
+        parameters.update(kwargs)
+        return cls(**parameters)
+
+    def _leg_impedance(self, omega, C):
+        # impedance of TES + resonator legs
+        return self.R_tes + self.r_s + 1j * omega * self.L_res + 1/(1j * omega * C)
+
+    def _parasitic_admittance(self, omega):
+        # admittance of the bias element + stray series impedance, plus the parasitics parallel to the comb
+        comb = self.comb
+        z_s_inv = 1./(comb.Rs + comb.Rbias + 1j * omega * (comb.Lbias + comb.Ls))
+        z_p_inv = 1j * omega * comb.Cpar + 1 / comb.Rpar
+        return z_s_inv + z_p_inv
+
+    def _ctf(self, omega, Z_i, Z_n):
+        # absolute leakage current cross talk fraction at the bias frequency omega of the on-resonance leg
+        return np.abs(calculate_cross_talk_fraction_LCX(Z_i, Z_n, 1j * omega * self.L_stray))
+
+    def set_schedule(self, f_bias:np.ndarray):
+        """Function to set all the bias frequencies and calculate the cross talk and impedance from scratch
+
+        Args:
+            f_bias (np.ndarray): bias frequencies [Hz], one per channel
+        """
+        self.f_bias = np.array(f_bias, dtype=float)
+        if len(self.f_bias) != self.mux_factor:
+            raise ValueError("expected {} bias frequencies, got {}".format(self.mux_factor, len(self.f_bias)))
+        self.C = 1/((2*pi*self.f_bias)**2 * self.L_res) * (1 + self.scatter) # fabricated capacitors
+        self.omega = 2*pi*self.f_bias / np.sqrt(1 + self.scatter) # actual bias frequencies
+
+        # Z_leg[r, i, j]: leg j at the bias frequency of leg i, in realization r
+        omega_i = self.omega[:, :, np.newaxis]
+        Z_leg = self._leg_impedance(omega_i, self.C[:, np.newaxis, :])
+        diagonal = np.arange(self.mux_factor)
+        Z_leg[:, diagonal, diagonal] = self.R_tes + self.r_s # on resonance
+        self.Y = 1./Z_leg
+        self.Y_others = np.sum(self.Y, axis=2) - self.Y[:, diagonal, diagonal]
+
+        self.ctf = self._ctf(omega_i, Z_leg[:, diagonal, diagonal][:, :, np.newaxis], Z_leg)
+        self.ctf[:, diagonal, diagonal] = 0.
+        self.ctf_row_max = np.max(self.ctf, axis=2)
+        self._update_z_thev()
+
+    def _update_z_thev(self):
+        # Thévenin-equivalent resistance of each leg at its bias frequency, the LC of the leg itself cancels
+        # and the small reactance left is tuned out by the bias frequency, as in compute_z_thev
+        self.z_thev = np.abs(np.real(1./(self._parasitic_admittance(self.omega) + self.Y_others)))
+
+    def move(self, k:int, f_new:float):
+        """Function to move the bias frequency of channel k, updating only row and column k
+
+        Args:
+            k (int): channel
+            f_new (float): new bias frequency [Hz]
+        """
+        n = self.mux_factor
+        self.f_bias[k] = f_new
+        self.C[:, k] = 1/((2*pi*f_new)**2 * self.L_res) * (1 + self.scatter[:, k])
+        self.omega[:, k] = 2*pi*f_new / np.sqrt(1 + self.scatter[:, k])
+        others = np.arange(n) != k
+        Z_on = self.R_tes + self.r_s
+
+        # row k: all legs at the new bias frequency of leg k
+        omega_k = self.omega[:, k][:, np.newaxis]
+        Z_row = self._leg_impedance(omega_k, self.C)
+        Z_row[:, k] = Z_on
+        self.Y[:, k, :] = 1./Z_row
+        self.Y_others[:, k] = np.sum(self.Y[:, k, others], axis=1)
+        self.ctf[:, k, :] = self._ctf(omega_k, Z_on, Z_row)
+        self.ctf[:, k, k] = 0.
+        self.ctf_row_max[:, k] = np.max(self.ctf[:, k, :], axis=1)
+
+        # column k: the new leg k at the bias frequencies of the other legs
+        omega_i = self.omega[:, others]
+        Z_column = self._leg_impedance(omega_i, self.C[:, k][:, np.newaxis])
+        Y_column = 1./Z_column
+        self.Y_others[:, others] += Y_column - self.Y[:, others, k]
+        self.Y[:, others, k] = Y_column
+
+        old_ctf_column = self.ctf[:, others, k]
+        new_ctf_column = self._ctf(omega_i, Z_on, Z_column)
+        self.ctf[:, others, k] = new_ctf_column
+        row_max = np.maximum(self.ctf_row_max[:, others], new_ctf_column)
+        # rows where the old column k was the maximum and went down have to be searched again
+        stale = (old_ctf_column >= row_max) & (new_ctf_column < old_ctf_column)
+        row_max[stale] = np.max(self.ctf[:, others, :][stale], axis=1)
+        self.ctf_row_max[:, others] = row_max
+
+        self._update_z_thev()
+
+    @property
+    def worst_xtalk(self):
+        return np.max(self.ctf_row_max)
+
+    @property
+    def worst_z_thev(self):
+        return np.max(self.z_thev)
+
+    def cost(self):
+        """Normalized worst-case cost of the current schedule, < 1 means that both targets are met"""
+        return max(self.worst_xtalk / self.xtalk_target, self.worst_z_thev / self.r_thev_target)
+
+    def _worst_channels(self):
+        # channels that set the cost: the pair with the worst cross talk, or the leg with the worst
+        # impedance and its closest neighbors in frequency
+        if self.worst_xtalk / self.xtalk_target >= self.worst_z_thev / self.r_thev_target:
+            r, i, j = np.unravel_index(np.argmax(self.ctf), self.ctf.shape)
+            return [i, j]
+        r, i = np.unravel_index(np.argmax(self.z_thev), self.z_thev.shape)
+        distance = np.abs(self.f_bias - self.f_bias[i])
+        return list(np.argsort(distance)[:3])
+
+    def _snap(self, f):
+        f = np.clip(f, self.freq_bias_range[0], self.freq_bias_range[1])
+        if self.grid:
+            f = np.round(f / self.grid) * self.grid
+        return f
+
+    def solve(self, f_bias:np.ndarray=None, initial_step:float=None, min_step:float=None, max_iterations:int=5000):
+        """Function to minimize the cost by moving one bias frequency at a time
+
+        The channels that set the worst cross talk or impedance are moved up or down by a step,
+        a move is kept if the cost goes down. The step is halved when no move helps.
+
+        Args:
+            f_bias (np.ndarray, optional): starting schedule [Hz]. Defaults to the current schedule,
+                or logarithmic spacing if there is none.
+            initial_step (float, optional): initial step [Hz]. Defaults to a quarter of the mean spacing.
+            min_step (float, optional): the search stops below this step [Hz]. Defaults to grid, or 100 Hz.
+            max_iterations (int, optional): maximum number of accepted moves. Defaults to 5000.
+
+        Returns:
+            f_bias (np.ndarray): optimized bias frequencies [Hz]
+        """
+        if f_bias is not None:
+            self.set_schedule(self._snap(np.asarray(f_bias, dtype=float)))
+        elif self.f_bias is None:
+            self.set_schedule(self._snap(create_f_bias_array(self.freq_bias_range, self.mux_factor, 'logarithmic')))
+        f_low, f_high = self.freq_bias_range
+        if initial_step is None:
+            initial_step = (f_high - f_low) / (self.mux_factor - 1) / 4
+        if min_step is None:
+            min_step = self.grid if self.grid else 100.
+
+        step = initial_step
+        cost = self.cost()
+        self.cost_history = [cost]
+        iterations = 0
+        while step >= min_step and iterations < max_iterations:
+            improved = False
+            for k in self._worst_channels():
+                f_old = self.f_bias[k]
+                for f_new in (self._snap(f_old + step), self._snap(f_old - step)):
+                    if f_new == f_old:
+                        continue
+                    self.move(k, f_new)
+                    new_cost = self.cost()
+                    if new_cost < cost:
+                        cost = new_cost
+                        improved = True
+                        break
+                    self.move(k, f_old)
+                if improved:
+                    break
+            if improved:
+                iterations += 1
+                self.cost_history.append(cost)
+            else:
+                step /= 2
+
+        # recalculate from scratch so that the rounding errors of the incremental updates do not add up
+        self.set_schedule(self.f_bias)
+        return np.sort(self.f_bias)
+
+    def save(self, filename:str, **metadata):
+        """Function to save the current schedule, see save_frequency_schedule"""
+        save_frequency_schedule(filename, self.f_bias, L_res=self.L_res, R_tes=self.R_tes,
+                                capacitor_scatter=self.capacitor_scatter, worst_xtalk=self.worst_xtalk,
+                                worst_z_thev=self.worst_z_thev, **metadata)
+
+
+def save_frequency_schedule(filename:str, f_bias:np.ndarray, **metadata):
+    """Function to save a frequency schedule to a yaml file
+
+    Args:
+        filename (str): name of yaml file
+        f_bias (np.ndarray): bias frequencies [Hz]
+        metadata: other (scalar) values to save with the schedule, e.g. the worst cross talk
+    """
+    f_bias = np.sort(np.asarray(f_bias, dtype=float))
+    data = {'mux_factor' : len(f_bias), 'freq_bias_range' : [float(f_bias[0]), float(f_bias[-1])],
+            'f_bias' : [float(f) for f in f_bias]}
+    data.update({key : float(value) for key, value in metadata.items()})
+    with open(filename, 'w') as file:
+        yaml.safe_dump(data, file, sort_keys=False)
+
+
+def local_main():
+    """
+    local main to compare the optimized schedule with linear and logarithmic spacing
+    """
+    solver = FrequencyScheduleSolver.from_config('config.yaml', grid=bolocomb().base_frequency)
+    for spacing in ['linear', 'logarithmic']:
+        solver.set_schedule(solver._snap(create_f_bias_array(solver.freq_bias_range, solver.mux_factor, spacing)))
+        print("{}: worst cross talk {:.2e}, worst R_thev {:.3f} Ohm"
+              .format(spacing, solver.worst_xtalk, solver.worst_z_thev))
+
+    f_bias = solver.solve()
+    print("optimized: worst cross talk {:.2e}, worst R_thev {:.3f} Ohm"
+          .format(solver.worst_xtalk, solver.worst_z_thev))
+    solver.save('frequency_schedule.yaml')
+
+    from matplotlib import pyplot as plt
+    plt.figure(1)
+    plt.plot(f_bias[:-1]/1e6, np.diff(f_bias)/1e3, '.-')
+    plt.xlabel('Bias frequency [MHz]')
+    plt.ylabel('Spacing to next channel [kHz]')
+    plt.figure(2)
+    plt.plot(solver.cost_history)
+    plt.xlabel('Iteration')
+    plt.ylabel('Normalized worst-case cost')
+    plt.show()
+
+
+if __name__ == "__main__":
+    local_main()
@@ -1,11 +1,12 @@
 import numpy as np
-import csv
 from matplotlib import pyplot as plt
 from scipy.constants import mu_0
 from scipy.optimize import curve_fit
 pi = np.pi
 
 from plot_parameters import *
+from data_analysis.load_vna_data import read_vna_files
+from data_analysis.find_resonances import find_resonances_in_files, get_resonant_frequencies
 
 #data_folder = "C:/Users/nicol/Documents/00Research/Data/Dunk Probe/starcryo_cable/date_20230920_19mm_2000um/"
 #data_files = np.array(["WARM01.csv", "WARM02.csv", "COLD03.csv", "COLD04.csv", "COLD05.csv"])
@@ -15,6 +16,9 @@ from plot_parameters import *
 data_folder = "C:/Users/nicol/Documents/00Research/Data/Dunk Probe/starcryo_cable/date_29240521_45mm_2000um/"
 data_files = np.array([  "20240521_4_1.csv"])    
 labels = np.array([ "4 K"])
+# one VNA file per geometry of model_inductance (calibration, l=19mm w=350um, l=19mm w=2000um, l=45mm w=2000um),
+# None to use the resonant frequencies read from the plots
+resonance_files = None
 
 def main():
     
@@ -24,7 +28,15 @@ def main():
     #compare_inductance_formulas()
     
     # attempt of model         
-    model_inductance()     
+    if resonance_files is None:
+        model_inductance()
+    else:
+        resonances = find_resonances_in_files([data_folder+data_file for data_file in resonance_files])
+        for data_file, found in zip(resonance_files, resonances):
+            print(found)
+            if not found:
+                print("No resonance found in {}, its geometry is left out of the fit".format(data_file))
+        model_inductance(*get_resonant_frequencies(resonances))
     
 
     plt.show()
@@ -50,19 +62,37 @@ def compare_inductance_formulas():
     plt.plot(lengths, L2, label="L2", linestyle="-.")
     plt.legend()
     
-def model_inductance():
+def model_inductance(res_freqs=None, res_freq_err=0.05e6):
     """
     Assume an inductance model and take a reference value
     at one of the geometries
     I'll pick the geometry of 19 mm length and 350 um width
+
+    Args:
+        res_freqs (np.ndarray, optional): resonant frequency of each geometry [Hz], e.g. from
+            find_resonances_in_files. Defaults to the values read from the plots.
+        res_freq_err (float or np.ndarray, optional): uncertainty of the resonant frequencies [Hz]. Defaults to 0.05e6.
     """
 
-    res_freqs = np.array([3.7e6, 2.0e6, 2.3e6, 1.9e6]) # Resonant frequencies  # y data
-    res_freq_err = 0.05e6
+    if res_freqs is None:
+        res_freqs = np.array([3.7e6, 2.0e6, 2.3e6, 1.9e6]) # Resonant frequencies  # y data
     labels = np.array(["calibration", "l=19mm w=350um", "l=19 mm w=350um", "l=45 mm w=300um"])
     lengths = np.array([0, 17.1e-3, 17.1e-3, 40.5e-3]) #np.array([0, 19e-3, 19e-3, 45e-3]) # [m]
     widths = np.array([1, 350e-6, 2000e-6, 2000e-6]) # [m]
     gap=5e-6
+    
+    # leave out the geometries without a resonant frequency (nan from get_resonant_frequencies)
+    found = np.isfinite(res_freqs)
+    if np.ndim(res_freq_err):
+        found &= np.isfinite(res_freq_err)
+        res_freq_err = res_freq_err[found]
+    if np.sum(found) < 3:
+        raise ValueError("resonant frequencies found for {} geometries ({}), at least 3 are needed to fit the model"
+                         .format(np.sum(found), ", ".join(labels[found])))
+    res_freqs = res_freqs[found]
+    labels = labels[found]
+    lengths = lengths[found]
+    widths = widths[found]
     L_over_L_ref = get_inductance_factors(lengths, widths, ref_length=17.1e-3, ref_width=350e-6, gap=gap) # x data
     
     
@@ -73,7 +103,9 @@ def model_inductance():
     initial_guesses = [L_ref_guess, C_guess, L_wb_guess]
     
     # Run fit 
-    popt, pcov = curve_fit(model_res_freq, L_over_L_ref, res_freqs, p0=initial_guesses)
+    # weight the points only when each resonant frequency has its own uncertainty
+    sigma = res_freq_err if np.ndim(res_freq_err) else None
+    popt, pcov = curve_fit(model_res_freq, L_over_L_ref, res_freqs, p0=initial_guesses, sigma=sigma)
     
     perr = np.sqrt(np.diag(pcov))
     print("Parameter values:", popt)
@@ -116,7 +148,7 @@ def model_inductance():
     # Calculate uncertainty based on how much things were changing at the lab
     C_70K_sigma = np.std([3.1, 3.2, 3.3])*1e-6 # F
     Lwb_70K_sigma = np.std([2.4, 2.3])*1e-9 # nH
-    fr_sigma = 0.05e6 # Hz
+    fr_sigma = res_freq_err # Hz
     
     L_sigma = np.sqrt( \
         ( C_70K_sigma * 1/(C_fit**2* res_freqs**2 * (2*pi)**2 ) )**2 + \
@@ -181,29 +213,11 @@ def plot_vna_measurement(data_folder, data_files, labels):
         labels: description of each file
     """
     
-    for df, data_file in enumerate(data_files):
-        
-        filepath = data_folder+data_file
-        
-        # initialize arrays
-        freqs = np.array([])
-        S11 = np.array([])
+    all_data = read_vna_files([data_folder+data_file for data_file in data_files])
+    
+    for df, data in enumerate(all_data):
         
-        # opening the CSV file
-        with open(filepath, mode ='r') as file:
-            # reading the CSV file
-            csvFile = csv.reader(file)
-    
-            # displaying the contents of the CSV file
-            line_counter = 0
-            lines_to_skip = 17
-            for line in csvFile:
-                if line_counter > lines_to_skip: # skip the headers
-                    # ignore last file
-                    if len(line) >1:
-                        freqs = np.append(freqs, float(line[0]) ) # frequency in Hz
-                        S11 = np.append(S11, float(line[1]) ) # S11 in dB
-                line_counter = line_counter + 1
+        freqs, S11 = data[0], data[1] # frequency in Hz, S11 in dB
 
         plt.figure(1, figsize=FIG_SIZE)
         plt.scatter(freqs/1e6, S11, label=labels[df], alpha=0.5)
@@ -20,6 +20,19 @@ def read_yaml_file(filename:str):
     return data
 
 
+def load_schedule(filename:str):
+    """Function to read the bias frequencies of a frequency schedule, the yaml file written by
+    electric_design/frequency_schedule.py, e.g. as the freqs of DfMux or the f_bias of dfmux_timestream
+
+    Args:
+        filename (str): name of yaml file
+
+    Returns:
+        f_bias (np.ndarray): bias frequencies [Hz]
+    """
+    return np.array(read_yaml_file(filename)['f_bias'], dtype=float)
+
+
 def local_main():
     # for testing
     read_yaml_file('config.yaml')
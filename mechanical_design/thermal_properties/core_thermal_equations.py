@@ -1,4 +1,10 @@
+import os
+import hashlib
 import numpy as np
+from scipy.integrate import quad_vec
+
+# directory where the cumulative conductivity tables are saved
+TABLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'conductivity_tables')
 
 def get_dissipated_heat(T0, T1, material,  area, length):
     """Calculate dissipated heat given thermal conductance k=alpha*T^(beta+gamma*(T^n))
@@ -10,18 +16,50 @@ def get_dissipated_heat(T0, T1, material,  area, length):
         area (_type_): area of cross section of conductor
         length (_type_): length of conductor
     """
-    # divide temperature into array
-    T_array = np.linspace(T0, T1, 100) # array of temperature used to integrate G   
+    Q = get_dissipated_heat_batch(T0, T1, material, area, length)
     
-    # Get conductance    
-    k_array = np.zeros(len(T_array))
-    for tc, T in enumerate(T_array):
-        k_array[tc] = material.alpha * T **(material.beta  + material.gamma * (T **(material.n)))
-    # integrate conductance and calculate heat transfer
-    k_integrated = np.trapz(k_array, x=T_array)
-    Q = k_integrated * area / length 
+    return Q[()]
+
+
+def get_dissipated_heat_batch(T0, T1, material, area=1., length=1., epsrel:float=1e-10):
+    """Calculate dissipated heat for arrays of (T0, T1, area, length) in one call, k=alpha*T^(beta+gamma*(T^n))
+
+    For power-law materials (gamma == 0) the integral of k is calculated in closed form,
+    otherwise (e.g. CFRP, CarbonStrut) with adaptive quadrature over all the elements at once.
+
+    Args:
+        T0 (np.ndarray): cold temperature(s) [K]
+        T1 (np.ndarray): warm temperature(s) [K]
+        material: a class that contains the thermal properties of a material
+        area (np.ndarray, optional): area(s) of cross section of conductor [m^2]. Defaults to 1.
+        length (np.ndarray, optional): length(s) of conductor [m]. Defaults to 1.
+        epsrel (float, optional): relative tolerance of the adaptive quadrature. Defaults to 1e-10.
+
+    Returns:
+        Q (np.ndarray): dissipated heat [W], with the broadcast shape of the inputs
+    """
+    T0, T1, area, length = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (T0, T1, area, length)])
+    
+    if material.gamma == 0:
+        # integral of alpha*T^beta
+        if material.beta == -1:
+            k_integrated = material.alpha * np.log(T1 / T0)
+        else:
+            k_integrated = material.alpha * (T1**(material.beta + 1) - T0**(material.beta + 1)) / (material.beta + 1)
+    else:
+        # T = T0 + s*(T1-T0), so all the integrals run over s in [0, 1]
+        delta_T = T1 - T0
+        def integrand(s):
+            return get_thermal_conductivity(T0 + s * delta_T, material) * delta_T
+        k_integrated, _ = quad_vec(integrand, 0., 1., epsrel=epsrel, norm='max')
+    Q = k_integrated * area / length
     
     return Q
+
+
+def get_thermal_conductivity(T, material):
+    """Thermal conductivity k=alpha*T^(beta+gamma*(T^n)) [W/m K] at temperature(s) T [K]"""
+    return material.alpha * T **(material.beta  + material.gamma * (T **(material.n)))
   
 
 class PhosphorBronze:
@@ -103,4 +141,144 @@ class CarbonStrut:
             self.alpha = 8.39e-3
             self.beta = 2.12
             self.gamma = -1.05
-            self.n = 0.181
\ No newline at end of file
+            self.n = 0.181
+
+
+# ---------------------------------------------------------
+# Material registry and cumulative conductivity tables
+# ---------------------------------------------------------
+
+MATERIALS = {
+    'PhosphorBronze' : PhosphorBronze,
+    'CFRP' : CFRP,
+    'Kapton' : Kapton,
+    'Kapton2' : Kapton2,
+    'NbTi' : NbTi,
+    'Ubilex' : Ubilex,
+    'CarbonStrut' : CarbonStrut,
+}
+
+_tables = {} # tables already loaded in this session
+
+
+def register_material(name:str, material_class):
+    """Function to add a material class (with alpha, beta, gamma, n attributes) to the registry"""
+    MATERIALS[name] = material_class
+
+
+def get_material(name:str, cryogenic=True):
+    """Function to get an instance of a registered material by name, e.g. get_material('NbTi')"""
+    if name not in MATERIALS:
+        raise KeyError("unknown material '{}', registered materials are {}".format(name, list(MATERIALS)))
+    return MATERIALS[name](cryogenic=cryogenic)
+
+
+class ConductivityTable:
+    """
+    Cumulative integral of the thermal conductivity, K(T) = integral of k dT from 0 to T [W/m],
+    on a dense logarithmic temperature grid. The heat through a conductor is then
+    Q = (K(T1) - K(T0)) * area / length, without integrating again.
+    K is interpolated linearly in log(K) vs log(T), which is exact for power-law materials.
+    """
+    def __init__(self, material, T_min:float=1e-3, T_max:float=20., n_points:int=4000):
+        """
+        Args:
+            material: a class that contains the thermal properties of a material
+            T_min (float, optional): lowest temperature of the table [K]. Defaults to 1e-3.
+            T_max (float, optional): highest temperature of the table [K]. Defaults to 20.
+            n_points (int, optional): number of temperatures in the table. Defaults to 4000.
+        """
+        self.material = material
+        self.T_min = T_min
+        self.T_max = T_max
+        self.n_points = n_points
+        self.T = None
+        self.K = None
+
+    @property
+    def key(self):
+        # identifies the table by the thermal properties and the grid, not by the class name
+        parameters = (self.material.alpha, self.material.beta, self.material.gamma, self.material.n,
+                      self.T_min, self.T_max, self.n_points)
+        return hashlib.sha256(repr(tuple(float(p) for p in parameters)).encode()).hexdigest()[:16]
+
+    @property
+    def filename(self):
+        return os.path.join(TABLE_DIR, "{}_{}.npz".format(type(self.material).__name__, self.key))
+
+    def build(self):
+        """Function to integrate k between all the temperatures of the grid"""
+        if self.material.beta + self.material.gamma * self.T_min**self.material.n <= -1:
+            raise ValueError("the integral of k from 0 K diverges for this material")
+        self.T = np.geomspace(self.T_min, self.T_max, self.n_points)
+        # from 0 K to T_min, then between consecutive temperatures of the grid
+        K_start = get_dissipated_heat_batch(0., self.T_min, self.material)
+        K_steps = get_dissipated_heat_batch(self.T[:-1], self.T[1:], self.material)
+        self.K = K_start + np.concatenate([[0.], np.cumsum(K_steps)])
+        return self
+
+    def save(self):
+        os.makedirs(TABLE_DIR, exist_ok=True)
+        temporary_name = self.filename + '.tmp.npz'
+        np.savez(temporary_name, T=self.T, K=self.K)
+        os.replace(temporary_name, self.filename)
+
+    def load(self):
+        """Function to read the table from disk, returns False if it does not exist yet"""
+        if not os.path.exists(self.filename):
+            return False
+        with np.load(self.filename) as data:
+            self.T = data['T']
+            self.K = data['K']
+        return True
+
+    def __call__(self, T):
+        """Cumulative integral K(T) [W/m] at temperature(s) T inside [T_min, T_max]"""
+        return np.exp(np.interp(np.log(T), np.log(self.T), np.log(self.K)))
+
+    def get_dissipated_heat(self, T0, T1, area=1., length=1.):
+        """Dissipated heat [W] for arrays of (T0, T1, area, length), using the table inside its
+        temperature range and get_dissipated_heat_batch outside of it"""
+        T0, T1, area, length = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (T0, T1, area, length)])
+        in_table = (np.minimum(T0, T1) >= self.T_min) & (np.maximum(T0, T1) <= self.T_max)
+        Q = np.empty(T0.shape)
+        Q[in_table] = (self(T1[in_table]) - self(T0[in_table])) * area[in_table] / length[in_table]
+        if not np.all(in_table):
+            out = ~in_table
+            Q[out] = get_dissipated_heat_batch(T0[out], T1[out], self.material, area[out], length[out])
+        return Q
+
+
+def get_conductivity_table(material, T_min:float=1e-3, T_max:float=20., n_points:int=4000):
+    """Function to get the cumulative conductivity table of a material (instance or registered name).
+    The table is built the first time, saved in TABLE_DIR, and read back in later sessions.
+
+    Returns:
+        table (ConductivityTable)
+    """
+    if isinstance(material, str):
+        material = get_material(material)
+    table = ConductivityTable(material, T_min, T_max, n_points)
+    if table.key not in _tables:
+        if not table.load():
+            table.build().save()
+        _tables[table.key] = table
+    return _tables[table.key]
+
+
+def get_dissipated_heat_from_table(T0, T1, material, area=1., length=1.):
+    """Calculate dissipated heat from the cumulative conductivity table of the material,
+    for arrays of (T0, T1, area, length). Same result as get_dissipated_heat_batch, but each value is
+    an interpolated difference, so sweeps over many geometries or temperatures cost almost nothing.
+
+    Args:
+        T0 (np.ndarray): cold temperature(s) [K]
+        T1 (np.ndarray): warm temperature(s) [K]
+        material: a class that contains the thermal properties of a material, or its registered name
+        area (np.ndarray, optional): area(s) of cross section of conductor [m^2]. Defaults to 1.
+        length (np.ndarray, optional): length(s) of conductor [m]. Defaults to 1.
+
+    Returns:
+        Q (np.ndarray): dissipated heat [W]
+    """
+    return get_conductivity_table(material).get_dissipated_heat(T0, T1, area, length)
\ No newline at end of file
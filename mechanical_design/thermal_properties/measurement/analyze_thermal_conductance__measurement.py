@@ -13,10 +13,10 @@ We know T_hot and the material properties, we can then estimate A/L.
 import numpy as np
 from matplotlib import pyplot as plt
 from scipy.optimize import curve_fit
-import csv
 import sys
 sys.path.insert(0, 'C:/Users/nicol/Documents/00Research/PythonCode/ReadoutDesigner/')
-from mechanical_design.thermal_properties.core_thermal_equations import  get_dissipated_heat, NbTi, PhosphorBronze, Kapton
+from mechanical_design.thermal_properties.core_thermal_equations import  get_dissipated_heat, get_dissipated_heat_batch, NbTi, PhosphorBronze, Kapton
+from mechanical_design.thermal_properties.measurement.load_measurement_data import read_measurement_file
 
 #data_dir = "C:/Users/nicol/Documents/00Research/Data/Thermal Conductance/"
 data_dir =  "C:/Users/nicol/Documents/00Research/Data/APEX/Run 63 Thermal Conductance/"
@@ -69,10 +69,7 @@ def main():
     #     print("Vout: {:.2f} , Iout: {:.2e} Pout: {:.2f}".format(V_out[i], I_out[i], P_heater[i]*1e9)) ; i=i+1
     
     # Estimate power from parasitics
-    P_par_estimated = np.array([])
-    for T in T1:
-        P_par_estimated = np.append(P_par_estimated, get_dissipated_heat(\
-            T, Twire, heater_wire_material, heater_wire_area, heater_wire_length))
+    P_par_estimated = get_dissipated_heat_batch(T1, Twire, heater_wire_material, heater_wire_area, heater_wire_length)
     
 
     # FIT TO THE DATA
@@ -144,23 +141,10 @@ def read_data_from_csv(path_to_file:str):
     Args:
         path_to_file (str): _description_
     """
-    V_out = np.array([])
-    T1 = np.array([])
-    T0 = np.array([])
-    
-    with open(path_to_file, mode='r') as file:
-        csv_reader = csv.reader(file)
-        # skip three header lines
-        next(csv_reader)
-        next(csv_reader)
-        next(csv_reader)
-    
-        for row in csv_reader:
-            V_out = np.append(V_out, float(row[3]))
-            T0 = np.append(T0, float(row[4]))
-            T1 = np.append(T1, float(row[5]))
+    # three header lines, then V_out, T0, T1 in columns 3, 4, 5
+    data = read_measurement_file(path_to_file, layout='legacy')
             
-    return V_out, T0, T1
+    return data.V_out, data.T0, data.T1
 
 
 def power_model(T1, a, b, Ppar_over_g):
@@ -9,10 +9,11 @@ power and temperature data + experimental setup parameters from a csv file
 import numpy as np
 from matplotlib import pyplot as plt
 from scipy.optimize import curve_fit
-import csv
 import sys
 sys.path.insert(0, 'C:/Users/nicol/Documents/00Research/PythonCode/ReadoutDesigner/')
-from mechanical_design.thermal_properties.core_thermal_equations import  get_dissipated_heat, NbTi, PhosphorBronze, Kapton
+from mechanical_design.thermal_properties.core_thermal_equations import  get_dissipated_heat
+from mechanical_design.thermal_properties.measurement.load_measurement_data import read_measurement_file
+from mechanical_design.thermal_properties.measurement.wiring_parasitics import get_wiring_parasitics
 
 
 from matplotlib import pyplot as plt
@@ -50,21 +51,10 @@ def main():
     P_heater_over_g_sigma = P_heater_sigma/g
     
     #### Simulate power dissipated by wiring ####
-    # intialize material
-    heater_material = NbTi(cryogenic=True)
-    therm_wire_material = PhosphorBronze(cryogenic=True)
-    # get cross sectional area based on wiring diamter
-    hw_area = 2 * (heater_wire_diameter/2)**2 * np.pi # two wires
-    therm_area = 4 * (therm_wire_diameter/2)**2 * np.pi # four wires
-    # initialize array to store total power dissipated by wiring
-    total_par_powers = np.zeros(len(T1))
-    for t, T1_var in enumerate(T1):
-        # Calculate parasitic power
-        hw_par_power = get_dissipated_heat(T0_mean, T1_var, heater_material, \
-            hw_area, heater_wire_length)
-        therm_par_power = get_dissipated_heat(T0_mean, T1_var, therm_wire_material, \
-            therm_area, therm_wire_length)
-        total_par_powers[t] = hw_par_power + therm_par_power
+    # NbTi heater wires (two) and PhosphorBronze thermometer wires (four), the correction curve
+    # of this harness is built once and reused by later measurements with the same wiring
+    wiring = get_wiring_parasitics(heater_wire_diameter, heater_wire_length, therm_wire_diameter, therm_wire_length)
+    total_par_powers = wiring(T0_mean, T1)
     
     
     # FIT TO THE DATA
@@ -184,57 +174,12 @@ def read_data_from_csv(path_to_file:str, verbose=False):
         path_to_file (str): _description_
         verbose (bool): whether or not to print useful things
     """
-    V_out = np.array([])
-    T1 = np.array([])
-    T0 = np.array([])
+    data = read_measurement_file(path_to_file, layout='v2')
     
-    with open(path_to_file, mode='r') as file:
-        csv_reader = csv.reader(file)
-        row_count = -1
-    
-        for row in csv_reader:
-            row_count +=1
-            #print(row)
-            
-            # get material properties
-            if row_count == 3:
-                width = float(row[0])
-                thickness = float(row[1])
-                length = float(row[2])
-            elif row_count == 5:
-                R_heater = float(row[0])
-                R_heater_sigma = float(row[1])
-            elif row_count == 7:
-                R_series = float(row[0])
-                R_series_sigma = float(row[1])
-            elif row_count == 9:
-                V_sigma = float(row[0])
-            elif row_count == 11:
-                T_sigma = float(row[0])
-            elif row_count == 13:
-                therm_wire_length = float(row[0])
-                therm_wire_diameter = float(row[1])
-                heater_wire_length = float(row[2])
-                heater_wire_diameter = float(row[3])
-                wiring_end_temperature = float(row[4])
-            elif row_count >= 15:                
-                V_out = np.append(V_out, float(row[2]))
-                T0 = np.append(T0, float(row[3]))
-                T1 = np.append(T1, float(row[4]))
-            
     if verbose:
-        print("Width[mm]: ", width*1e3, " , thickness [um]: ", thickness*1e6, " , length [mm]: ", length*1e3)
-        print("R_heater [Ohms]", R_heater, " +- ", R_heater_sigma)
-        print("R_series [Ohms]: ", R_series, " +- ", R_series_sigma)
-        print("Voltage uncertainty [V]: ", V_sigma)
-        print("Temperature uncertainty [K]: ", T_sigma)
-        print("Thermometer length [m], diameter [um] ", therm_wire_length, therm_wire_diameter*1e6)
-        print("Heater wire length[m] and diameter [um]: ", heater_wire_length, heater_wire_diameter*1e6)
-        print("Wiring end temperature: ", wiring_end_temperature)
+        data.setup.print_summary()
     
-    return V_out, T0, T1, width, thickness, length, R_heater, R_heater_sigma, R_series, R_series_sigma, \
-        V_sigma, T_sigma, therm_wire_diameter, therm_wire_length, heater_wire_diameter, heater_wire_length, \
-        wiring_end_temperature
+    return (data.V_out, data.T0, data.T1) + data.setup.as_tuple()
     
     
 class MeasuredMaterialProperties():
@@ -0,0 +1,141 @@
+"""
+Batch fitting of the thermal conductance power-law model to many measurement datasets
+(materials, runs, cooldowns, parasitic models), in parallel over a process pool.
+
+The model is the one of power_model in the analysis scripts:
+    (P_heater - P_par,wiring)/g = a * (T1^b - T0^b) - Ppar_over_g
+with k = alpha * T^beta, alpha = a*b, beta = b - 1 and Ppar = Ppar_over_g * g.
+"""
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import curve_fit
+
+T0_DEFAULT = 0.243 # [K] base temperature hard-coded in power_model
+
+
+def power_law_model(T1, a, b, Ppar_over_g, T0=T0_DEFAULT):
+    """P/g = a*(T1^b - T0^b) - Ppar_over_g, same as power_model with a free T0"""
+    return a * (T1**b - T0**b) - Ppar_over_g
+
+
+def power_law_jacobian(T1, a, b, Ppar_over_g, T0=T0_DEFAULT):
+    """Analytic derivatives of power_law_model with respect to (a, b, Ppar_over_g), shape (len(T1), 3)"""
+    T1_b = T1**b
+    T0_b = T0**b
+    return np.stack([T1_b - T0_b, a * (T1_b * np.log(T1) - T0_b * np.log(T0)), -np.ones_like(T1_b)], axis=-1)
+
+
+class FitDataset:
+    """
+    One dataset to fit: warm temperatures T1 [K], heater power P [W] (with the wiring parasitics
+    already subtracted, if wanted) and geometry factor g = area/length [m]
+    """
+    def __init__(self, T1:np.ndarray, P:np.ndarray, g:float, T0:float=T0_DEFAULT, P_sigma:np.ndarray=None,
+                 name:str='', p0=None):
+        self.T1 = np.asarray(T1, dtype=float)
+        self.P = np.asarray(P, dtype=float)
+        self.g = g
+        self.T0 = T0 # base temperature [K]
+        self.P_sigma = None if P_sigma is None else np.broadcast_to(np.asarray(P_sigma, dtype=float), self.P.shape)
+        self.name = name
+        self.p0 = p0 # initial (a, b, Ppar_over_g), defaults to ones as in curve_fit
+
+
+class FitResult:
+    """
+    Fitted parameters of one dataset. params and covariance are for (a, b, Ppar_over_g),
+    the physical parameters are alpha [W/m K^(beta+1)], beta and Ppar [W].
+    """
+    def __init__(self, name:str, params:np.ndarray, covariance:np.ndarray, g:float, bootstrap_params:np.ndarray=None):
+        self.name = name
+        self.params = params
+        self.covariance = covariance
+        a, b, Ppar_over_g = params
+        self.a = a
+        self.b = b
+        self.alpha = a * b
+        self.beta = b - 1
+        self.Ppar = Ppar_over_g * g
+        # covariance of (alpha, beta, Ppar) from the covariance of (a, b, Ppar_over_g)
+        jacobian = np.array([[b, a, 0.], [0., 1., 0.], [0., 0., g]])
+        self.physical_covariance = jacobian @ covariance @ jacobian.T
+        self.alpha_sigma, self.beta_sigma, self.Ppar_sigma = np.sqrt(np.diag(self.physical_covariance))
+        self.bootstrap_params = bootstrap_params # (n_bootstrap, 3) fitted (alpha, beta, Ppar) of the resampled data
+        self.bootstrap_sigma = None # spread of (alpha, beta, Ppar), needs at least two successful resamplings
+        if bootstrap_params is not None and len(bootstrap_params) >= 2:
+            self.bootstrap_sigma = np.std(bootstrap_params, axis=0, ddof=1)
+
+    def __repr__(self):
+        return "FitResult({}: alpha={:.3g} +- {:.2g}, beta={:.3g} +- {:.2g}, Ppar={:.3g} +- {:.2g} W)".format(
+            self.name, self.alpha, self.alpha_sigma, self.beta, self.beta_sigma, self.Ppar, self.Ppar_sigma)
+
+
+def _curve_fit(T1, y, T0, sigma=None, p0=None):
+    def model(T1, a, b, Ppar_over_g):
+        return power_law_model(T1, a, b, Ppar_over_g, T0)
+    def jacobian(T1, a, b, Ppar_over_g):
+        return power_law_jacobian(T1, a, b, Ppar_over_g, T0)
+    return curve_fit(model, T1, y, p0=p0, sigma=sigma, absolute_sigma=sigma is not None, jac=jacobian)
+
+
+def fit_dataset(dataset:FitDataset, n_bootstrap:int=0, seed=0):
+    """Function to fit the power-law model to one dataset
+
+    Args:
+        dataset (FitDataset): the data
+        n_bootstrap (int, optional): number of bootstrap resamplings of the data points, 0 for none, otherwise
+            at least 2. Defaults to 0.
+        seed (int or np.random.SeedSequence, optional): random seed of the bootstrap. Defaults to 0.
+
+    Returns:
+        result (FitResult)
+    """
+    if n_bootstrap == 1 or n_bootstrap < 0:
+        raise ValueError("n_bootstrap must be 0 or at least 2 to estimate the bootstrap spread, got {}".format(n_bootstrap))
+    y = dataset.P / dataset.g
+    sigma = None if dataset.P_sigma is None else dataset.P_sigma / dataset.g
+    params, covariance = _curve_fit(dataset.T1, y, dataset.T0, sigma, dataset.p0)
+
+    bootstrap_params = None
+    if n_bootstrap:
+        rng = np.random.default_rng(seed)
+        bootstrap_params = np.full((n_bootstrap, 3), np.nan)
+        for i in range(n_bootstrap):
+            sample = rng.integers(0, len(y), len(y))
+            try:
+                a, b, Ppar_over_g = _curve_fit(dataset.T1[sample], y[sample], dataset.T0,
+                                               None if sigma is None else sigma[sample], params)[0]
+            except (RuntimeError, ValueError):
+                continue # resampled data that cannot be fitted (e.g. too few distinct points)
+            bootstrap_params[i] = a * b, b - 1, Ppar_over_g * dataset.g
+        bootstrap_params = bootstrap_params[np.all(np.isfinite(bootstrap_params), axis=1)]
+
+    return FitResult(dataset.name, params, covariance, dataset.g, bootstrap_params)
+
+
+def _fit_dataset(args):
+    # top level function so that it can be sent to the worker processes
+    return fit_dataset(*args)
+
+
+def fit_datasets(datasets:list, n_bootstrap:int=0, n_workers:int=None, seed:int=0):
+    """Function to fit many datasets, in parallel over a process pool
+
+    Each dataset gets its own bootstrap seed, so the results do not depend on the number of workers.
+
+    Args:
+        datasets (list): FitDataset of each run / material / parasitic model
+        n_bootstrap (int, optional): number of bootstrap resamplings per dataset, 0 or at least 2. Defaults to 0.
+        n_workers (int, optional): number of worker processes, 1 to fit in this process.
+            Defaults to None (number of CPUs).
+        seed (int, optional): random seed of the bootstrap. Defaults to 0.
+
+    Returns:
+        results (list): FitResult of each dataset, in the same order
+    """
+    jobs = [(dataset, n_bootstrap, np.random.SeedSequence(seed, spawn_key=(i,))) for i, dataset in enumerate(datasets)]
+    if n_workers == 1 or len(jobs) <= 1:
+        return [_fit_dataset(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(_fit_dataset, jobs))
@@ -0,0 +1,209 @@
+"""
+Loader for the thermal conductance measurement files (csv exported from the excel sheets),
+shared by the analyze_thermal_conductance_* scripts.
+
+Two layouts are supported:
+ - 'v2': setup numbers in the header block (rows 3 to 13), data from row 15 with
+         V_out, T0, T1 in columns 2, 3, 4
+ - 'legacy': three header lines, data with V_out, T0, T1 in columns 3, 4, 5
+The data block is parsed in one pass with np.loadtxt (or in chunks for long logged runs), and a
+binary sidecar (<file>.npz) is written next to the csv so that the next load is instant.
+The sidecar is ignored when the csv changes.
+"""
+
+import os
+import csv
+import itertools
+import numpy as np
+
+LAYOUTS = {
+    'v2' : {'data_start_row' : 15, 'columns' : (2, 3, 4), 'has_setup' : True},
+    'legacy' : {'data_start_row' : 3, 'columns' : (3, 4, 5), 'has_setup' : False},
+}
+
+
+class MeasurementSetup:
+    """
+    Setup numbers from the header block of a measurement file. Lengths in m, resistances in Ohms,
+    voltages in V, temperatures in K.
+    """
+    # (header row, column, name), as in the excel sheet
+    HEADER_FIELDS = (
+        (3, 0, 'width'), (3, 1, 'thickness'), (3, 2, 'length'),
+        (5, 0, 'R_heater'), (5, 1, 'R_heater_sigma'),
+        (7, 0, 'R_series'), (7, 1, 'R_series_sigma'),
+        (9, 0, 'V_sigma'),
+        (11, 0, 'T_sigma'),
+        (13, 0, 'therm_wire_length'), (13, 1, 'therm_wire_diameter'), (13, 2, 'heater_wire_length'),
+        (13, 3, 'heater_wire_diameter'), (13, 4, 'wiring_end_temperature'),
+    )
+
+    def __init__(self, width:float, thickness:float, length:float, R_heater:float, R_heater_sigma:float,
+                 R_series:float, R_series_sigma:float, V_sigma:float, T_sigma:float, therm_wire_length:float,
+                 therm_wire_diameter:float, heater_wire_length:float, heater_wire_diameter:float,
+                 wiring_end_temperature:float):
+        self.width = width
+        self.thickness = thickness
+        self.length = length
+        self.R_heater = R_heater
+        self.R_heater_sigma = R_heater_sigma
+        self.R_series = R_series
+        self.R_series_sigma = R_series_sigma
+        self.V_sigma = V_sigma
+        self.T_sigma = T_sigma
+        self.therm_wire_length = therm_wire_length
+        self.therm_wire_diameter = therm_wire_diameter
+        self.heater_wire_length = heater_wire_length
+        self.heater_wire_diameter = heater_wire_diameter
+        self.wiring_end_temperature = wiring_end_temperature
+
+    @classmethod
+    def from_header_rows(cls, rows:list):
+        """Function to parse the setup numbers from the rows of the header block"""
+        values = {}
+        for row, column, name in cls.HEADER_FIELDS:
+            try:
+                values[name] = float(rows[row][column])
+            except (IndexError, ValueError):
+                raise ValueError("could not read {} from row {}, column {} of the header".format(name, row, column))
+        return cls(**values)
+
+    def as_dict(self):
+        return {name : getattr(self, name) for _, _, name in self.HEADER_FIELDS}
+
+    def as_tuple(self):
+        """Setup numbers in the order returned by read_data_from_csv in the analysis scripts"""
+        return (self.width, self.thickness, self.length, self.R_heater, self.R_heater_sigma, self.R_series,
+                self.R_series_sigma, self.V_sigma, self.T_sigma, self.therm_wire_diameter, self.therm_wire_length,
+                self.heater_wire_diameter, self.heater_wire_length, self.wiring_end_temperature)
+
+    def print_summary(self):
+        print("Width[mm]: ", self.width*1e3, " , thickness [um]: ", self.thickness*1e6, " , length [mm]: ", self.length*1e3)
+        print("R_heater [Ohms]", self.R_heater, " +- ", self.R_heater_sigma)
+        print("R_series [Ohms]: ", self.R_series, " +- ", self.R_series_sigma)
+        print("Voltage uncertainty [V]: ", self.V_sigma)
+        print("Temperature uncertainty [K]: ", self.T_sigma)
+        print("Thermometer length [m], diameter [um] ", self.therm_wire_length, self.therm_wire_diameter*1e6)
+        print("Heater wire length[m] and diameter [um]: ", self.heater_wire_length, self.heater_wire_diameter*1e6)
+        print("Wiring end temperature: ", self.wiring_end_temperature)
+
+
+class MeasurementData:
+    """
+    Data block of a measurement file: heater voltage V_out [V], base temperature T0 [K]
+    and warm temperature T1 [K], plus the setup (None for the legacy layout)
+    """
+    def __init__(self, V_out:np.ndarray, T0:np.ndarray, T1:np.ndarray, setup:MeasurementSetup=None):
+        self.V_out = V_out
+        self.T0 = T0
+        self.T1 = T1
+        self.setup = setup
+
+    def __len__(self):
+        return len(self.V_out)
+
+
+def _get_layout(layout:str):
+    if layout not in LAYOUTS:
+        raise ValueError("unknown layout '{}', options are {}".format(layout, list(LAYOUTS)))
+    return LAYOUTS[layout]
+
+
+def _parse_data_lines(lines, columns):
+    # parse the data lines in one call, skipping empty lines and rows of empty cells (",,,")
+    lines = [line for line in lines if line.strip(', \t\r\n')]
+    if not lines:
+        return np.zeros((0, len(columns)))
+    return np.loadtxt(lines, delimiter=',', usecols=columns, ndmin=2)
+
+
+def _read_header(file, layout:dict):
+    # read the header rows, returns the setup (or None)
+    header_rows = list(csv.reader(itertools.islice(file, layout['data_start_row'])))
+    if layout['has_setup']:
+        return MeasurementSetup.from_header_rows(header_rows)
+    return None
+
+
+def iter_measurement_chunks(path_to_file:str, layout:str='v2', chunk_size:int=100000):
+    """Function to read a measurement file in chunks, for long logged runs that do not fit in memory
+
+    Args:
+        path_to_file (str): csv file
+        layout (str, optional): 'v2' or 'legacy'. Defaults to 'v2'.
+        chunk_size (int, optional): number of data rows per chunk. Defaults to 100000.
+
+    Yields:
+        chunk (MeasurementData): the next chunk of rows, all chunks share the same setup
+    """
+    layout = _get_layout(layout)
+    with open(path_to_file, mode='r') as file:
+        setup = _read_header(file, layout)
+        while True:
+            lines = list(itertools.islice(file, chunk_size))
+            if not lines:
+                break
+            data = _parse_data_lines(lines, layout['columns'])
+            if len(data):
+                yield MeasurementData(data[:, 0], data[:, 1], data[:, 2], setup)
+
+
+def _sidecar_filename(path_to_file:str, layout:str):
+    return "{}.{}.npz".format(path_to_file, layout)
+
+
+def _load_sidecar(path_to_file:str, layout:str):
+    # returns None if there is no sidecar or if the csv changed since it was written
+    sidecar = _sidecar_filename(path_to_file, layout)
+    if not os.path.exists(sidecar):
+        return None
+    stat = os.stat(path_to_file)
+    try:
+        with np.load(sidecar) as cached:
+            if cached['source_size'] != stat.st_size or cached['source_mtime'] != stat.st_mtime_ns:
+                return None
+            setup = None
+            if 'setup' in cached.files:
+                setup = MeasurementSetup(**dict(zip([name for _, _, name in MeasurementSetup.HEADER_FIELDS], cached['setup'])))
+            return MeasurementData(cached['V_out'], cached['T0'], cached['T1'], setup)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _save_sidecar(path_to_file:str, layout:str, data:MeasurementData):
+    stat = os.stat(path_to_file)
+    arrays = {'V_out' : data.V_out, 'T0' : data.T0, 'T1' : data.T1,
+              'source_size' : stat.st_size, 'source_mtime' : stat.st_mtime_ns}
+    if data.setup is not None:
+        arrays['setup'] = np.array(list(data.setup.as_dict().values()))
+    sidecar = _sidecar_filename(path_to_file, layout)
+    try:
+        np.savez(sidecar + '.tmp.npz', **arrays)
+        os.replace(sidecar + '.tmp.npz', sidecar)
+    except OSError:
+        pass # e.g. read-only data directory, the sidecar is only an optimization
+
+
+def read_measurement_file(path_to_file:str, layout:str='v2', use_sidecar:bool=True):
+    """Function to read the setup and the data of a thermal conductance measurement file
+
+    Args:
+        path_to_file (str): csv file
+        layout (str, optional): 'v2' (setup in the header) or 'legacy' (three header lines). Defaults to 'v2'.
+        use_sidecar (bool, optional): read from / write the binary sidecar <file>.<layout>.npz. Defaults to True.
+
+    Returns:
+        data (MeasurementData)
+    """
+    if use_sidecar:
+        data = _load_sidecar(path_to_file, layout)
+        if data is not None:
+            return data
+    layout_parameters = _get_layout(layout)
+    with open(path_to_file, mode='r') as file:
+        setup = _read_header(file, layout_parameters)
+        values = _parse_data_lines(file.readlines(), layout_parameters['columns'])
+    data = MeasurementData(values[:, 0].copy(), values[:, 1].copy(), values[:, 2].copy(), setup)
+    if use_sidecar:
+        _save_sidecar(path_to_file, layout, data)
+    return data
@@ -0,0 +1,57 @@
+"""
+Parasitic heat conducted by the heater and thermometer wiring of a thermal conductance measurement.
+All the measured points are evaluated at once with the cumulative conductivity tables of the wire
+materials (ConductivityTable.get_dissipated_heat). get_wiring_parasitics memoizes the harnesses, so
+later measurements with the same wiring reuse them.
+"""
+
+import functools
+import numpy as np
+from mechanical_design.thermal_properties.core_thermal_equations import get_conductivity_table
+
+
+class WiringParasitics:
+    """
+    Wiring harness: n_heater_wires heater wires and n_therm_wires thermometer wires.
+    P_par(T0, T1) = sum over the wires of (K(T1) - K(T0)) * area / length, with K the cumulative
+    conductivity of the wire material from its ConductivityTable.
+    """
+    def __init__(self, heater_wire_diameter:float, heater_wire_length:float, therm_wire_diameter:float,
+                 therm_wire_length:float, heater_material:str='NbTi', therm_material:str='PhosphorBronze',
+                 n_heater_wires:int=2, n_therm_wires:int=4):
+        """
+        Args:
+            heater_wire_diameter (float): diameter of the heater wires [m]
+            heater_wire_length (float): length of the heater wires [m]
+            therm_wire_diameter (float): diameter of the thermometer wires [m]
+            therm_wire_length (float): length of the thermometer wires [m]
+            heater_material (str, optional): registered material of the heater wires. Defaults to 'NbTi'.
+            therm_material (str, optional): registered material of the thermometer wires. Defaults to 'PhosphorBronze'.
+            n_heater_wires (int, optional): number of heater wires. Defaults to 2.
+            n_therm_wires (int, optional): number of thermometer wires. Defaults to 4.
+        """
+        self.heater_geometry = n_heater_wires * np.pi * (heater_wire_diameter/2)**2 / heater_wire_length
+        self.therm_geometry = n_therm_wires * np.pi * (therm_wire_diameter/2)**2 / therm_wire_length
+        self.heater_table = get_conductivity_table(heater_material)
+        self.therm_table = get_conductivity_table(therm_material)
+
+    def heater_power(self, T0, T1):
+        """Heat conducted by the heater wires from T1 to T0 [W]"""
+        return self.heater_table.get_dissipated_heat(T0, T1, self.heater_geometry)
+
+    def thermometer_power(self, T0, T1):
+        """Heat conducted by the thermometer wires from T1 to T0 [W]"""
+        return self.therm_table.get_dissipated_heat(T0, T1, self.therm_geometry)
+
+    def __call__(self, T0, T1):
+        """Total parasitic heat conducted by the wiring from T1 to T0 [W], for arrays of T0 and T1"""
+        return self.heater_power(T0, T1) + self.thermometer_power(T0, T1)
+
+
+@functools.lru_cache(maxsize=None)
+def get_wiring_parasitics(heater_wire_diameter:float, heater_wire_length:float, therm_wire_diameter:float,
+                          therm_wire_length:float, heater_material:str='NbTi', therm_material:str='PhosphorBronze',
+                          n_heater_wires:int=2, n_therm_wires:int=4):
+    """Function to get the WiringParasitics of a wiring configuration, built only the first time it is asked for"""
+    return WiringParasitics(heater_wire_diameter, heater_wire_length, therm_wire_diameter, therm_wire_length,
+                            heater_material, therm_material, n_heater_wires, n_therm_wires)
@@ -0,0 +1,269 @@
+"""
+Thermal network of a focal plane: temperature stages and other thermal masses are nodes, flex cables,
+CFRP tubes and wiring bundles are conduction links between them.
+Instead of calculating one link at a time with get_dissipated_heat and comparing it by hand with the
+allowed power, the whole network is solved at once: the temperatures of the free nodes (e.g. a module
+board held only by its supports) are found with a sparse Newton solver, and the heat through every
+link is reported against its budget.
+"""
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
+from mechanical_design.thermal_properties.core_thermal_equations import get_conductivity_table, \
+    get_thermal_conductivity, get_material
+
+
+class ThermalNetwork:
+    """
+    Nodes have either a fixed temperature (the stages, e.g. 100 mK, 350 mK, 4 K) or a free temperature
+    that is solved for, with an optional heat dissipated on them (e.g. SQUID or amplifier power).
+    Link l between nodes a and b carries Q_l = (K(T_b) - K(T_a)) * count * area / length from b to a,
+    with K the cumulative conductivity table of its material.
+    """
+    def __init__(self):
+        self.node_names = []
+        self.node_index = {}
+        self.node_temperature = [] # fixed temperature, or initial guess of free nodes [K]
+        self.node_fixed = []
+        self.node_power = [] # heat dissipated on the node [W]
+
+        self.link_names = []
+        self.link_a = [] # index of the cold (or first) node
+        self.link_b = [] # index of the warm (or second) node
+        self.link_geometry = [] # count * area / length [m]
+        self.link_material = [] # index in self.materials
+        self.link_allowed = [] # allowed power [W], inf if there is no budget
+        self.materials = []
+        self.solved = False
+
+    @property
+    def n_nodes(self):
+        return len(self.node_names)
+
+    @property
+    def n_links(self):
+        return len(self.link_names)
+
+    def add_node(self, name:str, temperature:float=None, fixed:bool=True, power:float=0.):
+        """Function to add a node
+
+        Args:
+            name (str): name of the node
+            temperature (float, optional): temperature of a fixed node, or initial guess for a free node [K]
+            fixed (bool, optional): the temperature is fixed (a stage). Defaults to True.
+            power (float, optional): heat dissipated on a free node [W]. Defaults to 0.
+        """
+        if name in self.node_index:
+            raise ValueError("node '{}' already exists".format(name))
+        if fixed and temperature is None:
+            raise ValueError("fixed node '{}' needs a temperature".format(name))
+        self.node_index[name] = len(self.node_names)
+        self.node_names.append(name)
+        self.node_temperature.append(np.nan if temperature is None else temperature)
+        self.node_fixed.append(fixed)
+        self.node_power.append(power)
+        self.solved = False
+
+    def _material_index(self, material):
+        if isinstance(material, str):
+            material = get_material(material)
+        for i, known in enumerate(self.materials):
+            if known is material:
+                return i
+        self.materials.append(material)
+        return len(self.materials) - 1
+
+    def add_link(self, name:str, node_a:str, node_b:str, material, area:float, length:float, count:int=1,
+                 allowed_power:float=np.inf):
+        """Function to add a conduction link between two nodes
+
+        Args:
+            name (str): name of the link
+            node_a (str): name of the first (usually colder) node
+            node_b (str): name of the second (usually warmer) node
+            material: a class that contains the thermal properties of a material, or its registered name
+            area (float): area of cross section of one conductor [m^2]
+            length (float): length of conductor [m]
+            count (int, optional): number of identical conductors, e.g. wires in a bundle. Defaults to 1.
+            allowed_power (float, optional): budget for the heat through this link [W]. Defaults to no budget.
+        """
+        self.add_links([name], [node_a], [node_b], material, [area], [length], [count], [allowed_power])
+
+    def add_links(self, names, nodes_a, nodes_b, material, areas, lengths, counts=1, allowed_power=np.inf):
+        """Function to add many links of the same material at once, same arguments as add_link but as arrays"""
+        n = len(names)
+        self.link_names.extend(names)
+        self.link_a.extend(self.node_index[node] for node in nodes_a)
+        self.link_b.extend(self.node_index[node] for node in nodes_b)
+        geometry = np.broadcast_to(counts, n) * np.broadcast_to(areas, n) / np.broadcast_to(lengths, n)
+        self.link_geometry.extend(geometry)
+        self.link_material.extend([self._material_index(material)] * n)
+        self.link_allowed.extend(np.broadcast_to(allowed_power, n))
+        self.solved = False
+
+    def _arrays(self):
+        # the lists are converted to arrays once per solve
+        self._a = np.asarray(self.link_a, dtype=int)
+        self._b = np.asarray(self.link_b, dtype=int)
+        self._geometry = np.asarray(self.link_geometry, dtype=float)
+        self._material = np.asarray(self.link_material, dtype=int)
+        self._fixed = np.asarray(self.node_fixed, dtype=bool)
+        self._groups = [(get_conductivity_table(material), material, np.flatnonzero(self._material == i))
+                        for i, material in enumerate(self.materials)]
+
+    def _link_flows(self, T:np.ndarray, derivatives:bool=False):
+        # heat from b to a through each link, and optionally dQ/dT_a and dQ/dT_b
+        Q = np.zeros(self.n_links)
+        dQ_dTa = np.zeros(self.n_links)
+        dQ_dTb = np.zeros(self.n_links)
+        for table, material, links in self._groups:
+            Ta = T[self._a[links]]
+            Tb = T[self._b[links]]
+            geometry = self._geometry[links]
+            Q[links] = table.get_dissipated_heat(Ta, Tb, geometry)
+            if derivatives:
+                dQ_dTa[links] = -get_thermal_conductivity(Ta, material) * geometry
+                dQ_dTb[links] = get_thermal_conductivity(Tb, material) * geometry
+        return Q, dQ_dTa, dQ_dTb
+
+    def _node_heat(self, Q:np.ndarray):
+        # net heat arriving at each node: flows in through the links plus the dissipated power
+        heat = np.asarray(self.node_power, dtype=float).copy()
+        np.add.at(heat, self._a, Q)
+        np.add.at(heat, self._b, -Q)
+        return heat
+
+    def solve(self, rtol:float=1e-12, max_iterations:int=100):
+        """Function to find the temperatures of the free nodes where the net heat on each of them is zero
+
+        Newton iterations with a sparse Jacobian, the step is halved until the residual goes down.
+        Converged when the largest net heat on a free node is below rtol times the largest heat through a link
+        (or dissipated power on a node, if nothing flows yet).
+
+        Args:
+            rtol (float, optional): relative tolerance on the net heat of the free nodes. Defaults to 1e-12.
+            max_iterations (int, optional): maximum number of Newton iterations. Defaults to 100.
+
+        Returns:
+            T (np.ndarray): temperature of each node [K]
+        """
+        self._arrays()
+        T = np.asarray(self.node_temperature, dtype=float).copy()
+        free = np.flatnonzero(~self._fixed)
+        if np.any(np.isnan(T[free])):
+            # start the free nodes without a guess at the mean temperature of the fixed nodes
+            T[free] = np.where(np.isnan(T[free]), np.mean(T[self._fixed]), T[free])
+        free_position = -np.ones(self.n_nodes, dtype=int)
+        free_position[free] = np.arange(len(free))
+
+        node_power = np.max(np.abs(np.asarray(self.node_power, dtype=float)), initial=0.)
+
+        Q, dQ_dTa, dQ_dTb = self._link_flows(T, derivatives=True)
+        residual = self._node_heat(Q)[free]
+        self.iterations = 0
+        while len(free) and np.max(np.abs(residual)) > rtol * max(np.max(np.abs(Q), initial=0.), node_power):
+            if self.iterations == max_iterations:
+                raise RuntimeError("thermal network did not converge, largest net heat {:.3g} W".format(np.max(np.abs(residual))))
+            # d(heat_i)/dT_j: heat_a gets +Q, heat_b gets -Q
+            rows = np.concatenate([self._a, self._a, self._b, self._b])
+            cols = np.concatenate([self._a, self._b, self._a, self._b])
+            values = np.concatenate([dQ_dTa, dQ_dTb, -dQ_dTa, -dQ_dTb])
+            keep = (free_position[rows] >= 0) & (free_position[cols] >= 0)
+            jacobian = sparse.csr_matrix((values[keep], (free_position[rows[keep]], free_position[cols[keep]])),
+                                         shape=(len(free), len(free)))
+            step = spsolve(jacobian.tocsc(), -residual)
+            if not np.all(np.isfinite(step)):
+                raise ValueError("singular thermal network, check that every free node is connected to a fixed node")
+
+            scale = 1.
+            while True:
+                T_new = T.copy()
+                T_new[free] = T[free] + scale * step
+                if np.all(T_new[free] > 0):
+                    Q_new, dQ_dTa_new, dQ_dTb_new = self._link_flows(T_new, derivatives=True)
+                    residual_new = self._node_heat(Q_new)[free]
+                    if np.max(np.abs(residual_new)) < np.max(np.abs(residual)):
+                        break
+                    if scale < 1e-6:
+                        raise RuntimeError("thermal network did not converge, no step reduces the largest net heat {:.3g} W".format(
+                            np.max(np.abs(residual))))
+                elif scale < 1e-6:
+                    raise RuntimeError("thermal network solver stepped to negative temperatures")
+                scale /= 2
+            T, Q, dQ_dTa, dQ_dTb, residual = T_new, Q_new, dQ_dTa_new, dQ_dTb_new, residual_new
+            self.iterations += 1
+
+        self.T = T
+        self.link_power = Q
+        self.node_heat = self._node_heat(Q)
+        self.solved = True
+        return T
+
+    def stage_loads(self):
+        """Heat load on each fixed node (stage) [W], positive when heat arrives at the stage
+
+        Returns:
+            loads (dict): node name -> heat load
+        """
+        if not self.solved:
+            self.solve()
+        return {self.node_names[i] : self.node_heat[i] for i in np.flatnonzero(self._fixed)}
+
+    def budget(self):
+        """Heat through each link compared with its allowed power
+
+        Returns:
+            report (np.ndarray): structured array with the fields name, power [W], allowed [W]
+                and fraction (power/allowed), sorted from the largest fraction of the budget used
+        """
+        if not self.solved:
+            self.solve()
+        report = np.zeros(self.n_links, dtype=[('name', object), ('power', float), ('allowed', float), ('fraction', float)])
+        report['name'] = self.link_names
+        report['power'] = np.abs(self.link_power)
+        report['allowed'] = self.link_allowed
+        report['fraction'] = report['power'] / report['allowed']
+        return report[np.argsort(-report['fraction'])]
+
+
+def build_focal_plane(n_modules:int=20, T_bath:float=0.1, T_intermediate:float=0.35, T_4K:float=4.,
+                      allowed_power_per_module:float=15e-9):
+    """Example network: n_modules SQUID boards, each held by CFRP tubes from the 350 mK stage,
+    connected to the 100 mK stage by a Kapton flex, and wired from 4 K with NbTi.
+    Geometries follow simulate_squid_isolation.ipynb and simulate_parasitic_load.ipynb.
+    """
+    network = ThermalNetwork()
+    network.add_node('100 mK', T_bath)
+    network.add_node('350 mK', T_intermediate)
+    network.add_node('4 K', T_4K)
+    boards = ['module {} board'.format(i) for i in range(n_modules)]
+    for board in boards:
+        network.add_node(board, T_intermediate, fixed=False, power=1e-9)
+
+    flex_area = 2 * 12.7e-6 * 10e-3 # 2 legs
+    network.add_links(['module {} flex'.format(i) for i in range(n_modules)], ['100 mK'] * n_modules, boards,
+                      'Kapton', flex_area, 25e-3, allowed_power=allowed_power_per_module / 3)
+    cfrp_area = np.pi * ((2.0e-3/2)**2 - (1.75e-3/2)**2)
+    network.add_links(['module {} CFRP tubes'.format(i) for i in range(n_modules)], boards, ['350 mK'] * n_modules,
+                      'CFRP', cfrp_area, 10e-2, counts=6)
+    wire_area = np.pi * (110e-6/2)**2
+    network.add_links(['module {} wiring'.format(i) for i in range(n_modules)], boards, ['4 K'] * n_modules,
+                      'NbTi', wire_area, 1.2, counts=2)
+    return network
+
+
+def local_main():
+    network = build_focal_plane(n_modules=200)
+    T = network.solve()
+    print("Solved in {} iterations".format(network.iterations))
+    print("Board temperatures: {:.4f} to {:.4f} K".format(np.min(T[3:]), np.max(T[3:])))
+    for stage, load in network.stage_loads().items():
+        print("Load on {}: {:.3f} nW".format(stage, load * 1e9))
+    report = network.budget()
+    print("Worst link: {} with {:.3f} nW ({:.0f}% of its budget)".format(report['name'][0], report['power'][0]*1e9,
+                                                                       report['fraction'][0]*100))
+
+
+if __name__ == "__main__":
+    local_main()
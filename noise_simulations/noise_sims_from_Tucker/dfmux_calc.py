@@ -1,11 +1,92 @@
+import os
+import sys
 import numpy as np
 import copy as copy
+import itertools
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # repository root
+from load_data_functions import load_schedule
 
 def parallel(x, y):
     return 1/(1/x + 1/y)
 
+
+class NoiseBudget:
+    """
+    Named-source index over noise terms stored in one array, data[source, ...]. DfMux keeps all its
+    terms in one array and the budget of each chain wraps a slice of its rows, so nothing is copied.
+    It reads like the dict of arrays it replaces: budget['dac'] is a view of the 'dac' row, and
+    keys(), values() and items() work as for a dict.
+    """
+
+    def __init__(self, sources, data):
+        self.sources = tuple(sources)
+        self.index = {name : i for i, name in enumerate(self.sources)}
+        self.data = data
+
+    def __getitem__(self, name):
+        return self.data[self.index[name]]
+
+    def __iter__(self):
+        return iter(self.sources)
+
+    def __len__(self):
+        return len(self.sources)
+
+    def keys(self):
+        return self.sources
+
+    def values(self):
+        return [self.data[i] for i in range(len(self.sources))]
+
+    def items(self):
+        return [(name, self.data[i]) for i, name in enumerate(self.sources)]
+
+    def total(self):
+        """Quadrature sum of all the sources"""
+        return np.sqrt(np.einsum('i...,i...->...', self.data, self.data))
+
+    def fractions(self):
+        """Fraction of the total noise power coming from each source, same layout as data"""
+        return self.data**2 / self.total()**2
+
+    def dominant(self):
+        """Name of the largest source at every frequency"""
+        return np.array(self.sources)[np.argmax(self.data, axis=0)]
+
+
+class Component:
+    """
+    Base class of the DfMux components. Setting a parameter gives it a new version number (unique over
+    all the components), which is how DfMux knows which noise terms are out of date. Attributes calculated
+    by DfMux (listed in _derived) are not parameters. Note that changing an array parameter in place
+    (e.g. polyvals[0] = 2.) is not detected, assign a new value instead.
+    """
+    _derived = ('tf', 'noise', 'total_noise', 'req', 'rsqcb', 'csf', 'output_filter')
+    _counter = itertools.count(1)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name not in self._derived and not name.startswith('_'):
+            # new dictionary, so that copies of the component do not share their versions
+            versions = dict(getattr(self, '_versions', {}))
+            versions[name] = next(self._counter)
+            object.__setattr__(self, '_versions', versions)
+
+    def get_version(self, name):
+        """Version of a parameter, 0 if it was never set"""
+        return getattr(self, '_versions', {}).get(name, 0)
+
+
+class NoiseChain(Component):
+    """
+    Base class of the chains, which store their noise terms in self.noise (a NoiseBudget)
+    """
+
+    def calc_total_noise(self):
+        return self.noise.total()
+
         
-class Bolometer:
+class Bolometer(NoiseChain):
     
     def __init__(self, r=1.5, tc=0.171, tb=0.1):
         self.r = r
@@ -15,15 +96,8 @@ class Bolometer:
     def calc_johnson_noise(self, freqs):
         return np.sqrt(8*1.38e-23*self.tc/self.r) * (freqs/freqs)
     
-    def calc_total_noise(self):
-        total = []
-        for key in self.noise:
-            total.append(self.noise[key]**2)
-        total = np.sum(total, axis=0)**.5
-        return total
-
     
-class CarrierChain:
+class CarrierChain(NoiseChain):
     
     def __init__(self, l_bias=0., r_bias=30e-3, t_bias=4., r_stiff=180., polyvals=[1.]):
         self.l_bias = l_bias
@@ -52,18 +126,11 @@ class CarrierChain:
         return np.sqrt(2)*np.sqrt(4*1.38e-23*270./self.r_stiff) * np.absolute(self.r_bias + jw*self.l_bias) / bolo.r
 
     def calc_bias_element_johnson_noise(self, bolo):
-        return np.full(len(self.tf),
+        return np.full(np.shape(self.tf),
                        np.sqrt(2)*np.sqrt(4*1.38e-23*self.t_bias*self.r_bias)/bolo.r)
 
-    def calc_total_noise(self):
-        total = []
-        for key in self.noise:
-            total.append(self.noise[key]**2)
-        total = np.sum(total, axis=0)**.5
-        return total
-
     
-class DemodChain:
+class DemodChain(NoiseChain):
     
     def __init__(self, r_wh=40., c_wh=40e-12, l_wh=1e-6):
         self.r_wh = r_wh
@@ -100,15 +167,8 @@ class DemodChain:
     def calc_squid_bias_johnson_noise(self, squid):
         return 8.36e-9 * self.req / (self.req + 4.22e3) * np.sqrt(2) * self.csf / squid.zt / self.output_filter
         
-    def calc_total_noise(self):
-        total = []
-        for key in self.noise:
-            total.append(self.noise[key]**2)
-        total = np.sum(total, axis=0)**.5
-        return total    
-
     
-class NullerChain:
+class NullerChain(NoiseChain):
     
     def __init__(self, r_stiff=3e3, polyvals=[1.]):
         self.r_stiff = r_stiff
@@ -130,23 +190,16 @@ class NullerChain:
         return 34e-12 * np.sqrt(2) * self.tf
     
     def calc_stiffening_resistor_johnson_noise(self):    
-        return np.full(len(self.tf), np.sqrt(8*1.38e-23*300./self.r_stiff))
+        return np.full(np.shape(self.tf), np.sqrt(8*1.38e-23*300./self.r_stiff))
     
     def calc_flux_bias_johnson_noise(self):
-        return np.full(len(self.tf), np.sqrt(8*1.38e-23*300./20e3))
+        return np.full(np.shape(self.tf), np.sqrt(8*1.38e-23*300./20e3))
     
     def calc_analog_feedback_johnson_noise(self):
-        return np.full(len(self.tf), np.sqrt(8*1.38e-23*300./20e3))
+        return np.full(np.shape(self.tf), np.sqrt(8*1.38e-23*300./20e3))
     
-    def calc_total_noise(self):
-        total = []
-        for key in self.noise:
-            total.append(self.noise[key]**2)
-        total = np.sum(total, axis=0)**.5
-        return total
-
 
-class SQUID:
+class SQUID(Component):
     
     def __init__(self, zt=700, rdyn=700, noise_squid_only=3e-12, lin=70e-9):
         self.zt = zt
@@ -160,44 +213,173 @@ class SQUID:
 
 class DfMux():
     
-    def __init__(self, freqs, bolo=Bolometer(), carrier=CarrierChain(), demod=DemodChain(), nuller=NullerChain(), squid=SQUID()):
+    # (component, parameter) pairs each noise term depends on (besides freqs).
+    # The squid term uses demod.csf, which depends on squid.lin and bolo.r.
+    dependencies = {
+        'carrier' : (('carrier', 'r_stiff'), ('carrier', 'polyvals'), ('carrier', 'r_bias'), ('carrier', 'l_bias'),
+                     ('carrier', 't_bias'), ('bolo', 'r')),
+        'nuller' : (('nuller', 'r_stiff'), ('nuller', 'polyvals')),
+        'demod' : (('demod', 'r_wh'), ('demod', 'c_wh'), ('demod', 'l_wh'), ('squid', 'rdyn'), ('squid', 'lin'),
+                   ('squid', 'zt'), ('bolo', 'r')),
+        'bolo' : (('bolo', 'tc'), ('bolo', 'r')),
+        'squid' : (('squid', 'noise_squid_only'), ('squid', 'lin'), ('bolo', 'r')),
+    }
+
+    # names of the noise sources of each chain, their rows are contiguous in the noise array of the DfMux
+    noise_sources = {
+        'carrier' : ('dac', 'quantization', 'amplifier', 'stiffening_resistor_johnson', 'bias_element_johnson'),
+        'nuller' : ('dac', 'quantization', 'amplifier', 'stiffening_resistor_johnson', 'flux_bias_johnson',
+                    'analog_feedback_johnson'),
+        'demod' : ('adc', 'amplifier_second_stage', 'amplifier_first_stage_voltage', 'amplifier_first_stage_current',
+                   'squid_bias_johnson'),
+        'bolo' : ('johnson',),
+        'squid' : ('squid',),
+    }
+
+    def __init__(self, freqs, bolo=Bolometer(), carrier=CarrierChain(), demod=DemodChain(), nuller=NullerChain(), squid=SQUID(),
+                 noise_dtype=np.float64):
+        self._computed = {} # noise term -> state of its dependencies when it was last calculated
+        # all the noise terms in one array, data[source, ...], the noise of each chain is a view of its rows
+        self.sources = [(chain if name == chain else chain + '_' + name)
+                        for chain, names in self.noise_sources.items() for name in names]
+        self._rows, start = {}, 0
+        for chain, names in self.noise_sources.items():
+            self._rows[chain] = slice(start, start + len(names))
+            start += len(names)
+        self._noise_data = None
+        self._freqs_version = 0
         self.freqs = copy.copy(freqs)
         self.bolo = copy.copy(bolo)
         self.carrier = copy.copy(carrier)
         self.demod = copy.copy(demod)
         self.nuller = copy.copy(nuller)
         self.squid = copy.copy(squid)
+        self.noise_dtype = noise_dtype # e.g. np.float32 to halve the memory of the stored noise terms
+        self.recomputed = [] # noise terms recalculated by the last update
+
+    @property
+    def freqs(self):
+        return self._freqs
+
+    @freqs.setter
+    def freqs(self, freqs):
+        # bias frequencies [Hz], or the name of a frequency schedule file (see load_schedule)
+        if isinstance(freqs, str):
+            freqs = load_schedule(freqs)
+        self._freqs = freqs
+        self._freqs_version += 1
+
+    @property
+    def total_noise(self):
+        """Total noise, recalculating only the noise terms whose parameters changed"""
+        self.update_noise()
+        return self._total_noise
+
+    @total_noise.setter
+    def total_noise(self, total_noise):
+        self._total_noise = total_noise
+
+    def _dependency_state(self, term):
+        return (self._freqs_version,) + tuple((id(getattr(self, component)), getattr(self, component).get_version(name))
+                                              for component, name in self.dependencies[term])
+
+    def is_stale(self, term):
+        """Function to check whether a noise term ('carrier', 'nuller', 'demod', 'bolo' or 'squid') is out of date"""
+        return self._computed.get(term) != self._dependency_state(term)
+
+    def invalidate(self, term=None):
+        """Function to force the recalculation of one noise term, or of all of them if term is None"""
+        if term is None:
+            self._computed.clear()
+        else:
+            self._computed.pop(term, None)
+
+    def update_noise(self):
+        """Function to recalculate the noise terms that are out of date, and the total if any of them was
+
+        Returns:
+            recomputed (list): names of the recalculated noise terms
+        """
+        calc_functions = {
+            'carrier' : self.calc_carrier_chain_noise,
+            'nuller' : self.calc_nuller_chain_noise,
+            'demod' : self.calc_demod_chain_noise,
+            'bolo' : self.calc_bolo_noise,
+            'squid' : self.calc_squid_noise,
+        }
+        self.recomputed = []
+        # a second pass is only needed when the noise array had to be reallocated with a new shape
+        stale = [term for term in calc_functions if self.is_stale(term)]
+        while stale:
+            for term in stale:
+                calc_functions[term]()
+                self._computed[term] = self._dependency_state(term)
+                if term not in self.recomputed:
+                    self.recomputed.append(term)
+            stale = [term for term in calc_functions if self.is_stale(term)]
+        if self.recomputed or not hasattr(self, '_total_noise'):
+            self.calc_total_noise()
+        return self.recomputed
 
     def calc_noise(self):
-        self.calc_carrier_chain_noise()
-        self.calc_nuller_chain_noise()
-        self.calc_demod_chain_noise()
-        self.calc_bolo_noise()
-        self.calc_squid_noise()
-        self.calc_total_noise()
+        self.update_noise()
         pass
+
+    def _store_noise(self, chain, terms):
+        """Function to write the noise terms of a chain into its rows of the noise array
+
+        Args:
+            chain (str): name of the chain, key of noise_sources
+            terms (dict): source name -> noise [A/rtHz]
+
+        Returns:
+            noise (NoiseBudget): view of the rows of the chain
+        """
+        shape = np.broadcast_shapes(*[np.shape(term) for term in terms.values()])
+        data = self._noise_data
+        if data is not None:
+            try:
+                shape = np.broadcast_shapes(data.shape[1:], shape)
+            except ValueError:
+                # e.g. new freqs: the other chains have to be recalculated too
+                data = None
+                self._computed.clear()
+        if data is None or data.shape[1:] != shape:
+            self._noise_data = np.empty((len(self.sources),) + shape, dtype=self.noise_dtype)
+            if data is not None:
+                # new axes after the source axis, so that the old terms broadcast to the new shape
+                self._noise_data[...] = data.reshape(data.shape[:1] + (1,) * (len(shape) + 1 - data.ndim) + data.shape[1:])
+            # the views of the other chains point to the old array
+            for other in self.noise_sources:
+                component = getattr(self, other)
+                if hasattr(component, 'noise'):
+                    component.noise = NoiseBudget(self.noise_sources[other], self._noise_data[self._rows[other]])
+        noise = NoiseBudget(self.noise_sources[chain], self._noise_data[self._rows[chain]])
+        for name, term in terms.items():
+            noise[name][...] = term
+        return noise
     
     def calc_carrier_chain_noise(self):
         self.carrier.tf = self.carrier.calc_tf(self.freqs)
-        self.carrier.noise = {
+        self.carrier.noise = self._store_noise('carrier', {
             'dac' : self.carrier.calc_dac_noise(self.bolo),
             'quantization' : self.carrier.calc_quantization_noise(self.bolo),
             'amplifier' : self.carrier.calc_amplifier_noise(self.bolo),
             'stiffening_resistor_johnson' : self.carrier.calc_stiffening_resistor_johnson_noise(self.freqs, self.bolo),
             'bias_element_johnson' : self.carrier.calc_bias_element_johnson_noise(self.bolo),
-        }
+        })
         self.carrier.total_noise = self.carrier.calc_total_noise()
 
     def calc_nuller_chain_noise(self):
         self.nuller.tf = self.nuller.calc_tf(self.freqs)
-        self.nuller.noise = {
+        self.nuller.noise = self._store_noise('nuller', {
             'dac' : self.nuller.calc_dac_noise(),
             'quantization' : self.nuller.calc_quantization_noise(),
             'amplifier' : self.nuller.calc_amplifier_noise(),
             'stiffening_resistor_johnson' : self.nuller.calc_stiffening_resistor_johnson_noise(),
             'flux_bias_johnson' : self.nuller.calc_flux_bias_johnson_noise(),
             'analog_feedback_johnson' : self.nuller.calc_analog_feedback_johnson_noise(),
-        }
+        })
         self.nuller.total_noise = self.nuller.calc_total_noise()
 
     def calc_demod_chain_noise(self):
@@ -205,27 +387,75 @@ class DfMux():
         self.demod.rsqcb = self.demod.calc_rsqcb()
         self.demod.csf = self.demod.calc_csf(self.freqs, self.bolo, self.squid)
         self.demod.output_filter = self.demod.calc_output_filter(self.freqs, self.squid)
-        self.demod.noise = {
+        self.demod.noise = self._store_noise('demod', {
             'adc' : self.demod.calc_adc_noise(self.squid),
             'amplifier_second_stage' : self.demod.calc_second_stage_amplifier_noise(self.squid),
             'amplifier_first_stage_voltage' : self.demod.calc_first_stage_amplifier_voltage_noise(self.squid),
             'amplifier_first_stage_current' : self.demod.calc_first_stage_amplifier_current_noise(self.squid),
             'squid_bias_johnson' : self.demod.calc_squid_bias_johnson_noise(self.squid),
-        }
+        })
         self.demod.total_noise = self.demod.calc_total_noise()
     
     def calc_squid_noise(self):
-        self.squid.total_noise = self.squid.calc_squid_noise(self.demod)
+        self.squid.noise = self._store_noise('squid', {'squid' : self.squid.calc_squid_noise(self.demod)})
+        self.squid.total_noise = self.squid.noise['squid']
     
     def calc_bolo_noise(self):
-        self.bolo.noise = {
+        self.bolo.noise = self._store_noise('bolo', {
             'johnson' : self.bolo.calc_johnson_noise(self.freqs)
-        }
+        })
         self.bolo.total_noise = self.bolo.calc_total_noise()
         
     def calc_total_noise(self):
-        self.total_noise = np.sqrt(self.demod.total_noise**2
+        self._total_noise = np.sqrt(self.demod.total_noise**2
                                    + self.nuller.total_noise**2
                                    + self.carrier.total_noise**2
                                    + self.bolo.total_noise**2
-                                   + self.squid.total_noise**2)
\ No newline at end of file
+                                   + self.squid.total_noise**2)
+
+    def get_noise_budget(self):
+        """Function to get the noise terms of all the chains as one NoiseBudget (e.g. for fractions or dominant()),
+        a view of the noise array, source names are prefixed by the chain name (unless named after the chain, like 'squid')"""
+        self.update_noise()
+        return NoiseBudget(self.sources, self._noise_data)
+
+
+class DfMuxBatch(DfMux):
+    """
+    Many DfMux configurations evaluated in one vectorized pass.
+    Component parameters are given as dictionaries of constructor arguments, each value being a scalar or
+    an array with one entry per configuration, e.g. squid={'zt': zt_array, 'rdyn': rdyn_array}.
+    Every parameter is broadcast to a column (n_configs, 1) so that it broadcasts against freqs.
+    polyvals are shared by all configurations. The noise terms are stored in float32 by default, which is
+    plenty for noise budgets and halves the memory of large sweeps.
+    """
+
+    def __init__(self, freqs, bolo=None, carrier=None, demod=None, nuller=None, squid=None, noise_dtype=np.float32):
+        params = [bolo or {}, carrier or {}, demod or {}, nuller or {}, squid or {}]
+        sizes = [np.size(value) for p in params for key, value in p.items() if key != 'polyvals']
+        self.n_configs = int(np.broadcast_shapes(*[(size,) for size in sizes])[0]) if sizes else 1
+
+        components = []
+        for component_class, p in zip([Bolometer, CarrierChain, DemodChain, NullerChain, SQUID], params):
+            component = component_class(**p)
+            for key, value in list(vars(component).items()):
+                if key != 'polyvals' and not key.startswith('_'):
+                    setattr(component, key, self._as_column(value))
+            components.append(component)
+        DfMux.__init__(self, freqs, *components, noise_dtype=noise_dtype)
+
+    def _as_column(self, value):
+        return np.broadcast_to(np.asarray(value, dtype=float), (self.n_configs,))[:, np.newaxis]
+
+    def calc_noise(self):
+        """Function to calculate all the noise terms of all the configurations
+
+        Returns:
+            noise (np.ndarray): noise tensor of shape (n_configs, n_freqs, n_sources) [A/rtHz],
+                a view of self.noise_budget.data. The sources are named in self.sources
+        """
+        # the bolometer Johnson noise has the shape of every configuration and frequency,
+        # so the noise array is (n_sources, n_configs, n_freqs)
+        self.noise_budget = self.get_noise_budget()
+        self.noise = np.moveaxis(self.noise_budget.data, 0, -1)
+        return self.noise
@@ -0,0 +1,264 @@
+"""
+Code to search the dfmux parameter space for designs that meet the LiteBIRD NEI requirement
+Instead of hand-editing a "modified" system in compare_dfmux_noise.py, give ranges for the
+parameters, optional constraints and a cost, and let the optimizer evaluate many designs at once
+with DfMuxBatch.
+"""
+import os
+import sys
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import differential_evolution
+from scipy.stats import qmc
+import dfmux_calc
+from dfmux_calc import DfMuxBatch
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # repository root
+from cache_functions import cached
+
+# global constants
+freqs = np.linspace(1.5e6, 5.5e6, 68) # frequency schedule [Hz]
+LB_requirement = 6.2e-12 # A/sqrt(Hz) # from litebird_noise.ipynb
+
+# design parameter name -> (component, argument of the component constructor)
+DESIGN_PARAMETERS = {
+    'zt' : ('squid', 'zt'), # transimpedance [Ohm]
+    'rdyn' : ('squid', 'rdyn'), # dynamical impedance [Ohm]
+    'lin' : ('squid', 'lin'), # input inductance [H]
+    'noise_squid_only' : ('squid', 'noise_squid_only'), # squid noise [A/rtHz]
+    'r_stiff_carrier' : ('carrier', 'r_stiff'), # carrier stiffening resistor [Ohm]
+    'r_stiff_nuller' : ('nuller', 'r_stiff'), # nuller stiffening resistor [Ohm]
+    't_bias' : ('carrier', 't_bias'), # bias element temperature [K]
+    'r_tes' : ('bolo', 'r'), # TES resistance [Ohm]
+    'tc' : ('bolo', 'tc'), # TES critical temperature [K]
+}
+
+
+def main():
+    print("Let's optimize the readout design :) ")
+
+    # parameters to search and their ranges
+    bounds = {
+        'zt' : (500., 2000.),
+        'rdyn' : (300., 1000.),
+        'lin' : (20e-9, 100e-9),
+        'r_stiff_carrier' : (50., 500.),
+        'r_stiff_nuller' : (1e3, 1e4),
+        'r_tes' : (0.5, 1.2),
+    }
+    # parameters that are kept fixed
+    fixed = {'tc' : 0.171, 't_bias' : 4., 'noise_squid_only' : 1e-12}
+    # e.g. SQUIDs with a transimpedance much larger than their dynamical impedance are not available
+    constraints = [lambda p: p['zt'] <= 3 * p['rdyn']]
+
+    result = optimize_design(bounds, fixed=fixed, constraints=constraints, objective='median',
+                             cost=stiffening_resistor_power, n_candidates=20000)
+
+    print("-----------------------")
+    print("Best design ({} NEI {:.2f} pA/sqrt(Hz), LiteBIRD ~ requirement {:.1f} pA/sqrt(Hz)):"
+          .format(result.objective, result.best_nei*1e12, LB_requirement*1e12))
+    for name, value in result.best_params.items():
+        print("   {:>16s} : {:.3g}".format(name, value))
+    print("{} of {} designs meet the requirement, {} on the Pareto front"
+          .format(np.sum(result.nei < LB_requirement), len(result.nei), len(result.pareto_indices)))
+
+    from matplotlib import pyplot as plt
+    plot_pareto_front(result)
+    plt.show()
+    print("The end")
+    return 0
+
+
+class DesignResult:
+    """
+    Output of optimize_design
+    """
+    def __init__(self, objective, candidates, nei, cost, best_params, best_nei, pareto_indices):
+        self.objective = objective # 'median' or 'worst'
+        self.candidates = candidates # dict parameter name -> array, all evaluated feasible designs
+        self.nei = nei # NEI metric of each candidate [A/rtHz]
+        self.cost = cost # cost of each candidate (None if no cost was given)
+        self.best_params = best_params # dict parameter name -> value of the best design
+        self.best_nei = best_nei # NEI metric of the best design [A/rtHz]
+        self.pareto_indices = pareto_indices # indices of the candidates on the NEI vs cost Pareto front
+
+
+def build_dfmux_batch(params:dict, fixed:dict=None, freqs:np.ndarray=freqs):
+    """Function to build a DfMuxBatch from arrays of design parameters
+
+    Args:
+        params (dict): design parameter name (see DESIGN_PARAMETERS) -> array with one value per design
+        fixed (dict, optional): design parameter name -> value shared by all designs. Defaults to None.
+        freqs (np.ndarray, optional): frequency schedule [Hz]
+
+    Returns:
+        dfmux (DfMuxBatch)
+    """
+    components = {'bolo' : {}, 'carrier' : {}, 'demod' : {}, 'nuller' : {}, 'squid' : {}}
+    for name, value in {**(fixed or {}), **params}.items():
+        component, argument = DESIGN_PARAMETERS[name]
+        components[component][argument] = value
+    return DfMuxBatch(freqs, **components)
+
+
+def evaluate_designs(params:dict, fixed:dict=None, objective:str='median', freqs:np.ndarray=freqs):
+    """Function to calculate the NEI metric of many designs in one vectorized pass
+
+    Args:
+        params (dict): design parameter name -> array with one value per design
+        fixed (dict, optional): design parameter name -> value shared by all designs
+        objective (str, optional): 'median' or 'worst' (maximum) NEI over the frequency schedule. Defaults to 'median'.
+        freqs (np.ndarray, optional): frequency schedule [Hz]
+
+    Returns:
+        nei (np.ndarray): NEI metric of each design [A/rtHz]
+    """
+    total_noise = build_dfmux_batch(params, fixed, freqs).total_noise
+    if objective == 'median':
+        return np.median(total_noise, axis=1)
+    elif objective == 'worst':
+        return np.max(total_noise, axis=1)
+    raise ValueError("unknown objective '{}', options are 'median' and 'worst'".format(objective))
+
+
+# the initial search uses the same candidates every time it is run with the same bounds and seed,
+# so its chunks are cached on disk (see cache_functions.py). The refinement is not.
+evaluate_designs_cached = cached(config_file=None, depends_on=[dfmux_calc.__file__])(evaluate_designs)
+
+
+def _evaluate_chunk(args):
+    # top level function so that it can be sent to the worker processes
+    return evaluate_designs_cached(*args)
+
+
+def sample_designs(bounds:dict, n:int, seed:int=0):
+    """Function to draw designs from a Latin hypercube, uniform in log of each parameter
+
+    Args:
+        bounds (dict): design parameter name -> (lowest, highest)
+        n (int): number of designs
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        params (dict): design parameter name -> array of n values
+    """
+    sampler = qmc.LatinHypercube(d=len(bounds), seed=seed)
+    log_low = np.log([b[0] for b in bounds.values()])
+    log_high = np.log([b[1] for b in bounds.values()])
+    samples = np.exp(qmc.scale(sampler.random(n), log_low, log_high))
+    return {name : samples[:, i] for i, name in enumerate(bounds)}
+
+
+def pareto_front(nei:np.ndarray, cost:np.ndarray):
+    """Function to find the designs for which no other design has both lower NEI and lower cost
+
+    Returns:
+        indices (np.ndarray): indices of the Pareto-optimal designs, sorted by cost
+    """
+    order = np.lexsort((nei, cost)) # by cost, then by NEI
+    best_nei_so_far = np.minimum.accumulate(nei[order])
+    on_front = np.ones(len(order), dtype=bool)
+    on_front[1:] = nei[order][1:] < best_nei_so_far[:-1]
+    return order[on_front]
+
+
+def stiffening_resistor_power(params:dict, v_dac:float=1.):
+    """Example cost: power dissipated by the carrier and nuller DACs in the stiffening resistors,
+    relative to a DAC output voltage v_dac. Lower stiffening resistors mean less noise but more power.
+    """
+    return v_dac**2 / params['r_stiff_carrier'] + v_dac**2 / params['r_stiff_nuller']
+
+
+def optimize_design(bounds:dict, fixed:dict=None, constraints=(), objective:str='median', cost=None,
+                    n_candidates:int=10000, chunk_size:int=2000, n_workers:int=1, refine:bool=True,
+                    seed:int=0, freqs:np.ndarray=freqs):
+    """Function to search for the design with the lowest NEI metric
+
+    A Latin hypercube of candidate designs is evaluated first (in chunks, over n_workers processes),
+    then the best design is refined with differential evolution, which evaluates each generation
+    as one DfMuxBatch.
+
+    Args:
+        bounds (dict): design parameter name -> (lowest, highest) for the parameters to search
+        fixed (dict, optional): design parameter name -> value for the parameters kept fixed
+        constraints (list, optional): functions taking the dict of parameter arrays and returning
+            True where a design is allowed
+        objective (str, optional): 'median' or 'worst' NEI over the frequency schedule. Defaults to 'median'.
+        cost (callable, optional): function taking the dict of parameter arrays and returning the cost
+            (component cost, power...) of each design. Needed for the Pareto front.
+        n_candidates (int, optional): number of designs in the initial search. Defaults to 10000.
+        chunk_size (int, optional): designs per DfMuxBatch. Defaults to 2000.
+        n_workers (int, optional): number of worker processes. Defaults to 1.
+        refine (bool, optional): refine the best design with differential evolution. Defaults to True.
+        seed (int, optional): random seed. Defaults to 0.
+        freqs (np.ndarray, optional): frequency schedule [Hz]
+
+    Returns:
+        result (DesignResult)
+    """
+    names = list(bounds)
+    candidates = sample_designs(bounds, n_candidates, seed)
+    feasible = get_feasible({**(fixed or {}), **candidates}, constraints)
+    candidates = {name : values[feasible] for name, values in candidates.items()}
+    n_feasible = int(np.sum(feasible))
+    if n_feasible == 0:
+        raise ValueError("none of the {} candidate designs satisfies the constraints".format(n_candidates))
+
+    chunks = [({name : values[start:start + chunk_size] for name, values in candidates.items()}, fixed, objective, freqs)
+              for start in range(0, n_feasible, chunk_size)]
+    if n_workers == 1:
+        nei = np.concatenate([_evaluate_chunk(chunk) for chunk in chunks])
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            nei = np.concatenate(list(executor.map(_evaluate_chunk, chunks)))
+
+    best = np.argmin(nei)
+    best_params = {name : candidates[name][best] for name in names}
+    best_nei = nei[best]
+
+    if refine:
+        def objective_function(log_x):
+            # log_x has shape (number of parameters, number of designs in this generation)
+            params = {name : np.exp(log_x[i]) for i, name in enumerate(names)}
+            values = evaluate_designs(params, fixed, objective, freqs)
+            return np.where(get_feasible({**(fixed or {}), **params}, constraints), values, np.inf)
+
+        log_bounds = [(np.log(bounds[name][0]), np.log(bounds[name][1])) for name in names]
+        initial_population = np.log(np.array([candidates[name][np.argsort(nei)[:15 * len(names)]] for name in names]).T)
+        refined = differential_evolution(objective_function, log_bounds, init=initial_population, seed=seed,
+                                         vectorized=True, updating='deferred', polish=False, tol=1e-8)
+        if refined.fun < best_nei:
+            best_params = {name : np.exp(refined.x[i]) for i, name in enumerate(names)}
+            best_nei = refined.fun
+
+    if cost is not None:
+        cost_values = np.asarray(cost({**(fixed or {}), **candidates}), dtype=float)
+        pareto_indices = pareto_front(nei, cost_values)
+    else:
+        cost_values = None
+        pareto_indices = np.array([], dtype=int)
+
+    return DesignResult(objective, candidates, nei, cost_values, best_params, best_nei, pareto_indices)
+
+
+def get_feasible(params:dict, constraints):
+    """Function to combine the constraints, returns True for the designs that satisfy all of them"""
+    # fixed parameters are scalars, the searched ones have one value per design
+    feasible = np.ones(np.broadcast_shapes(*[np.shape(value) for value in params.values()]), dtype=bool)
+    for constraint in constraints:
+        feasible &= np.asarray(constraint(params), dtype=bool)
+    return feasible
+
+
+def plot_pareto_front(result:DesignResult, figcount=1):
+    from matplotlib import pyplot as plt
+    plt.figure(figcount)
+    plt.axhline(LB_requirement*1e12, label="goal", linewidth=5, alpha=0.5)
+    plt.scatter(result.cost, result.nei*1e12, s=2, color='gray', alpha=0.3, label='candidates')
+    plt.plot(result.cost[result.pareto_indices], result.nei[result.pareto_indices]*1e12, 'k.-', label='Pareto front')
+    plt.legend()
+    plt.xlabel('Cost')
+    plt.ylabel('{} readout noise [pA/rtHz]'.format(result.objective.capitalize()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Readout noise requirements of all the LiteBIRD bands on a grid of TES resistance, loop gain and bath
+temperature, from NEP_g, NEP_ph and S_I in noise_formulas.py.
+The readout NEP may increase the detector NEP (phonon and photon in quadrature) by 10%, so
+NEP_read = sqrt((NEP_g^2 + NEP_ph^2) * (1.1^2 - 1)) and NEI_read = NEP_read * S_I, as in litebird_noise.ipynb.
+Grids that do not fit in memory are evaluated in chunks into a memory-mapped .npy file.
+nei_margin compares the requirement of every band with the readout noise predicted by a DfMux
+(or DfMuxBatch) configuration at every bias frequency.
+"""
+import numpy as np
+from noise_formulas import NEP_g, NEP_ph, S_I
+from dfmux_calc import DfMux, DfMuxBatch
+
+BOLO_PARAMS_FILE = 'LiteBIRD_PTEP_bolo_params.txt'
+
+
+class BoloParams:
+    """
+    Detector parameters of each band: pixel ID, band center v [Hz], fractional bandwidth dvfrac,
+    optical power popt [W], saturation power psat [W], critical temperature tc [K] and thermal index n
+    """
+    def __init__(self, pixel, v, dvfrac, popt, psat, tc, n):
+        self.pixel = np.asarray(pixel)
+        self.v = np.asarray(v, dtype=float)
+        self.dvfrac = np.asarray(dvfrac, dtype=float)
+        self.dv = self.dvfrac * self.v
+        self.popt = np.asarray(popt, dtype=float)
+        self.psat = np.asarray(psat, dtype=float)
+        self.tc = np.asarray(tc, dtype=float)
+        self.n = np.asarray(n, dtype=float)
+
+    def __len__(self):
+        return len(self.v)
+
+    @property
+    def labels(self):
+        """Band labels, e.g. 'LF1 40 GHz'"""
+        return np.array(["{} {:.0f} GHz".format(pixel, v/1e9) for pixel, v in zip(self.pixel, self.v)])
+
+    @classmethod
+    def from_file(cls, filename:str=BOLO_PARAMS_FILE):
+        """Function to read the bolometer parameters (three header lines, then one line per band)"""
+        pixel = np.loadtxt(filename, skiprows=3, delimiter=',', dtype=str, usecols=0)
+        v, dvfrac, popt, psat, tc, n = np.loadtxt(filename, skiprows=3, delimiter=',', dtype=float,
+                                                  usecols=(1, 2, 3, 4, 5, 6), unpack=True)
+        return cls(np.char.strip(pixel), v, dvfrac, popt, psat, tc, n)
+
+
+class LabelledArray:
+    """
+    N-D array with a name and coordinates for each axis, e.g. dims ('band', 'r_tes', 'loop_gain', 't_bath').
+    values can be a numpy array or a memory map.
+    """
+    def __init__(self, values, dims:tuple, coords:dict, name:str=''):
+        self.values = values
+        self.dims = tuple(dims)
+        self.coords = {dim : np.asarray(coords[dim]) for dim in self.dims}
+        self.name = name
+        if self.values.shape != tuple(len(self.coords[dim]) for dim in self.dims):
+            raise ValueError("shape {} does not match the coordinates {}".format(self.values.shape,
+                             {dim : len(self.coords[dim]) for dim in self.dims}))
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.values, dtype=dtype)
+
+    def __repr__(self):
+        return "LabelledArray({}: {})".format(self.name, ", ".join("{}={}".format(dim, n) for dim, n in zip(self.dims, self.shape)))
+
+    def axis(self, dim:str):
+        return self.dims.index(dim)
+
+    def isel(self, **indices):
+        """Selection by index along named axes, e.g. grid.isel(band=3, t_bath=0). Integer indices drop the axis"""
+        key = tuple(indices.get(dim, slice(None)) for dim in self.dims)
+        dims = [dim for dim in self.dims if not np.isscalar(indices.get(dim, slice(None)))]
+        coords = {dim : self.coords[dim][indices.get(dim, slice(None))] for dim in dims}
+        return LabelledArray(self.values[key], dims, coords, self.name)
+
+    def sel(self, **values):
+        """Selection of the nearest coordinate along named axes, e.g. grid.sel(r_tes=0.7, loop_gain=10)"""
+        indices = {}
+        for dim, value in values.items():
+            coord = self.coords[dim]
+            if coord.dtype.kind in 'US':
+                indices[dim] = int(np.flatnonzero(coord == value)[0])
+            else:
+                indices[dim] = int(np.argmin(np.abs(coord - value)))
+        return self.isel(**indices)
+
+    def _reduce(self, function, dim:str):
+        axis = self.axis(dim)
+        dims = self.dims[:axis] + self.dims[axis+1:]
+        return LabelledArray(function(self.values, axis=axis), dims, {d : self.coords[d] for d in dims}, self.name)
+
+    def min(self, dim:str):
+        """Minimum along a named axis, e.g. grid.min('band') for the most demanding band"""
+        return self._reduce(np.min, dim)
+
+    def max(self, dim:str):
+        return self._reduce(np.max, dim)
+
+    def argmin(self, dim:str):
+        """Coordinates of the minimum along a named axis, e.g. grid.argmin('band') for the label of the most demanding band"""
+        axis = self.axis(dim)
+        dims = self.dims[:axis] + self.dims[axis+1:]
+        return LabelledArray(self.coords[dim][np.argmin(self.values, axis=axis)], dims, {d : self.coords[d] for d in dims}, self.name)
+
+
+def nep_readout_requirement(bolo:BoloParams, t_bath, margin:float=1.1):
+    """Maximum readout NEP [W/rtHz], such that the detector NEP increases by less than margin
+
+    Args:
+        bolo (BoloParams): detector parameters
+        t_bath (float or np.ndarray): bath temperature [K]
+        margin (float, optional): allowed increase of the detector NEP. Defaults to 1.1.
+
+    Returns:
+        nep_read_req (np.ndarray): shape (number of bands, number of bath temperatures)
+    """
+    t_bath = np.atleast_1d(np.asarray(t_bath, dtype=float))
+    nep_g = NEP_g(bolo.psat[:, np.newaxis], bolo.n[:, np.newaxis], t_bath, bolo.tc[:, np.newaxis]) # phonon noise
+    nep_ph = NEP_ph(bolo.popt, bolo.v, bolo.dv)[:, np.newaxis] # photon noise
+    return np.sqrt((nep_g**2 + nep_ph**2)*(margin**2 - 1))
+
+
+def requirement_grid(r_tes, loop_gain, t_bath=0.1, bolo:BoloParams=None, margin:float=1.1, ac:bool=True,
+                     filename:str=None, chunk_size:int=2**24):
+    """Maximum readout NEI of every band on a grid of TES resistance, loop gain and bath temperature
+
+    NEI_read[band, r_tes, loop_gain, t_bath] = nep_readout_requirement[band, t_bath] * S_I(r_tes, psat - popt, loop_gain)
+    The grid is filled in chunks of the r_tes axis, so that the temporary arrays hold at most about
+    chunk_size elements.
+
+    Args:
+        r_tes (np.ndarray): TES resistances [Ohm]
+        loop_gain (np.ndarray): loop gains
+        t_bath (float or np.ndarray, optional): bath temperatures [K]. Defaults to 0.1.
+        bolo (BoloParams, optional): detector parameters. Defaults to LiteBIRD_PTEP_bolo_params.txt.
+        margin (float, optional): allowed increase of the detector NEP. Defaults to 1.1.
+        ac (bool, optional): AC bias convention of S_I. Defaults to True.
+        filename (str, optional): .npy file to write the grid into (memory map) instead of memory. Defaults to None.
+        chunk_size (int, optional): number of elements evaluated at once. Defaults to 2**24.
+
+    Returns:
+        nei_read_req (LabelledArray): [A/rtHz], dims ('band', 'r_tes', 'loop_gain', 't_bath')
+    """
+    if bolo is None:
+        bolo = BoloParams.from_file()
+    r_tes = np.atleast_1d(np.asarray(r_tes, dtype=float))
+    loop_gain = np.atleast_1d(np.asarray(loop_gain, dtype=float))
+    t_bath = np.atleast_1d(np.asarray(t_bath, dtype=float))
+    shape = (len(bolo), len(r_tes), len(loop_gain), len(t_bath))
+    if filename is None:
+        values = np.empty(shape)
+    else:
+        values = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float64, shape=shape)
+
+    nep_read_req = nep_readout_requirement(bolo, t_bath, margin)[:, np.newaxis, np.newaxis, :]
+    pelec = (bolo.psat - bolo.popt)[:, np.newaxis, np.newaxis]
+    rows = max(1, chunk_size // (shape[0] * shape[2] * shape[3]))
+    for start in range(0, len(r_tes), rows):
+        block = slice(start, start + rows)
+        si = S_I(r_tes[np.newaxis, block, np.newaxis], pelec, loop_gain[np.newaxis, np.newaxis, :], ac)
+        values[:, block] = nep_read_req * si[..., np.newaxis]
+    if filename is not None:
+        values.flush()
+
+    coords = {'band' : bolo.labels, 'r_tes' : r_tes, 'loop_gain' : loop_gain, 't_bath' : t_bath}
+    return LabelledArray(values, ('band', 'r_tes', 'loop_gain', 't_bath'), coords, 'nei_read_req')
+
+
+def open_requirement_grid(filename:str, r_tes, loop_gain, t_bath=0.1, bolo:BoloParams=None):
+    """Function to open a grid written by requirement_grid(..., filename=filename) without recomputing it"""
+    if bolo is None:
+        bolo = BoloParams.from_file()
+    coords = {'band' : bolo.labels, 'r_tes' : np.atleast_1d(r_tes), 'loop_gain' : np.atleast_1d(loop_gain),
+              't_bath' : np.atleast_1d(t_bath)}
+    return LabelledArray(np.load(filename, mmap_mode='r'), ('band', 'r_tes', 'loop_gain', 't_bath'), coords, 'nei_read_req')
+
+
+class NEIMargin:
+    """
+    NEI margin (requirement / predicted readout noise) of every band at every bias frequency.
+    requirement has dims ('band',), predicted ('freq',) and margin ('band', 'freq'), with a leading
+    'config' axis for a DfMuxBatch. A margin below 1 means the readout noise is above the requirement.
+    """
+    def __init__(self, requirement:LabelledArray, predicted:LabelledArray, margin:LabelledArray, bolo:BoloParams):
+        self.requirement = requirement
+        self.predicted = predicted
+        self.margin = margin
+        self.bolo = bolo
+
+    def table(self, config:int=0):
+        """Summary of each band for one configuration
+
+        Returns:
+            table (np.ndarray): structured array with the fields band, v [GHz], requirement [pA/rtHz],
+                worst_predicted [pA/rtHz], min_margin, f_min_margin [MHz] (bias frequency of the smallest margin)
+                and passing (fraction of the channels with margin >= 1)
+        """
+        margin, requirement, predicted = self.margin, self.requirement, self.predicted
+        if 'config' in margin.dims:
+            margin, requirement, predicted = margin.isel(config=config), requirement.isel(config=config), predicted.isel(config=config)
+        table = np.zeros(len(self.bolo), dtype=[('band', 'U16'), ('v', float), ('requirement', float), ('worst_predicted', float),
+                                                ('min_margin', float), ('f_min_margin', float), ('passing', float)])
+        table['band'] = self.bolo.pixel
+        table['v'] = self.bolo.v / 1e9
+        table['requirement'] = requirement.values * 1e12
+        table['worst_predicted'] = np.max(predicted.values) * 1e12
+        table['min_margin'] = np.min(margin.values, axis=1)
+        table['f_min_margin'] = margin.coords['freq'][np.argmin(margin.values, axis=1)] / 1e6
+        table['passing'] = np.mean(margin.values >= 1, axis=1)
+        return table
+
+    def print_table(self, config:int=0):
+        print("Band  | v [GHz] | Req. NEI [pA/rtHz] | Worst NEI [pA/rtHz] | Min margin | at [MHz] | Passing [%]")
+        for row in self.table(config):
+            print("{:5s} | {:7.0f} | {:18.2f} | {:19.2f} | {:10.2f} | {:8.2f} | {:11.0f}".format(
+                row['band'], row['v'], row['requirement'], row['worst_predicted'], row['min_margin'],
+                row['f_min_margin'], row['passing']*100))
+
+
+def nei_margin(dfmux:DfMux, bolo:BoloParams=None, loop_gain:float=10., margin:float=1.1, ac:bool=True):
+    """Function to compare the readout NEI requirement of every band with the noise predicted by a DfMux configuration
+
+    The requirement uses the TES resistance (bolo.r) and bath temperature (bolo.tb) of the DfMux, and the
+    predicted noise is dfmux.total_noise at each bias frequency, e.g. of a frequency schedule file with
+    DfMux('frequency_schedule.yaml', ...). For a DfMuxBatch all the configurations are evaluated at once.
+
+    Args:
+        dfmux (DfMux or DfMuxBatch): readout configuration
+        bolo (BoloParams, optional): detector parameters of the bands. Defaults to LiteBIRD_PTEP_bolo_params.txt.
+        loop_gain (float, optional): loop gain of the TES. Defaults to 10.
+        margin (float, optional): allowed increase of the detector NEP. Defaults to 1.1.
+        ac (bool, optional): AC bias convention of S_I. Defaults to True.
+
+    Returns:
+        result (NEIMargin)
+    """
+    if bolo is None:
+        bolo = BoloParams.from_file()
+    n_configs = dfmux.n_configs if isinstance(dfmux, DfMuxBatch) else 1
+    r_tes = np.broadcast_to(np.ravel(dfmux.bolo.r), (n_configs,))
+    t_bath = np.broadcast_to(np.ravel(dfmux.bolo.tb), (n_configs,))
+    freqs = np.asarray(dfmux.freqs)
+
+    # requirement[config, band]
+    nep_read_req = nep_readout_requirement(bolo, t_bath, margin).T
+    requirement = nep_read_req * S_I(r_tes[:, np.newaxis], bolo.psat - bolo.popt, loop_gain, ac)
+    # predicted[config, freq]
+    predicted = np.broadcast_to(dfmux.total_noise, (n_configs, len(freqs)))
+    ratio = requirement[:, :, np.newaxis] / predicted[:, np.newaxis, :]
+
+    coords = {'config' : np.arange(n_configs), 'band' : bolo.labels, 'freq' : freqs}
+    result = NEIMargin(LabelledArray(requirement, ('config', 'band'), coords, 'nei_read_req'),
+                       LabelledArray(predicted, ('config', 'freq'), coords, 'total_noise'),
+                       LabelledArray(ratio, ('config', 'band', 'freq'), coords, 'nei_margin'), bolo)
+    if not isinstance(dfmux, DfMuxBatch):
+        result.requirement = result.requirement.isel(config=0)
+        result.predicted = result.predicted.isel(config=0)
+        result.margin = result.margin.isel(config=0)
+    return result
+
+
+def main(schedule_file:str=None):
+    # baseline system of compare_dfmux_noise.py, with the LiteBIRD frequency schedule
+    # (or the schedule file written by electric_design/frequency_schedule.py)
+    from dfmux_calc import Bolometer, CarrierChain, DemodChain, NullerChain, SQUID
+    freqs = np.linspace(1.5e6, 5.5e6, 68) if schedule_file is None else schedule_file
+    dfmux = DfMux(freqs, bolo=Bolometer(r=1.), carrier=CarrierChain(), demod=DemodChain(), nuller=NullerChain(),
+                  squid=SQUID(zt=1500., rdyn=400., lin=70e-9, noise_squid_only=1e-12))
+    nei_margin(dfmux).print_table()
+
+
+if __name__ == "__main__":
+    main()
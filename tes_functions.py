@@ -21,13 +21,16 @@ def get_loop_gain(Pbias:float, alpha:float, g:float, Tc:float, omega:float, tau0
     return L
 
 def get_responsivity(Vbias:float, L:float, omega:float, tau:float, AC:bool=True):
-    """Function to calculate responsivity of detector
+    """Function to calculate responsivity of detector without stray impedance, see get_tes_responsivity
+    S = -Stilda / Vbias * L/(1+L) * 1/(1+1j*omega*tau), with Stilda = 1/sqrt(2) for AC bias and 1 for DC bias.
+    The sign and prefactor are the ones this function always had, they differ from get_tes_responsivity
+    (positive, sqrt(2) for AC): for AC bias get_responsivity = -get_tes_responsivity/2
 
     Args:
         Vbias (float): Voltage bias
         L (float): Loop gain
         omega (float): frequency of AC current
-        tau (float): time constant of detector
+        tau (float): time constant of detector with electrothermal feedback, tau0/(1+L)
         AC (bool, optional): whether or not system has Alternating Current. True by default
     """
     
@@ -35,7 +38,36 @@ def get_responsivity(Vbias:float, L:float, omega:float, tau:float, AC:bool=True)
         Stilda = 1/np.sqrt(2)
     else:
         Stilda = 1
-        
-    S = -Stilda / Vbias * L/(1+L) * 1/(1+1j*omega*tau)
     
-    return S
\ No newline at end of file
+    # get_tes_responsivity without prefactor (DC) is 1/Vbias * L/(1+L) * 1/(1+1j*omega*tau)
+    S = -Stilda * get_tes_responsivity(Vbias, L, omega=omega, tau0=tau*(1+L), AC=False)
+    
+    return S
+
+def get_tes_responsivity(V_TES, loop_gain, omega=0., tau0=0., R_TES=1., R_s=0., AC:bool=True):
+    """Function to calculate the complex current responsivity of a voltage biased TES, vectorized:
+    all the arguments broadcast, e.g. loop_gain[:, None, None, None], R_s[None, :, None, None],
+    omega[None, None, :, None] and R_TES[None, None, None, :] for a full responsivity surface.
+
+    Small signal model of Irwin & Hilton (beta=0, negligible electrical time constant) with a
+    stray series impedance R_s and the frequency dependent loop gain L(omega) = L0/(1 + j omega tau0):
+        S_I = prefactor * L(omega) / (I0 * (L(omega)*(R_TES - R_s) + R_TES + R_s)),  I0 = V_TES/R_TES
+    For R_s = 0 this is prefactor/V_TES * L0/(1+L0) * 1/(1 + j omega tau0/(1+L0)).
+    The sign follows calculate_responsivity in core_equations.py (positive at low frequency).
+
+    Args:
+        V_TES (float or np.ndarray): voltage across the TES (rms for AC bias) [V]
+        loop_gain (float or np.ndarray): low frequency loop gain L0
+        omega (float or np.ndarray, optional): angular frequency of the signal [rad/s]. Defaults to 0.
+        tau0 (float or np.ndarray, optional): time constant of the detector without feedback [s]. Defaults to 0.
+        R_TES (float or np.ndarray, optional): TES resistance [Ohm]. Defaults to 1.
+        R_s (float, complex or np.ndarray, optional): stray series impedance [Ohm]. Defaults to 0.
+        AC (bool, optional): AC bias, prefactor sqrt(2) (as S_I in noise_formulas.py), 1 for DC. Defaults to True.
+
+    Returns:
+        S_I (np.ndarray): complex responsivity [1/V]
+    """
+    prefactor = np.sqrt(2) if AC else 1.
+    L = loop_gain / (1 + 1j*np.asarray(omega)*tau0) # same roll-off as get_loop_gain
+    I0 = V_TES / R_TES
+    return prefactor * L / (I0 * (L*(R_TES - R_s) + R_TES + R_s))
\ No newline at end of file
@@ -0,0 +1,285 @@
+"""
+this file contains the electrothermal stability analysis of a voltage biased TES in series with a stray
+impedance R_s and an inductance L_stray, following Irwin & Hilton (2005), section 2.
+beta = dlogR/dlogI is kept as a parameter, it is 0 in the rest of this repository.
+
+The small signal equations of the current and temperature of the TES are d/dt [dI, dT] = -M [dI, dT] with
+    M = [[1/tau_el, loop_gain G/(I0 L_el)], [-I0 R_TES (2+beta)/C, (1 - loop_gain)/tau0]]
+    1/tau_el = (R_s + R_TES (1+beta))/L_el
+The two poles are s = -1/tau_+ and s = -1/tau_-, the detector is stable when both rates 1/tau have a
+positive real part, i.e. when trace(M) > 0 and det(M) > 0:
+    electrical: (R_s + R_TES (1+beta)) tau0 + (1 - loop_gain) L_el > 0 (the inductance is small enough)
+    thermal:    R_s (1 - loop_gain) + R_TES (1 + beta + loop_gain) > 0
+For beta = 0 the thermal condition is R_TES > R_s (L-1)/(L+1), used in simulate_detector_stability.ipynb.
+With AC bias the envelope of the current through the LC filter sees twice the inductance, L_el = 2 L_stray.
+
+All the functions broadcast over their arguments, so the maps over loop gain, R_s, L_stray, tau0 and R_TES,
+or over all the channels of a comb, are single numpy expressions. find_stability_boundary locates the
+boundary of the stable region in a plane of two parameters with an adaptive (quadtree) refinement: only
+the cells that the boundary crosses are split, so the boundary is resolved on a fine grid for the cost of
+a coarse one.
+"""
+
+import numpy as np
+
+
+def _electrical_inductance(L_stray, ac:bool):
+    return 2 * np.asarray(L_stray, dtype=float) if ac else np.asarray(L_stray, dtype=float)
+
+
+def get_tes_poles(loop_gain, tau0, R_TES, R_s=0., L_stray=0., beta=0., ac:bool=True):
+    """Function to calculate the two rates 1/tau_+ and 1/tau_- of the coupled electrical and thermal
+    response of a TES (the poles are s = -1/tau), all the arguments broadcast
+
+    Args:
+        loop_gain (float or np.ndarray): low frequency loop gain
+        tau0 (float or np.ndarray): time constant of the detector without feedback, C/G [s]
+        R_TES (float or np.ndarray): TES resistance [Ohm]
+        R_s (float or np.ndarray, optional): stray series resistance [Ohm]. Defaults to 0.
+        L_stray (float or np.ndarray, optional): inductance in series with the TES [H]. Defaults to 0.
+        beta (float or np.ndarray, optional): dlogR/dlogI. Defaults to 0.
+        ac (bool, optional): AC bias, the electrical time constant is doubled. Defaults to True.
+
+    Returns:
+        rates (np.ndarray): complex array of shape (2, *broadcast shape), 1/tau_+ and 1/tau_- [1/s].
+            For L_stray = 0, 1/tau_+ is inf and 1/tau_- is the thermal rate of Irwin & Hilton eq. 2.
+    """
+    L_el = _electrical_inductance(L_stray, ac)
+    R_el = R_s + R_TES * (1 + beta)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate_el = R_el / L_el
+        rate_I = (1 - loop_gain) / tau0
+        coupling = loop_gain * R_TES * (2 + beta) / (L_el * tau0)
+        mean = (rate_el + rate_I) / 2
+        root = np.sqrt(((rate_el - rate_I) / 2)**2 - coupling + 0j)
+        rate_plus = mean + root
+        rate_minus = mean - root
+        # L_stray -> 0: the electrical pole goes to infinity and the thermal one to det/trace
+        rate_thermal = (R_s * (1 - loop_gain) + R_TES * (1 + beta + loop_gain)) / (tau0 * R_el)
+    no_inductance = L_el == 0
+    rate_plus = np.where(no_inductance, np.inf, rate_plus)
+    rate_minus = np.where(no_inductance, rate_thermal, rate_minus)
+    return np.stack(np.broadcast_arrays(rate_plus, rate_minus))
+
+
+def get_stability_margin(loop_gain, tau0, R_TES, R_s=0., L_stray=0., beta=0., ac:bool=True):
+    """Smallest real part of the rates 1/tau of get_tes_poles [1/s], positive when the TES is stable"""
+    return np.min(np.real(get_tes_poles(loop_gain, tau0, R_TES, R_s, L_stray, beta, ac)), axis=0)
+
+
+def is_stable(loop_gain, tau0, R_TES, R_s=0., L_stray=0., beta=0., ac:bool=True):
+    """Function to check the electrical and thermal stability conditions, same arguments as get_tes_poles
+
+    Returns:
+        stable (np.ndarray): boolean array of the broadcast shape of the arguments
+    """
+    L_el = _electrical_inductance(L_stray, ac)
+    electrical = (R_s + R_TES * (1 + beta)) * tau0 + (1 - loop_gain) * L_el > 0
+    thermal = R_s * (1 - loop_gain) + R_TES * (1 + beta + loop_gain) > 0
+    return electrical & thermal
+
+
+def get_minimum_stable_resistance(loop_gain, tau0=np.inf, R_s=0., L_stray=0., beta=0., ac:bool=True):
+    """Function to calculate the lowest TES resistance that is stable, all the arguments broadcast.
+    Both stability conditions are linear in R_TES, so this is the largest of the two bounds
+    (and 0 if there is no bound).
+
+    Args:
+        loop_gain (float or np.ndarray): low frequency loop gain
+        tau0 (float or np.ndarray, optional): time constant of the detector without feedback [s].
+            Defaults to inf (only the thermal condition, as in simulate_detector_stability.ipynb).
+        R_s (float or np.ndarray, optional): stray series resistance [Ohm]. Defaults to 0.
+        L_stray (float or np.ndarray, optional): inductance in series with the TES [H]. Defaults to 0.
+        beta (float or np.ndarray, optional): dlogR/dlogI. Defaults to 0.
+        ac (bool, optional): AC bias, the electrical time constant is doubled. Defaults to True.
+
+    Returns:
+        R_TES_min (np.ndarray): minimum stable TES resistance [Ohm]
+    """
+    L_el = _electrical_inductance(L_stray, ac)
+    R_thermal = R_s * (loop_gain - 1) / (1 + beta + loop_gain)
+    R_electrical = ((loop_gain - 1) * L_el / tau0 - R_s) / (1 + beta)
+    return np.maximum(np.maximum(R_thermal, R_electrical), 0.)
+
+
+def get_maximum_stable_inductance(loop_gain, tau0, R_TES, R_s=0., beta=0., ac:bool=True):
+    """Function to calculate the largest series inductance L_stray for which the TES is electrically stable,
+    inf for loop gains <= 1. Same arguments as get_tes_poles.
+
+    Returns:
+        L_max (np.ndarray): maximum stable inductance [H]
+    """
+    with np.errstate(divide='ignore'):
+        L_el_max = np.where(np.asarray(loop_gain) > 1, (R_s + R_TES * (1 + beta)) * tau0 / (np.asarray(loop_gain) - 1.), np.inf)
+    return L_el_max / 2 if ac else L_el_max
+
+
+def get_comb_minimum_stable_resistance(comb, loop_gain, tau0, beta=0., ac:bool=True):
+    """Function to calculate the minimum stable TES resistance of every channel of a comb,
+    with the Thévenin-equivalent resistance seen by each TES at its bias frequency as R_s and the
+    resonator plus stray inductance as L_stray
+
+    Args:
+        comb (bolocomb): the comb, see electric_design/bolocomb.py
+        loop_gain (float or np.ndarray): loop gain(s), broadcast against the channels along the last axis
+        tau0 (float or np.ndarray): time constant of the detector without feedback [s]
+        beta (float, optional): dlogR/dlogI. Defaults to 0.
+        ac (bool, optional): AC bias. Defaults to True.
+
+    Returns:
+        R_TES_min (np.ndarray): minimum stable TES resistance, channels along the last axis [Ohm]
+        f_bias (np.ndarray): bias frequency of each channel [Hz]
+    """
+    z_thev, f_bias = comb.z_thev()
+    return get_minimum_stable_resistance(loop_gain, tau0, np.real(z_thev), comb.L + comb.Ls, beta, ac), f_bias
+
+
+class StabilityBoundary:
+    """
+    Boundary of the stable region in the plane of two parameters, from find_stability_boundary.
+    x, y are points on the boundary (zero crossings of the margin on the edges of the finest cells),
+    samples_x, samples_y, samples_margin are all the points where the margin was evaluated.
+    """
+    def __init__(self, x:np.ndarray, y:np.ndarray, samples_x:np.ndarray, samples_y:np.ndarray,
+                 samples_margin:np.ndarray, n_levels:int):
+        self.x = x
+        self.y = y
+        self.samples_x = samples_x
+        self.samples_y = samples_y
+        self.samples_margin = samples_margin
+        self.n_levels = n_levels
+
+    @property
+    def n_evaluations(self):
+        return len(self.samples_margin)
+
+
+def _to_parameter(u, value_range, log:bool):
+    # position in [0, 1] -> parameter value
+    low, high = value_range
+    if log:
+        return low * (high / low)**u
+    return low + (high - low) * u
+
+
+def find_stability_boundary(margin_function, x_range, y_range, n_initial:int=16, n_levels:int=6,
+                            log_x:bool=False, log_y:bool=False):
+    """Function to find the boundary of the region where margin_function(x, y) > 0 with a quadtree:
+    the plane is divided in n_initial x n_initial cells, and at each level the cells whose corners
+    do not all have the same sign are split in four. The corners shared between cells and levels are
+    evaluated once. The final resolution is that of a (n_initial * 2^n_levels)^2 uniform grid.
+
+    Args:
+        margin_function (callable): vectorized function of two arrays x, y, positive in the stable region
+            and continuous across the boundary, e.g. a partial of get_stability_margin
+        x_range (tuple): (lowest, highest) x
+        y_range (tuple): (lowest, highest) y
+        n_initial (int, optional): number of cells along each axis at the first level. Defaults to 16.
+        n_levels (int, optional): number of refinements. Defaults to 6.
+        log_x (bool, optional): logarithmic spacing in x. Defaults to False.
+        log_y (bool, optional): logarithmic spacing in y. Defaults to False.
+
+    Returns:
+        boundary (StabilityBoundary)
+    """
+    n = n_initial
+    i, j = [index.ravel() for index in np.meshgrid(np.arange(n), np.arange(n), indexing='ij')]
+    corner_di = np.array([0, 1, 0, 1])
+    corner_dj = np.array([0, 0, 1, 1])
+    known_i = np.zeros(0, dtype=np.int64)
+    known_j = np.zeros(0, dtype=np.int64)
+    known_margin = np.zeros(0)
+
+    for level in range(n_levels + 1):
+        corners_i = i[:, np.newaxis] + corner_di
+        corners_j = j[:, np.newaxis] + corner_dj
+        keys = corners_i * (n + 1) + corners_j
+        known_keys = known_i * (n + 1) + known_j
+
+        # evaluate the corners that were not evaluated at a previous level
+        new_keys = np.setdiff1d(keys, known_keys)
+        new_i, new_j = np.divmod(new_keys, n + 1)
+        new_margin = margin_function(_to_parameter(new_i / n, x_range, log_x), _to_parameter(new_j / n, y_range, log_y))
+        known_i = np.concatenate([known_i, new_i])
+        known_j = np.concatenate([known_j, new_j])
+        known_margin = np.concatenate([known_margin, np.broadcast_to(new_margin, new_keys.shape)])
+
+        known_keys = known_i * (n + 1) + known_j
+        order = np.argsort(known_keys)
+        corner_margin = known_margin[order[np.searchsorted(known_keys[order], keys)]]
+        corner_stable = corner_margin > 0 # nan counts as unstable
+        mixed = np.any(corner_stable, axis=1) & ~np.all(corner_stable, axis=1)
+        i, j, corner_margin = i[mixed], j[mixed], corner_margin[mixed]
+        if level == n_levels:
+            break
+
+        # split the cells that the boundary crosses, the grid is twice as fine
+        i = (2 * i[:, np.newaxis] + corner_di).ravel()
+        j = (2 * j[:, np.newaxis] + corner_dj).ravel()
+        known_i = 2 * known_i
+        known_j = 2 * known_j
+        n = 2 * n
+
+    # zero crossings along the edges of the finest cells, linear interpolation of the margin
+    boundary_u = []
+    boundary_v = []
+    for a, b in ((0, 1), (0, 2), (1, 3), (2, 3)):
+        margin_a = corner_margin[:, a]
+        margin_b = corner_margin[:, b]
+        crossing = (margin_a > 0) != (margin_b > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = margin_a[crossing] / (margin_a[crossing] - margin_b[crossing])
+        t = np.where(np.isfinite(t), np.clip(t, 0, 1), 0.5)
+        boundary_u.append((i[crossing] + corner_di[a] + t * (corner_di[b] - corner_di[a])) / n)
+        boundary_v.append((j[crossing] + corner_dj[a] + t * (corner_dj[b] - corner_dj[a])) / n)
+    # edges shared by two cells give the same point twice
+    boundary_uv = np.unique(np.round(np.stack([np.concatenate(boundary_u), np.concatenate(boundary_v)], axis=1), 12), axis=0)
+
+    return StabilityBoundary(_to_parameter(boundary_uv[:, 0], x_range, log_x), _to_parameter(boundary_uv[:, 1], y_range, log_y),
+                             _to_parameter(known_i / n, x_range, log_x), _to_parameter(known_j / n, y_range, log_y),
+                             known_margin, n_levels)
+
+
+def stability_boundary(x_name:str, x_range, y_name:str, y_range, n_initial:int=16, n_levels:int=6,
+                       log_x:bool=False, log_y:bool=False, **parameters):
+    """Function to find the stability boundary in the plane of two arguments of get_tes_poles,
+    e.g. stability_boundary('R_s', (0, 0.5), 'R_TES', (0.01, 1), loop_gain=10, tau0=30e-3, L_stray=60e-6)
+
+    Args:
+        x_name (str): name of the first parameter ('loop_gain', 'tau0', 'R_TES', 'R_s', 'L_stray' or 'beta')
+        x_range (tuple): (lowest, highest) value of the first parameter
+        y_name (str): name of the second parameter
+        y_range (tuple): (lowest, highest) value of the second parameter
+        n_initial, n_levels, log_x, log_y: see find_stability_boundary
+        **parameters: values of the other arguments of get_tes_poles
+
+    Returns:
+        boundary (StabilityBoundary)
+    """
+    def margin_function(x, y):
+        return get_stability_margin(**{x_name : x, y_name : y}, **parameters)
+    return find_stability_boundary(margin_function, x_range, y_range, n_initial, n_levels, log_x, log_y)
+
+
+def local_main():
+    loop_gain = 10
+    tau0 = 30e-3 # s
+    L_stray = 60e-6 # H, resonator inductance
+    boundary = stability_boundary('R_s', (0., 0.5), 'R_TES', (0.01, 1.), loop_gain=loop_gain, tau0=tau0, L_stray=L_stray)
+    # exact boundary for comparison
+    R_min = get_minimum_stable_resistance(loop_gain, tau0, boundary.x, L_stray)
+    print("{} boundary points from {} evaluations (uniform grid: {})".format(
+        len(boundary.x), boundary.n_evaluations, (16 * 2**boundary.n_levels + 1)**2))
+    inside = (R_min > 0.01) & (R_min < 1.)
+    print("Largest error of the boundary: {:.2g} Ohm".format(np.max(np.abs(boundary.y[inside] - R_min[inside]))))
+
+    # map over loop gain x R_s x L_stray in one call
+    loop_gains = np.linspace(1, 30, 59)[:, None, None]
+    Rss = np.linspace(0, 0.5, 101)[None, :, None]
+    L_strays = np.geomspace(1e-6, 1e-3, 31)[None, None, :]
+    R_TES_min_stable = get_minimum_stable_resistance(loop_gains, tau0, Rss, L_strays)
+    print("Minimum stable R_TES map of shape {}, largest {:.3f} Ohm".format(R_TES_min_stable.shape, np.max(R_TES_min_stable)))
+
+
+if __name__ == "__main__":
+    local_main()
@@ -5,7 +5,8 @@ script to test stuff
 import numpy as np
 from matplotlib import pyplot as plt
 
-from circuits_functions import ZL, ZC, find_LC_resonant_frequency, series, find_resonant_freq, get_phase
+from circuits_functions import ZL, ZC, find_LC_resonant_frequency, series, find_resonant_freq, get_phase, \
+    find_resonant_freq_RLC
 
 pi = np.pi
 
@@ -26,17 +27,9 @@ def main():
     L = 60e-9 # henry
     
     omegas = np.linspace(4e6*2*pi, 6e6*2*pi, 1000) # Hertz
-    Z_mag_tot = np.empty(len(omegas), dtype=complex)
-    Z_phase_tot = np.empty(len(omegas), dtype=float)
-    
-    i=0
-    for omega in omegas:
-        Zl = ZL(L, omega)
-        Zc = ZC(C, omega)
-        Z_mag_tot[i] = np.abs( series(R, series(Zl, Zc) ) )
-        Z_phase_tot[i] = get_phase( series(R, series(Zl, Zc) ) )
-        
-        i=i+1
+    Z_tot = series(R, series(ZL(L, omegas), ZC(C, omegas)))
+    Z_mag_tot = np.abs(Z_tot)
+    Z_phase_tot = get_phase(Z_tot)
     
     
     print("Phase: ")
@@ -45,6 +38,7 @@ def main():
     f_res = find_resonant_freq(Z_mag_tot, freq_array=omegas/(2*pi), show_plot=True)
     
     print("Resonant frequency: ", f_res/1e6)
+    print("Resonant frequency (refined): ", find_resonant_freq_RLC(L, C, R)/1e6)
     
     
     # calculate cross talk based on Josh's paper